@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Compare loading a state from per-building files against a packed archive
+
+Run from the repository root after packing the state with
+`python -m sunrise.archive AK`:
+
+    PYTHONPATH=src python benchmarks/archive.py AK
+
+Only the I/O side of `City.make` is measured (mapping and slicing each
+building's vertices and indices), so OSPRay does not need to be available.
+"""
+
+import sunrise.archive
+
+import gc
+import os
+import pathlib
+import time
+
+import numpy as np
+
+
+# Number of memory mappings this process currently holds
+def count_mappings() -> int:
+    with open('/proc/self/maps') as f:
+        return sum(1 for _ in f)
+
+
+# Read every page of the arrays, like OSPRay does when it builds the BVH
+def touch(arrays) -> float:
+    total = 0.0
+    for position, index in arrays:
+        total += float(position['x'].sum()) + float(index['a'].sum())
+    return total
+
+
+def load_files(path: pathlib.Path, names: list[str]):
+    arrays = []
+    for name in names:
+        position, index = sunrise.archive.building_files(path, name)
+        arrays.append((
+            np.memmap(position, dtype=sunrise.archive.POSITION_DTYPE, mode='c'),
+            np.memmap(index, dtype=sunrise.archive.INDEX_DTYPE, mode='c'),
+        ))
+    return arrays
+
+
+def load_archive(path: pathlib.Path, names: list[str]):
+    archive = sunrise.archive.Archive(path)
+    return [archive.arrays(name) for name in names]
+
+
+def measure(label: str, load, path: pathlib.Path, names: list[str], *, do_touch: bool):
+    gc.collect()
+    before = count_mappings()
+
+    start = time.perf_counter()
+    arrays = load(path, names)
+    loaded = time.perf_counter() - start
+
+    if do_touch:
+        touch(arrays)
+    touched = time.perf_counter() - start
+
+    mappings = count_mappings() - before
+    print(f'{label:>8}: {len(names)} buildings, load {loaded*1e3:.1f} ms, '
+          f'load+touch {touched*1e3:.1f} ms, +{mappings} mappings')
+
+    del arrays
+    gc.collect()
+
+
+def main(*, state: str, data: pathlib.Path, limit: int | None, touch: bool):
+    packed = data / 'pack' / state
+    if not sunrise.archive.Archive.exists(packed):
+        raise SystemExit(f'No archive at {packed}; run `python -m sunrise.archive {state}` first')
+
+    names = sunrise.archive.Archive(packed).names
+    if limit is not None:
+        names = names[:limit]
+
+    measure('files', load_files, data / 'gen' / state, names, do_touch=touch)
+    measure('archive', load_archive, packed, names, do_touch=touch)
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('state')
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--touch', action='store_true', help='also read every page')
+    args = vars(parser.parse_args())
+
+    main(**args)
+
+
+if __name__ == '__main__':
+    cli()
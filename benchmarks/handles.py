@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Time to make an OSPRay Data of many instance handles
+
+Run from the repository root with OSPRay available:
+
+    SUNRISE_LIBOSPRAY_PATH=/path/to/libospray.so \
+    PYTHONPATH=src python benchmarks/handles.py --counts 10000,100000,1000000
+
+For each count N this makes N instances of one empty group, then times Data
+made from a Python list of the handles (every handle converted on the spot)
+against Data made from a HandleArray filled as the instances were created.
+The cost of filling the HandleArray is reported separately, as it is paid
+once per instance at creation rather than on every commit.
+"""
+
+import sunrise.scene
+
+import os
+import statistics
+import time
+
+
+def measure(function, *, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        data = function()
+        times.append(time.perf_counter() - start)
+        sunrise.scene.lib.ospRelease(data)
+    return statistics.median(times)
+
+
+def main(*, counts: list[int], runs: int):
+    lib = sunrise.scene.load_library(os.environ.get('SUNRISE_LIBOSPRAY_PATH', 'libospray.so'))
+    lib.ospInit(None, None)
+
+    group = lib.ospNewGroup()
+    lib.ospCommit(group)
+
+    print(f'{"handles":>9} {"record ms":>10} {"list ms":>9} {"array ms":>9} {"speedup":>8}')
+    for count in counts:
+        instances = [lib.ospNewInstance(group) for _ in range(count)]
+
+        start = time.perf_counter()
+        handles = sunrise.scene.HandleArray()
+        for instance in instances:
+            handles.append(instance)
+        record = time.perf_counter() - start
+
+        from_list = measure(lambda: sunrise.scene.Data(instances, type=lib.OSP_INSTANCE), runs=runs)
+        from_array = measure(lambda: sunrise.scene.Data(handles, type=lib.OSP_INSTANCE), runs=runs)
+        print(f'{count:>9} {record*1e3:>10.1f} {from_list*1e3:>9.1f} {from_array*1e3:>9.1f} '
+              f'{from_list/from_array:>7.1f}x')
+
+        for instance in instances:
+            lib.ospRelease(instance)
+
+    lib.ospRelease(group)
+    lib.ospShutdown()
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=lambda s: [int(c) for c in s.split(',')],
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = vars(parser.parse_args())
+
+    main(**args)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Frame time against the level-of-detail threshold
+
+Run from the repository root with OSPRay available:
+
+    SUNRISE_LIBOSPRAY_PATH=/path/to/libospray.so \
+    PYTHONPATH=src python benchmarks/lod.py --position 0,-6400,0
+
+For each threshold T the city switches to decimated meshes at T km from the
+camera and to boxes at 5*T km. T=inf keeps every cell at full resolution.
+The first frame after a change includes paging the cells in at their new
+level, so it is reported separately from the steady-state frames.
+"""
+
+import sunrise.scene
+import sunrise.model
+import sunrise.lod
+
+import math
+import os
+import pathlib
+import statistics
+import time
+
+import structlog
+
+
+def triangles(city: sunrise.scene.City) -> dict[int, int]:
+    counts = {lod: 0 for lod in sunrise.lod.LEVELS}
+    for cell in city.resident.values():
+        counts[cell.lod] += sum(len(building.index) for building in cell.buildings)
+    return counts
+
+
+def measure(scene: sunrise.scene.Scene, request: sunrise.model.RenderingRequest, *, frames: int):
+    start = time.perf_counter()
+    scene.render(request).release()
+    first = time.perf_counter() - start
+
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        scene.render(request).release()
+        times.append(time.perf_counter() - start)
+
+    return first, times
+
+
+def main(
+    *,
+    data: pathlib.Path,
+    thresholds: list[float],
+    position: tuple[float, float, float],
+    width: int,
+    height: int,
+    frames: int,
+):
+    lib = sunrise.scene.load_library(os.environ.get('SUNRISE_LIBOSPRAY_PATH', 'libospray.so'))
+    lib.ospInit(None, None)
+    lib.ospLoadModule(b'denoiser')
+
+    # Look straight down at the surface from `position`
+    norm = math.sqrt(sum(x * x for x in position))
+    request = sunrise.model.RenderingRequest(
+        width=width,
+        height=height,
+        tile=('0of1', '0of1'),
+        position=position,
+        direction=tuple(-x / norm for x in position),
+        up=(0.0, 0.0, 1.0),
+        samples=1,
+        hour=12.0,
+        light='distant',
+    )
+
+    with sunrise.scene.City(path=data) as city, \
+         sunrise.scene.Scene(what=city) as scene:
+        scene.logger = structlog.get_logger('benchmark')
+
+        print(f'{"threshold":>10} {"first ms":>9} {"median ms":>10} {"p90 ms":>8} '
+              f'{"full tris":>10} {"decim tris":>11} {"box tris":>9}')
+        for threshold in thresholds:
+            city.lod_distances = (threshold, threshold * 5)
+            first, times = measure(scene, request, frames=frames)
+
+            counts = triangles(city)
+            p90 = sorted(times)[int(0.9 * (len(times) - 1))]
+            print(f'{threshold:>10} {first*1e3:>9.1f} {statistics.median(times)*1e3:>10.1f} '
+                  f'{p90*1e3:>8.1f} {counts[sunrise.lod.FULL]:>10} '
+                  f'{counts[sunrise.lod.DECIMATED]:>11} {counts[sunrise.lod.BOX]:>9}')
+
+    lib.ospShutdown()
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--thresholds', type=lambda s: [float(t) for t in s.split(',')],
+                        default=[math.inf, 10.0, 2.0, 0.5, 0.0])
+    parser.add_argument('--position', type=lambda s: tuple(float(x) for x in s.split(',')),
+                        required=True, help='camera position x,y,z in km')
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--frames', type=int, default=20)
+    args = vars(parser.parse_args())
+
+    main(**args)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Time to pick buildings under screen points against time to render a frame
+
+Run from the repository root with OSPRay available:
+
+    SUNRISE_LIBOSPRAY_PATH=/path/to/libospray.so \
+    PYTHONPATH=src python benchmarks/pick.py --position 0,-6400,0
+
+Picks run on a scene that has already rendered the view once, as a pooled
+scene answering /api/v1/pick would have. Single picks are timed one point at
+a time; batches pick `--batch` random points per call.
+"""
+
+import sunrise.scene
+import sunrise.model
+
+import math
+import os
+import pathlib
+import random
+import statistics
+import time
+
+import structlog
+
+
+def main(
+    *,
+    data: pathlib.Path,
+    position: tuple[float, float, float],
+    width: int,
+    height: int,
+    picks: int,
+    batch: int,
+):
+    lib = sunrise.scene.load_library(os.environ.get('SUNRISE_LIBOSPRAY_PATH', 'libospray.so'))
+    lib.ospInit(None, None)
+    lib.ospLoadModule(b'denoiser')
+
+    # Look straight down at the surface from `position`
+    norm = math.sqrt(sum(x * x for x in position))
+    view = dict(
+        width=width,
+        height=height,
+        position=position,
+        direction=tuple(-x / norm for x in position),
+        up=(0.0, 0.0, 1.0),
+    )
+    request = sunrise.model.RenderingRequest(
+        **view,
+        tile=('0of1', '0of1'),
+        samples=1,
+        hour=12.0,
+        light='distant',
+    )
+
+    def points(n):
+        return tuple((random.uniform(0, width), random.uniform(0, height)) for _ in range(n))
+
+    with sunrise.scene.City(path=data) as city, \
+         sunrise.scene.Scene(what=city) as scene:
+        scene.logger = structlog.get_logger('benchmark')
+
+        frames = []
+        for _ in range(5):
+            start = time.perf_counter()
+            scene.render(request).release()
+            frames.append(time.perf_counter() - start)
+
+        single, hits = [], 0
+        for _ in range(picks):
+            start = time.perf_counter()
+            result, = scene.pick(sunrise.model.PickRequest(**view, points=points(1)))
+            single.append(time.perf_counter() - start)
+            hits += result.building is not None
+
+        batches = []
+        for _ in range(max(1, picks // batch)):
+            start = time.perf_counter()
+            scene.pick(sunrise.model.PickRequest(**view, points=points(batch)))
+            batches.append(time.perf_counter() - start)
+
+    print(f'frame         {statistics.median(frames)*1e3:>8.2f} ms')
+    print(f'single pick   {statistics.median(single)*1e3:>8.2f} ms  ({hits}/{picks} on a building)')
+    print(f'batch of {batch:<4} {statistics.median(batches)*1e3:>8.2f} ms  '
+          f'({statistics.median(batches)/batch*1e6:.1f} us per point)')
+
+    lib.ospShutdown()
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--position', type=lambda s: tuple(float(x) for x in s.split(',')),
+                        required=True, help='camera position x,y,z in km')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--picks', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=256)
+    args = vars(parser.parse_args())
+
+    main(**args)
+
+
+if __name__ == '__main__':
+    cli()
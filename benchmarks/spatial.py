@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Build time and per-query latency of the building spatial index
+
+Run from the repository root, either on synthetic boxes scattered over a
+patch of the earth's surface:
+
+    PYTHONPATH=src python benchmarks/spatial.py --count 1000000
+
+or on the bounds of a packed state:
+
+    PYTHONPATH=src python benchmarks/spatial.py --state AK
+
+OSPRay is not needed.
+"""
+
+import sunrise.archive
+import sunrise.spatial
+
+import pathlib
+import statistics
+import time
+
+import numpy as np
+
+
+# `count` building-sized boxes (~20 m) within ~100 km of a point on a 6371 km
+# sphere, in the same km coordinates as the generated meshes
+def synthetic(count: int, *, seed: int=0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    lat = np.radians(61.2 + rng.uniform(-0.5, 0.5, count))
+    lng = np.radians(-149.9 + rng.uniform(-1.0, 1.0, count))
+    centre = 6371.0 * np.stack([
+        np.cos(lat) * np.cos(lng),
+        np.cos(lat) * np.sin(lng),
+        np.sin(lat),
+    ], axis=1)
+    half = rng.uniform(0.005, 0.02, (count, 3))
+    return (centre - half).astype('f4'), (centre + half).astype('f4')
+
+
+def timed(label: str, queries: int, query) -> list:
+    times = []
+    sizes = []
+    for i in range(queries):
+        start = time.perf_counter()
+        found = query(i)
+        times.append(time.perf_counter() - start)
+        sizes.append(len(found))
+
+    times.sort()
+    print(f'{label:>8}: median {statistics.median(times)*1e6:8.1f} us, '
+          f'p99 {times[int(0.99 * (len(times) - 1))]*1e6:8.1f} us, '
+          f'mean results {statistics.mean(sizes):.1f}')
+
+
+def main(*, state: str | None, data: pathlib.Path, count: int, queries: int):
+    if state is not None:
+        table = sunrise.archive.Archive(data / 'pack' / state).table
+        lo, hi = table['lo'], table['hi']
+    else:
+        lo, hi = synthetic(count)
+
+    start = time.perf_counter()
+    index = sunrise.spatial.SpatialIndex.of(lo, hi)
+    print(f'built index over {len(lo)} boxes ({len(index.nodes)} nodes) '
+          f'in {(time.perf_counter() - start)*1e3:.0f} ms')
+
+    rng = np.random.default_rng(1)
+    centres = ((lo + hi) / 2)[rng.integers(0, len(lo), queries)].astype('f8')
+    outward = centres / np.linalg.norm(centres, axis=1)[:, None]
+
+    # 200 m boxes around buildings
+    timed('box', queries, lambda i: index.box(centres[i] - 0.1, centres[i] + 0.1))
+
+    # Straight down from 1 km up
+    timed('ray', queries, lambda i: index.ray(centres[i] + outward[i], -outward[i]))
+
+    timed('nearest', queries, lambda i: index.nearest(centres[i], 10))
+
+    # A narrow camera 5 km above, looking down
+    planes = [
+        sunrise.spatial.frustum_planes(
+            centres[i] + 5 * outward[i],
+            -outward[i],
+            (0.0, 0.0, 1.0),
+            fovy=10.0,
+        )
+        for i in range(queries)
+    ]
+    timed('frustum', queries, lambda i: index.frustum(planes[i]))
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--state', default=None)
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--count', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = vars(parser.parse_args())
+
+    main(**args)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Server start time from `data/` against start time from a snapshot
+
+Run from the repository root with OSPRay available, after writing a
+snapshot with `python -m sunrise.snapshot AK --position x,y,z`:
+
+    SUNRISE_LIBOSPRAY_PATH=/path/to/libospray.so \
+    PYTHONPATH=src python benchmarks/startup.py --snapshot data/snapshot
+
+Each start builds the city and `--scenes` scenes the way the server does and
+then renders one frame of the snapshot's view, which is when the first
+request would be answered. Every start runs in its own process; drop the
+page cache between runs (`echo 3 > /proc/sys/vm/drop_caches`) to measure a
+truly cold disk rather than a cold process.
+"""
+
+import sunrise.scene
+import sunrise.model
+import sunrise.snapshot
+
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+import structlog
+
+
+def start(*, data: pathlib.Path, snapshot: pathlib.Path | None, view: dict, scenes: int) -> dict[str, float]:
+    lib = sunrise.scene.load_library(os.environ.get('SUNRISE_LIBOSPRAY_PATH', 'libospray.so'))
+    lib.ospInit(None, None)
+    lib.ospLoadModule(b'denoiser')
+
+    request = sunrise.model.RenderingRequest(**{
+        key: tuple(value) if isinstance(value, list) else value
+        for key, value in view.items()
+    })
+
+    times = {}
+    begin = time.perf_counter()
+
+    city = sunrise.scene.City(
+        path=data,
+        snapshot=sunrise.snapshot.Snapshot(snapshot) if snapshot is not None else None,
+    )
+    city.make()
+    times['city'] = time.perf_counter() - begin
+
+    pool = []
+    for _ in range(scenes):
+        scene = sunrise.scene.Scene(what=city)
+        scene.make()
+        scene.logger = structlog.get_logger('benchmark')
+        if snapshot is not None:
+            scene.setup(request)
+        pool.append(scene)
+    times['scenes'] = time.perf_counter() - begin - times['city']
+
+    ready = time.perf_counter()
+    pool[0].render(request).release()
+    times['first frame'] = time.perf_counter() - ready
+    times['total'] = time.perf_counter() - begin
+
+    for scene in pool:
+        scene.close()
+    city.close()
+    lib.ospShutdown()
+    return times
+
+
+def main(*, data: pathlib.Path, snapshot: pathlib.Path, scenes: int, runs: int, child: str | None):
+    view = sunrise.snapshot.Snapshot(snapshot).request()
+    if view is None:
+        sys.exit(f'{snapshot} has no warm-up view; write it with --position')
+
+    if child is not None:
+        times = start(
+            data=data,
+            snapshot=snapshot if child == 'warm' else None,
+            view=view,
+            scenes=scenes,
+        )
+        print(json.dumps(times))
+        return
+
+    results = {}
+    for mode in ('cold', 'warm'):
+        for _ in range(runs):
+            output = subprocess.run([
+                sys.executable, __file__,
+                '--data', str(data),
+                '--snapshot', str(snapshot),
+                '--scenes', str(scenes),
+                '--child', mode,
+            ], check=True, capture_output=True, text=True).stdout
+            times = json.loads(output.strip().splitlines()[-1])
+            for key, value in times.items():
+                results.setdefault((mode, key), []).append(value)
+
+    print(f'{"":>6} {"city s":>8} {"scenes s":>9} {"first frame s":>14} {"total s":>8}')
+    for mode in ('cold', 'warm'):
+        print(f'{mode:>6}', *(
+            f'{statistics.median(results[mode, key]):>{width}.2f}'
+            for key, width in (('city', 8), ('scenes', 9), ('first frame', 14), ('total', 8))
+        ))
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--snapshot', type=pathlib.Path, default=pathlib.Path('data/snapshot'))
+    parser.add_argument('--scenes', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--child', choices=('cold', 'warm'), default=None,
+                        help=argparse.SUPPRESS)
+    args = vars(parser.parse_args())
+
+    main(**args)
+
+
+if __name__ == '__main__':
+    cli()
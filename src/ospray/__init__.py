@@ -40,9 +40,11 @@ except NameError:
 
 __all__ = [
     'load_library',
+    'Arena',
 ]
 
 
+import array
 import ctypes
 import os
 
@@ -74,8 +76,10 @@ def load_library(name: str) -> ctypes.CDLL:
     def alias(name: str, ctype: type, /):
         setattr(lib, name, ctype)
 
-    # def struct():
-    #     pass
+    def struct(name: str, /, *fields: tuple[str, type]):
+        setattr(lib, name, type(name, (ctypes.Structure,), {
+            '_fields_': list(fields),
+        }))
 
 
     #--- Top-Level Enums
@@ -395,8 +399,27 @@ def load_library(name: str) -> ctypes.CDLL:
         lib.OSPWorld,
     )
 
-    # struct('OSPPickResult')
-    # declare('ospPick')
+    # `instance` and `model` are new references when `hasHit` is set; the
+    # caller releases them
+    struct('OSPPickResult',
+        ('hasHit', ctypes.c_int),
+        ('worldPosition', ctypes.c_float * 3),
+        ('instance', lib.OSPInstance),
+        ('model', lib.OSPGeometricModel),
+        ('primID', ctypes.c_uint32),
+    )
+
+    declare('ospPick',
+        None,
+
+        ctypes.POINTER(lib.OSPPickResult),
+        lib.OSPFrameBuffer,
+        lib.OSPRenderer,
+        lib.OSPCamera,
+        lib.OSPWorld,
+        ctypes.c_float,
+        ctypes.c_float,
+    )
 
 
     #--- OSPFrameBuffer
@@ -492,19 +515,17 @@ def load_library(name: str) -> ctypes.CDLL:
         lib.OSPWorld,
     )
 
-    # struct('OSPBounds')
-    # declare('ospGetBounds')
+    # World-space bounds of a committed world, instance or group
+    struct('OSPBounds',
+        ('lower', ctypes.c_float * 3),
+        ('upper', ctypes.c_float * 3),
+    )
 
-    # lib.OSPBounds = type('OSPBounds', (ctypes.Structure,), {
-    #     '_fields_': [
-    #         ('xlo', ctypes.c_float),
-    #         ('ylo', ctypes.c_float),
-    #         ('zlo', ctypes.c_float),
-    #         ('xhi', ctypes.c_float),
-    #         ('yhi', ctypes.c_float),
-    #         ('zhi', ctypes.c_float),
-    #     ],
-    # })
+    declare('ospGetBounds',
+        lib.OSPBounds,
+
+        lib.OSPObject,
+    )
 
 
     #--- OSPLight
@@ -717,9 +738,89 @@ def load_library(name: str) -> ctypes.CDLL:
         ctypes.c_uint64,
     )
 
+
+    #--- Handles by Address
+
+    # ospRetain and ospRelease again, taking the handle's address as an int,
+    # so an Arena can release what it stored without rebuilding pointers
+    for symbol in ('ospRetain', 'ospRelease'):
+        function = lib[symbol]
+        function.restype = None
+        function.argtypes = (ctypes.c_void_p,)
+        setattr(lib, f'{symbol}Address', function)
+
     return lib
 
 
+# The OSPRay handles one object owns, as two compact arrays of addresses and
+# OSPDataTypes rather than a release callback per handle. `own` takes over a
+# reference the caller already has (as from ospNew*), `retain` adds one, and
+# `close` releases everything in the reverse order it was owned.
+class Arena:
+    __slots__ = ('lib', '_handles', '_types')
+
+    _ADDRESS = 'Q' if ctypes.sizeof(ctypes.c_void_p) == 8 else 'L'
+
+    def __init__(self, lib: ctypes.CDLL):
+        self.lib = lib
+        self._handles = array.array(self._ADDRESS)
+        self._types = array.array('I')
+
+    def own(self, handle, type: int | None=None, /):
+        address = ctypes.cast(handle, ctypes.c_void_p).value
+        if not address:
+            raise ValueError('Cannot own a null handle')
+
+        self._handles.append(address)
+        self._types.append(self.lib.OSP_OBJECT if type is None else type)
+        return handle
+
+    def retain(self, handle, type: int | None=None, /):
+        self.lib.ospRetain(handle)
+        return self.own(handle, type)
+
+    # Give back one reference to `handle` before the arena closes
+    def release(self, handle, /):
+        address = ctypes.cast(handle, ctypes.c_void_p).value
+        try:
+            i = self._handles.index(address)
+        except ValueError:
+            raise KeyError(f'Handle {address:#x} is not owned by this arena') from None
+
+        del self._handles[i]
+        del self._types[i]
+        self.lib.ospReleaseAddress(address)
+
+    def close(self):
+        handles = self._handles
+        self._handles = array.array(self._ADDRESS)
+        self._types = array.array('I')
+
+        release = self.lib.ospReleaseAddress
+        for address in reversed(handles):
+            release(address)
+
+    # How many handles are owned, per OSPDataType
+    def counts(self) -> dict[int, int]:
+        counts = {}
+        for type in self._types:
+            counts[type] = counts.get(type, 0) + 1
+        return counts
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def __contains__(self, handle) -> bool:
+        return ctypes.cast(handle, ctypes.c_void_p).value in self._handles
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self._handles.itemsize * len(self._handles) +
+            self._types.itemsize * len(self._types)
+        )
+
+
 if __name__ == '__main__':
     lib = load_library('libospray.so')
     error = lib.ospInit(None, None)
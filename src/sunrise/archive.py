@@ -0,0 +1,456 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+import sunrise.arrayfile, sunrise.lod, sunrise.spatial
+
+import hashlib
+import os
+import pathlib
+import typing
+
+import numpy as np
+
+
+__all__ = [
+    'POSITION_DTYPE',
+    'INDEX_DTYPE',
+    'BUILDING_DTYPE',
+    'PROTOTYPE_DTYPE',
+    'Archive',
+    'pack',
+]
+
+
+POSITION_DTYPE = np.dtype([
+    ('x', 'f4'),
+    ('y', 'f4'),
+    ('z', 'f4'),
+])
+
+INDEX_DTYPE = np.dtype([
+    ('a', 'u4'),
+    ('b', 'u4'),
+    ('c', 'u4'),
+])
+
+# One row per building. Offsets and counts are in elements of the vertex and
+# index blobs; indices are local to the building's own vertices.
+BUILDING_DTYPE = np.dtype([
+    ('name', 'S128'),
+    ('vertex_offset', '<u8'),
+    ('vertex_count', '<u8'),
+    ('index_offset', '<u8'),
+    ('index_count', '<u8'),
+    ('lo', '<f4', (3,)),
+    ('hi', '<f4', (3,)),
+])
+
+# One row per building, parallel to the building table. A building whose
+# mesh matches an earlier one up to translation and per-axis scale shares
+# that building's vertices and indices (its table row points at the same
+# slices) and is placed with `position * scale + offset`. A prototype points
+# at its own row with an identity transform.
+PROTOTYPE_DTYPE = np.dtype([
+    ('prototype', '<u8'),
+    ('scale', '<f4', (3,)),
+    ('offset', '<f4', (3,)),
+])
+
+# Two meshes are the same prototype when, once the prototype is scaled and
+# moved onto the other mesh, every vertex lands within this many km of where
+# it was. Vertices are float32 km from the earth's centre, where one unit in
+# the last place is ~0.5 m, so this only forgives rounding noise.
+DEDUP_TOLERANCE = 2 * float(np.spacing(np.float32(6400.0)))
+
+POSITION_FILE = 'vertex.position.vec3f[].bin'
+INDEX_FILE = 'index.vec3ui[].bin'
+BUILDING_FILE = 'building.table[].bin'
+PROTOTYPE_FILE = 'prototype.table[].bin'
+
+sunrise.arrayfile.register(BUILDING_FILE, BUILDING_DTYPE)
+sunrise.arrayfile.register(PROTOTYPE_FILE, PROTOTYPE_DTYPE)
+
+
+# The (position, index, table, prototype) files of one level of detail. The
+# full meshes keep the unprefixed names so archives packed before LODs
+# existed still open.
+def level_files(lod: int, /) -> tuple[str, str, str, str]:
+    if lod == sunrise.lod.FULL:
+        return POSITION_FILE, INDEX_FILE, BUILDING_FILE, PROTOTYPE_FILE
+    return (
+        f'lod{lod}.{POSITION_FILE}',
+        f'lod{lod}.{INDEX_FILE}',
+        f'lod{lod}.{BUILDING_FILE}',
+        f'lod{lod}.{PROTOTYPE_FILE}',
+    )
+
+
+# A digest of a mesh's size and triangle list. Meshes can only be copies of
+# each other if their topology matches exactly.
+def mesh_topology(position: np.ndarray, index: np.ndarray, /) -> bytes:
+    digest = hashlib.sha256()
+    digest.update(np.array([len(position), len(index)], dtype='u8').tobytes())
+    digest.update(np.ascontiguousarray(index).tobytes())
+    return digest.digest()
+
+
+# A mesh's vertices mapped into its own bounding box, so meshes that only
+# differ by translation and per-axis scale coincide, plus the box itself
+def normalise(position: np.ndarray, /) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    xyz = position.view('f4').reshape(-1, 3).astype('f8')
+    lo = xyz.min(axis=0)
+    extent = xyz.max(axis=0) - lo
+    extent[extent == 0] = 1.0
+    return (xyz - lo) / extent, lo, extent
+
+
+# The per-building files written by the mesh generator for `name`
+def building_files(path: pathlib.Path, name: str, /) -> tuple[pathlib.Path, pathlib.Path]:
+    return (
+        path / f'{name}.mesh.vec3f[].vertex.position.bin',
+        path / f'{name}.mesh.vec3ui[].vertex.index.bin',
+    )
+
+
+# Size of a level that is derived at load time instead of packed. Boxes have
+# a fixed size; decimation is only bounded by the full mesh.
+def estimate_nbytes(full: np.ndarray, lod: int, /) -> np.ndarray:
+    if lod == sunrise.lod.BOX:
+        return np.full_like(full, 8 * POSITION_DTYPE.itemsize + 12 * INDEX_DTYPE.itemsize)
+    return full
+
+
+# Appends one level's meshes to its blobs and remembers the table rows. With
+# `dedup`, a mesh that matches an earlier prototype is not written again.
+# `lossy` is an opt-in looser match, as a fraction of the mesh's extent along
+# each axis, that merges meshes which visibly differ.
+class _LevelWriter:
+    def __init__(self, dst: pathlib.Path, lod: int, *, dedup: bool, tolerance: float, lossy: float | None=None):
+        self.files = [dst / f'{file}.tmp' for file in level_files(lod)]
+        self.final = [dst / file for file in level_files(lod)]
+        self.positions = sunrise.arrayfile.Writer(self.files[0], POSITION_DTYPE)
+        self.indices = sunrise.arrayfile.Writer(self.files[1], INDEX_DTYPE)
+        self.dedup = dedup
+        self.tolerance = tolerance
+        self.lossy = lossy
+
+        self.rows = []
+        self.prototypes = []
+        self.vertex_offset = 0
+        self.index_offset = 0
+
+        # topology -> (row, normalised vertices, lo, extent) of each prototype
+        # written so far with that topology
+        self._seen: dict[bytes, list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]] = {}
+
+    def _match(self, position: np.ndarray, index: np.ndarray) -> tuple[int, np.ndarray, np.ndarray] | None:
+        candidates = self._seen.setdefault(mesh_topology(position, index), [])
+        normalised, mesh_lo, mesh_extent = normalise(position)
+        for prototype, prototype_normalised, prototype_lo, prototype_extent in candidates:
+            error = np.abs(normalised - prototype_normalised)
+            if (
+                (error * mesh_extent).max() <= self.tolerance or
+                (self.lossy is not None and error.max() <= self.lossy)
+            ):
+                scale = mesh_extent / prototype_extent
+                return prototype, scale, mesh_lo - prototype_lo * scale
+
+        candidates.append((len(self.rows), normalised, mesh_lo, mesh_extent))
+        return None
+
+    def write(self, name: str, position: np.ndarray, index: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+        row = len(self.rows)
+        if self.dedup and len(position) and len(index):
+            match = self._match(position, index)
+            if match is not None:
+                prototype = match[0]
+                self.rows.append((
+                    name.encode('utf-8'),
+                    *self.rows[prototype][1:5],
+                    lo, hi,
+                ))
+                self.prototypes.append(match)
+                return
+
+        self.positions.write(position)
+        self.indices.write(index)
+
+        self.rows.append((
+            name.encode('utf-8'),
+            self.vertex_offset, len(position),
+            self.index_offset, len(index),
+            lo, hi,
+        ))
+        self.prototypes.append((row, np.ones(3, 'f4'), np.zeros(3, 'f4')))
+        self.vertex_offset += len(position)
+        self.index_offset += len(index)
+
+    def finish(self):
+        self.positions.close()
+        self.indices.close()
+        sunrise.arrayfile.save(self.files[2], np.array(self.rows, dtype=BUILDING_DTYPE))
+        sunrise.arrayfile.save(self.files[3], np.array(self.prototypes, dtype=PROTOTYPE_DTYPE))
+
+    # Buildings per unique mesh written
+    def dedup_ratio(self) -> float:
+        unique = len({prototype for prototype, _, _ in self.prototypes})
+        return len(self.prototypes) / unique if unique else 1.0
+
+    def commit(self):
+        for tmp, final in zip(self.files, self.final):
+            os.replace(tmp, final)
+
+
+# Concatenate the per-building meshes of one state into a packed archive:
+# one vertex blob, one index blob and a table of offsets, counts and bounds
+# per level of detail. Buildings are streamed one at a time so memory use
+# stays flat. Every level has a row for every building, in the same order.
+# Returns the dedup ratio (buildings per unique mesh) of each level.
+#
+# Dedup only finds copies that differ by a translation and a per-axis scale
+# along the earth-centred axes, since that is all a prototype row can store.
+# Copies rotated about their own up axis never match. Copies far apart on
+# the globe don't match either, because their local up directions differ:
+# 10 km apart the tilt moves the top of a 50 m building by ~8 cm, within
+# DEDUP_TOLERANCE, but across a state it is metres. Matching in each
+# building's east/north/up frame would need a rotation per prototype row, so
+# the ratio reported here is a lower bound on what real data could share.
+def pack(
+    src: pathlib.Path,
+    dst: pathlib.Path,
+    names: typing.Iterable[str],
+    /,
+    *,
+    lods: typing.Iterable[int]=sunrise.lod.LEVELS,
+    dedup: bool=True,
+    tolerance: float=DEDUP_TOLERANCE,
+    lossy: float | None=None,
+    progress: typing.Callable[[int], None] | None=None,
+) -> dict[int, float]:
+    dst.mkdir(parents=True, exist_ok=True)
+
+    lods = sorted(set(lods) | {sunrise.lod.FULL})
+    writers = {
+        lod: _LevelWriter(dst, lod, dedup=dedup, tolerance=tolerance, lossy=lossy)
+        for lod in lods
+    }
+
+    for i, name in enumerate(names):
+        position_path, index_path = building_files(src, name)
+        position = np.array(sunrise.arrayfile.read(position_path, POSITION_DTYPE))
+        index = np.array(sunrise.arrayfile.read(index_path, INDEX_DTYPE))
+
+        xyz = position.view(('f4', 3))
+        if len(xyz):
+            lo, hi = xyz.min(axis=0), xyz.max(axis=0)
+        else:
+            lo, hi = np.zeros(3, 'f4'), np.zeros(3, 'f4')
+
+        for lod, writer in writers.items():
+            if lod == sunrise.lod.FULL or len(position) == 0 or len(index) == 0:
+                writer.write(name, position, index, lo, hi)
+            else:
+                writer.write(name, *sunrise.lod.level(position, index, lod), lo, hi)
+
+        if progress is not None:
+            progress(i + 1)
+
+    for writer in writers.values():
+        writer.finish()
+
+    # A BVH over the building bounds, for spatial queries without a scan
+    full = np.array(writers[sunrise.lod.FULL].rows, dtype=BUILDING_DTYPE)
+    sunrise.spatial.SpatialIndex.of(full['lo'], full['hi']).save(dst)
+
+    # Only expose the archive once every part of it is complete. The full
+    # level's table goes last since it is what marks an archive as present.
+    for lod in reversed(lods):
+        writers[lod].commit()
+
+    return {lod: writer.dedup_ratio() for lod, writer in writers.items()}
+
+
+# One level of detail of an archive as two shared memmaps and its table
+class _Level(typing.NamedTuple):
+    position: np.ndarray
+    index: np.ndarray
+    table: np.ndarray
+    prototypes: np.ndarray
+
+    @classmethod
+    def open(cls, path: pathlib.Path, lod: int) -> _Level:
+        position, index, table, prototypes = level_files(lod)
+        table = np.array(sunrise.arrayfile.read(path / table, BUILDING_DTYPE))
+
+        # Archives packed without dedup: every building is its own prototype
+        if (path / prototypes).exists():
+            prototypes = np.array(sunrise.arrayfile.read(path / prototypes, PROTOTYPE_DTYPE))
+        else:
+            prototypes = np.zeros(len(table), dtype=PROTOTYPE_DTYPE)
+            prototypes['prototype'] = np.arange(len(table))
+            prototypes['scale'] = 1.0
+
+        return cls(
+            position=sunrise.arrayfile.read(path / position, POSITION_DTYPE, mode='c'),
+            index=sunrise.arrayfile.read(path / index, INDEX_DTYPE, mode='c'),
+            table=table,
+            prototypes=prototypes,
+        )
+
+
+# A packed archive opened as a few shared memmaps per level of detail. Each
+# building's vertices and indices are slices of the shared blobs, so opening
+# the whole state costs the same mappings no matter how many buildings it
+# holds.
+class Archive:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+        self.levels = {
+            lod: _Level.open(path, lod)
+            for lod in sunrise.lod.LEVELS
+            if (path / level_files(lod)[2]).exists()
+        }
+
+        full = self.levels[sunrise.lod.FULL]
+        self.position = full.position
+        self.index = full.index
+        self.table = full.table
+
+        self._rows = {
+            name.decode('utf-8'): i
+            for i, name in enumerate(self.table['name'])
+        }
+
+        # Archives packed before the index existed get one built in memory
+        if sunrise.spatial.SpatialIndex.exists(path):
+            self.spatial = sunrise.spatial.SpatialIndex.open(path, self.table['lo'], self.table['hi'])
+        else:
+            self.spatial = sunrise.spatial.SpatialIndex.of(self.table['lo'], self.table['hi'])
+
+    @staticmethod
+    def exists(path: pathlib.Path) -> bool:
+        return (path / BUILDING_FILE).exists()
+
+    # Every file that makes up the archive at `path`
+    @staticmethod
+    def files(path: pathlib.Path) -> list[pathlib.Path]:
+        names = [
+            *(file for lod in sunrise.lod.LEVELS for file in level_files(lod)),
+            sunrise.spatial.NODE_FILE,
+            sunrise.spatial.ITEM_FILE,
+        ]
+        return [path / name for name in names if (path / name).exists()]
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._rows)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, name: str):
+        return name in self._rows
+
+    def has_level(self, lod: int) -> bool:
+        return lod in self.levels
+
+    # The vertex and index arrays of one building, as views into the blobs.
+    # For a deduplicated building these are its prototype's, see prototype().
+    def arrays(self, name: str, lod: int=sunrise.lod.FULL) -> tuple[np.ndarray, np.ndarray]:
+        level = self.levels[lod]
+        row = level.table[self._rows[name]]
+
+        vertex_offset = int(row['vertex_offset'])
+        index_offset = int(row['index_offset'])
+        return (
+            level.position[vertex_offset:vertex_offset + int(row['vertex_count'])],
+            level.index[index_offset:index_offset + int(row['index_count'])],
+        )
+
+    # The prototype a building's mesh is shared with at level `lod`, and the
+    # per-axis scale and offset that place the prototype's mesh over it
+    def prototype(self, name: str, lod: int=sunrise.lod.FULL) -> tuple[str, np.ndarray, np.ndarray]:
+        level = self.levels[lod]
+        row = level.prototypes[self._rows[name]]
+        prototype = level.table[int(row['prototype'])]['name'].decode('utf-8')
+        return prototype, row['scale'], row['offset']
+
+    # Approximate resident bytes of every building's mesh at level `lod`.
+    # Deduplicated buildings cost nothing beyond their prototype.
+    def nbytes(self, lod: int=sunrise.lod.FULL) -> np.ndarray:
+        level = self.levels[lod]
+        unique = level.prototypes['prototype'] == np.arange(len(level.table))
+        return np.where(
+            unique,
+            level.table['vertex_count'] * POSITION_DTYPE.itemsize
+            + level.table['index_count'] * INDEX_DTYPE.itemsize,
+            0,
+        )
+
+    # Approximate resident bytes of every building at every level of detail,
+    # one column per level, estimating the levels that were not packed
+    def sizes(self) -> np.ndarray:
+        full = self.nbytes()
+        return np.stack([
+            self.nbytes(lod) if self.has_level(lod) else estimate_nbytes(full, lod)
+            for lod in sunrise.lod.LEVELS
+        ], axis=1)
+
+    # Buildings per unique mesh at level `lod`
+    def dedup_ratio(self, lod: int=sunrise.lod.FULL) -> float:
+        prototypes = self.levels[lod].prototypes['prototype']
+        unique = len(np.unique(prototypes))
+        return len(prototypes) / unique if unique else 1.0
+
+    def bounds(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        row = self.table[self._rows[name]]
+        return row['lo'], row['hi']
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Pack per-building meshes into one archive per state',
+    )
+    parser.add_argument('states', nargs='+', help='e.g. AK')
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--no-lods', dest='lods', action='store_false',
+                        help='only pack the full meshes')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false',
+                        help='store every mesh even if it repeats an earlier one')
+    parser.add_argument('--tolerance', type=float, default=DEDUP_TOLERANCE,
+                        help='vertex tolerance for dedup, in km')
+    parser.add_argument('--lossy', type=float, default=None,
+                        help='also merge meshes whose vertices differ by up to this '
+                             'fraction of mesh extent (visibly changes buildings)')
+    args = parser.parse_args()
+
+    for state in args.states:
+        names = sorted(os.listdir(args.data / 'pre' / state))
+        src = args.data / 'gen' / state
+        dst = args.data / 'pack' / state
+
+        with auto.tqdm.tqdm(total=len(names), desc=state) as bar:
+            ratios = pack(
+                src,
+                dst,
+                names,
+                lods=sunrise.lod.LEVELS if args.lods else (sunrise.lod.FULL,),
+                dedup=args.dedup,
+                tolerance=args.tolerance,
+                lossy=args.lossy,
+                progress=lambda i: bar.update(1),
+            )
+
+        print(f'Packed {len(names)} buildings from {src} into {dst}')
+        for lod, ratio in ratios.items():
+            print(f'  lod {lod}: {ratio:.2f} buildings per unique mesh')
+
+
+if __name__ == '__main__':
+    cli()
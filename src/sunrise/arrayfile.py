@@ -0,0 +1,418 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+
+import ast
+import concurrent.futures
+import os
+import pathlib
+import re
+import struct
+import typing
+import zlib
+
+import numpy as np
+
+
+__all__ = [
+    'MAGIC',
+    'VERSION',
+    'ALIGNMENT',
+    'Header',
+    'Writer',
+    'header',
+    'is_container',
+    'read',
+    'save',
+    'verify',
+    'infer_dtype',
+    'convert',
+    'register',
+]
+
+
+# Every array file starts with a fixed little-endian header
+#
+#   magic        4s   b'SRAF'
+#   version      u16
+#   ndim         u16
+#   alignment    u32  of the payload offset, in bytes
+#   offset       u32  where the payload starts; a multiple of alignment
+#   descr_size   u32
+#   payload_size u64
+#   payload_crc  u32  zlib.crc32 of the payload
+#   header_crc   u32  zlib.crc32 of the header up to `offset`, with this
+#                     field zeroed
+#
+# followed by the shape (ndim u64s), the dtype as the repr of its NumPy
+# descr, and zero padding up to `offset`. The payload is the C-order array.
+MAGIC = b'SRAF'
+VERSION = 1
+ALIGNMENT = 64
+
+_FIXED = struct.Struct('<4sHHIIIQII')
+_HEADER_CRC = _FIXED.size - 4
+
+# Files that still use scene.Read's old header: a u32 count N, then N u32
+# dimensions, then the raw array
+_LEGACY_HEADER = re.compile(r'\.texture2d\.')
+
+# Component types in the generator's file names, e.g. `vec3f[]` or `uint[]`
+_TYPES = {
+    'f': '<f4',
+    'i': '<i4',
+    'ui': '<u4',
+    'uc': 'u1',
+    'float': '<f4',
+    'int': '<i4',
+    'uint': '<u4',
+    'uchar': 'u1',
+}
+_VEC = re.compile(r'(?:^|\.)vec([234])(f|i|ui|uc)(?:\[\])?(?:\.|$)')
+_SCALAR = re.compile(r'(?:^|\.)(float|int|uint|uchar)(?:\[\])?(?:\.|$)')
+
+# Dtypes of files whose names do not spell them out, such as the archive
+# tables; see register
+_REGISTERED: dict[str, np.dtype] = {}
+
+
+class Header(typing.NamedTuple):
+    version: int
+    dtype: np.dtype
+    shape: tuple[int, ...]
+    alignment: int
+    offset: int
+    payload_size: int
+    payload_crc: int
+
+
+# Let the converter and verifier know the dtype of files named `name`
+def register(name: str, dtype: np.dtype, /):
+    _REGISTERED[name] = np.dtype(dtype)
+
+
+def _encode(dtype: np.dtype, shape: tuple[int, ...], payload_size: int, payload_crc: int, alignment: int) -> bytes:
+    descr = repr(np.lib.format.dtype_to_descr(dtype)).encode('utf-8')
+    size = _FIXED.size + 8 * len(shape) + len(descr)
+    offset = -(-size // alignment) * alignment
+
+    header = bytearray(offset)
+    _FIXED.pack_into(
+        header, 0,
+        MAGIC, VERSION, len(shape), alignment, offset, len(descr),
+        payload_size, payload_crc, 0,
+    )
+    struct.pack_into(f'<{len(shape)}Q', header, _FIXED.size, *shape)
+    header[_FIXED.size + 8 * len(shape):size] = descr
+    struct.pack_into('<I', header, _HEADER_CRC, zlib.crc32(header))
+    return bytes(header)
+
+
+def _crc(array: np.ndarray, crc: int=0, *, chunk: int=1 << 24) -> int:
+    data = memoryview(np.ascontiguousarray(array).reshape(-1).view('u1'))
+    for start in range(0, len(data), chunk):
+        crc = zlib.crc32(data[start:start + chunk], crc)
+    return crc
+
+
+def is_container(path: pathlib.Path) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Parse and check the header of the array file at `path` without touching the
+# payload: magic, version, header checksum, alignment, and that the file is
+# exactly as long as the shape and dtype say
+def header(path: pathlib.Path) -> Header:
+    with open(path, 'rb') as f:
+        fixed = f.read(_FIXED.size)
+        if len(fixed) < _FIXED.size or fixed[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an array file')
+
+        (
+            _, version, ndim, alignment, offset, descr_size,
+            payload_size, payload_crc, header_crc,
+        ) = _FIXED.unpack(fixed)
+        if version != VERSION:
+            raise ValueError(f'{path} has array file version {version}, expected {VERSION}')
+        if alignment == 0 or offset % alignment or offset < _FIXED.size + 8 * ndim + descr_size:
+            raise ValueError(f'{path} has a misaligned payload at {offset} (alignment {alignment})')
+
+        rest = f.read(offset - _FIXED.size)
+        if len(rest) != offset - _FIXED.size:
+            raise ValueError(f'{path} has a truncated header')
+
+        check = bytearray(fixed + rest)
+        struct.pack_into('<I', check, _HEADER_CRC, 0)
+        if zlib.crc32(check) != header_crc:
+            raise ValueError(f'{path} has a corrupt header')
+
+        shape = struct.unpack_from(f'<{ndim}Q', rest, 0)
+        descr = rest[8 * ndim:8 * ndim + descr_size].decode('utf-8')
+        dtype = np.lib.format.descr_to_dtype(ast.literal_eval(descr))
+
+        expected = int(np.prod(shape, dtype='u8')) * dtype.itemsize
+        if payload_size != expected:
+            raise ValueError(f'{path} has {payload_size} payload bytes, but shape {shape} of {dtype} needs {expected}')
+
+        size = os.fstat(f.fileno()).st_size
+        if size != offset + payload_size:
+            raise ValueError(f'{path} is {size} bytes, expected {offset + payload_size}')
+
+    return Header(
+        version=version,
+        dtype=dtype,
+        shape=tuple(shape),
+        alignment=alignment,
+        offset=offset,
+        payload_size=payload_size,
+        payload_crc=payload_crc,
+    )
+
+
+# Map the array file at `path` without copying or reading its payload. Files
+# without a header are mapped as raw `dtype` as before. With a `dtype` other
+# than the stored one, the last axis is reinterpreted, e.g. a stored (N, 3)
+# float array read as an (x, y, z) record array gives N records.
+def read(path: pathlib.Path, dtype: np.dtype | None=None, *, mode: str='r') -> np.ndarray:
+    if not is_container(path):
+        if dtype is None:
+            raise ValueError(f'{path} has no header, so its dtype must be given')
+        return np.memmap(path, dtype=dtype, mode=mode)
+
+    head = header(path)
+    if head.payload_size == 0:
+        array = np.zeros(head.shape, dtype=head.dtype)
+    else:
+        array = np.memmap(path, dtype=head.dtype, shape=head.shape, mode=mode, offset=head.offset)
+
+    if dtype is None or np.dtype(dtype) == head.dtype:
+        return array
+
+    dtype = np.dtype(dtype)
+    if array.ndim == 0 or (array.shape[-1] * head.dtype.itemsize) % dtype.itemsize:
+        raise ValueError(f'{path} holds {head.shape} of {head.dtype}, which cannot be read as {dtype}')
+    view = array.view(dtype)
+    if view.ndim > 1 and view.shape[-1] == 1 and array.shape[-1] != 1:
+        view = view[..., 0]
+    return view
+
+
+# Write an array file all at once
+def save(path: pathlib.Path, array: np.ndarray, /, *, alignment: int=ALIGNMENT):
+    with Writer(path, array.dtype, inner=array.shape[1:], alignment=alignment) as writer:
+        writer.write(array)
+
+
+# Write an array file a slice at a time, along its first axis. The header is
+# filled in on close, and the file only appears at `path` then.
+class Writer:
+    def __init__(
+        self,
+        path: pathlib.Path,
+        dtype: np.dtype,
+        *,
+        inner: tuple[int, ...]=(),
+        alignment: int=ALIGNMENT,
+    ):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.inner = tuple(inner)
+        self.alignment = alignment
+        self.count = 0
+        self.crc = 0
+
+        self._tmp = path.with_name(f'{path.name}.tmp')
+        self._file = open(self._tmp, 'wb')
+
+        # Reserve the header at its final size: the largest count still takes
+        # one u64, so only the values change on close
+        self._offset = len(_encode(self.dtype, (0, *self.inner), 0, 0, alignment))
+        self._file.write(bytes(self._offset))
+
+    def write(self, array: np.ndarray):
+        array = np.ascontiguousarray(array, dtype=self.dtype).reshape(-1, *self.inner)
+        self._file.write(memoryview(array.reshape(-1).view('u1')))
+        self.crc = _crc(array, self.crc)
+        self.count += len(array)
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        shape = (self.count, *self.inner)
+        nbytes = int(np.prod(shape, dtype='u8')) * self.dtype.itemsize
+        self._file.seek(0)
+        self._file.write(_encode(self.dtype, shape, nbytes, self.crc, self.alignment))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self._file.close()
+            self._tmp.unlink(missing_ok=True)
+
+
+# Check a file end to end. Array files have their header checked and their
+# payload checksummed; raw files are checked against the dtype their name
+# implies, when it implies one. Returns a short status; raises ValueError
+# for a bad file.
+def verify(path: pathlib.Path) -> str:
+    if is_container(path):
+        head = header(path)
+        if head.payload_size:
+            payload = np.memmap(path, dtype='u1', mode='r', offset=head.offset, shape=(head.payload_size,))
+            crc = _crc(payload)
+        else:
+            crc = 0
+        if crc != head.payload_crc:
+            raise ValueError(f'{path} payload checksum {crc:08x} does not match {head.payload_crc:08x}')
+        return 'ok'
+
+    dtype = infer_dtype(path)
+    if dtype is None:
+        return 'raw, unknown dtype'
+    if _LEGACY_HEADER.search(path.name):
+        _legacy(path)
+    elif path.stat().st_size % dtype.itemsize:
+        raise ValueError(f'{path} is {path.stat().st_size} bytes, not a whole number of {dtype}')
+    return 'raw'
+
+
+# The dtype a raw file's name implies, or None. Vector types come back as
+# sub-array dtypes, e.g. vec3f as ('<f4', (3,)).
+def infer_dtype(path: pathlib.Path) -> np.dtype | None:
+    name = pathlib.Path(path).name
+    if name in _REGISTERED:
+        return _REGISTERED[name]
+    for suffix, dtype in _REGISTERED.items():
+        if name.endswith(f'.{suffix}'):
+            return dtype
+
+    if _LEGACY_HEADER.search(name):
+        return np.dtype([('r', '<f4'), ('g', '<f4'), ('b', '<f4')])
+
+    match = _VEC.search(name)
+    if match is not None:
+        return np.dtype((_TYPES[match.group(2)], (int(match.group(1)),)))
+
+    match = _SCALAR.search(name)
+    if match is not None:
+        return np.dtype(_TYPES[match.group(1)])
+
+    return None
+
+
+# A file with scene.Read's old header, as (shape, payload offset)
+def _legacy(path: pathlib.Path) -> tuple[tuple[int, ...], int]:
+    with open(path, 'rb') as f:
+        count = f.read(4)
+        if len(count) != 4:
+            raise ValueError(f'{path} has a truncated header')
+        ndim ,= struct.unpack('<I', count)
+        if ndim > 8:
+            raise ValueError(f'{path} has an implausible header ({ndim} dimensions)')
+        dims = f.read(4 * ndim)
+        if len(dims) != 4 * ndim:
+            raise ValueError(f'{path} has a truncated header')
+        shape = struct.unpack(f'<{ndim}I', dims)
+
+    offset = 4 + 4 * ndim
+    expected = int(np.prod(shape, dtype='u8')) * infer_dtype(path).itemsize
+    if path.stat().st_size - offset != expected:
+        raise ValueError(f'{path} holds {path.stat().st_size - offset} bytes, but shape {shape} needs {expected}')
+    return shape, offset
+
+
+# Rewrite a raw file in place as an array file. The dtype comes from the
+# file name unless given. Returns False if the file is already an array file.
+def convert(path: pathlib.Path, /, *, dtype: np.dtype | None=None) -> bool:
+    if is_container(path):
+        return False
+
+    dtype = np.dtype(dtype) if dtype is not None else infer_dtype(path)
+    if dtype is None:
+        raise ValueError(f'Cannot tell the dtype of {path} from its name')
+
+    if _LEGACY_HEADER.search(path.name):
+        shape, offset = _legacy(path)
+    else:
+        offset = 0
+        if path.stat().st_size % dtype.itemsize:
+            raise ValueError(f'{path} is {path.stat().st_size} bytes, not a whole number of {dtype}')
+        shape = (path.stat().st_size // dtype.itemsize,)
+
+    if np.prod(shape, dtype='u8') == 0:
+        array = np.zeros(shape, dtype=dtype)
+    else:
+        array = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    save(path, array)
+    return True
+
+
+def _files(paths: list[pathlib.Path]) -> list[pathlib.Path]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(path.rglob('*.bin')))
+        else:
+            files.append(path)
+    return files
+
+
+def cli():
+    import argparse
+
+    # The archive, index and snapshot modules register their table dtypes
+    import sunrise.archive, sunrise.spatial, sunrise.snapshot
+
+    parser = argparse.ArgumentParser(
+        description='Convert raw .bin files to array files, or verify a tree of them',
+    )
+    parser.add_argument('command', choices=('verify', 'convert'))
+    parser.add_argument('paths', nargs='+', type=pathlib.Path,
+                        help='files, or directories to search for *.bin')
+    parser.add_argument('--workers', type=int, default=auto.os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    def verify_one(path):
+        return verify(path)
+
+    def convert_one(path):
+        if infer_dtype(path) is None and not is_container(path):
+            return 'skipped, unknown dtype'
+        return 'converted' if convert(path) else 'already an array file'
+
+    work = verify_one if args.command == 'verify' else convert_one
+    files = _files(args.paths)
+
+    failed = 0
+    counts = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(work, path): path for path in files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                status = future.result()
+            except (OSError, ValueError) as e:
+                failed += 1
+                print(f'FAILED {futures[future]}: {e}')
+                continue
+            counts[status] = counts.get(status, 0) + 1
+
+    for status, count in sorted(counts.items()):
+        print(f'{count:8d} {status}')
+    print(f'{failed:8d} failed')
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    cli()
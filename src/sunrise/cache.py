@@ -0,0 +1,322 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+
+import asyncio
+import collections
+import hashlib
+import os
+import pathlib
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    from . import model
+
+
+__all__ = [
+    'request_key',
+    'CachedTile',
+    'TileCache',
+    'SingleFlight',
+]
+
+
+# Round floats so that camera vectors which only differ by float noise from
+# the client's matrix math share a cache entry
+def _normalise(value, *, digits: int=6):
+    if isinstance(value, float):
+        value = round(value, digits)
+        return 0.0 if value == 0 else value
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (tuple, list)):
+        return tuple(_normalise(v, digits=digits) for v in value)
+    return value
+
+
+# Content address of a rendering request: every field that affects the pixels
+# plus anything about how they are encoded
+def request_key(request: model.RenderingRequest, /, **extra) -> str:
+    fields = auto.dataclasses.asdict(request)
+    fields.update(extra)
+
+    canonical = repr(sorted(
+        (name, _normalise(value))
+        for name, value in fields.items()
+    ))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class CachedTile(typing.NamedTuple):
+    content: bytes
+    media_type: str
+    headers: dict[str, str] = {}
+
+
+# A least-recently-used map of encoded tiles, bounded by total bytes
+class MemoryTier:
+    def __init__(self, *, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._tiles: collections.OrderedDict[str, CachedTile] = collections.OrderedDict()
+
+    def get(self, key: str) -> CachedTile | None:
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+        return tile
+
+    def put(self, key: str, tile: CachedTile):
+        if len(tile.content) > self.max_bytes:
+            return
+
+        old = self._tiles.pop(key, None)
+        if old is not None:
+            self.nbytes -= len(old.content)
+
+        self._tiles[key] = tile
+        self.nbytes += len(tile.content)
+
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._tiles.popitem(last=False)
+            self.nbytes -= len(evicted.content)
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+# Encoded tiles stored one per file as
+#   <media type>\n
+#   <header>: <value>\n   (zero or more)
+#   \n
+#   <content>
+# The index of
+# file sizes is rebuilt from the directory at startup, oldest files first, and
+# files are evicted in that order once the directory exceeds `max_bytes`.
+# Only the index is locked; files are read and written outside the lock, so
+# one slow disk operation does not hold up the others. Writes go to a
+# `<key>.<thread>.tmp` file first; any left behind by a crash are removed at
+# startup.
+class DiskTier:
+    def __init__(self, *, path: pathlib.Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._sizes: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.logger = auto.structlog.get_logger('sunrise.cache')
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.tmp'):
+                self._unlink_path(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._sizes[name] = size
+            self.nbytes += size
+
+    def _file(self, key: str) -> pathlib.Path:
+        return self.path / key
+
+    # Reads the file, so call it off the event loop. The header lines are
+    # read one by one and the content in one read, so it is copied once.
+    def get(self, key: str) -> CachedTile | None:
+        with self._lock:
+            if key not in self._sizes:
+                return None
+
+        try:
+            with open(self._file(key), 'rb') as f:
+                media_type = f.readline().rstrip(b'\n').decode('ascii')
+                headers = {}
+                while (line := f.readline().rstrip(b'\n')):
+                    name, value = line.decode('ascii').split(': ', 1)
+                    headers[name] = value
+                if not media_type or line != b'':
+                    raise ValueError(f'Corrupt tile cache entry {key}')
+                content = f.read()
+        except (OSError, ValueError, UnicodeDecodeError):
+            self._forget(key)
+            return None
+
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return CachedTile(content=content, media_type=media_type, headers=headers)
+
+    def put(self, key: str, tile: CachedTile):
+        header = ''.join([
+            f'{tile.media_type}\n',
+            *(f'{name}: {value}\n' for name, value in tile.headers.items()),
+            '\n',
+        ]).encode('ascii')
+        size = len(header) + len(tile.content)
+        if size > self.max_bytes:
+            return
+
+        # The tile was rendered fine; failing to keep it (a full disk, lost
+        # permissions, the directory removed) only costs a later re-render
+        path = self._file(key)
+        tmp = path.with_name(f'{key}.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(tile.content)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.warning(event='tile_cache_write_failed', key=key, error=str(e))
+            self._unlink_path(tmp)
+            return
+
+        evicted = []
+        with self._lock:
+            self.nbytes -= self._sizes.pop(key, 0)
+            self._sizes[key] = size
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                old, old_size = self._sizes.popitem(last=False)
+                self.nbytes -= old_size
+                evicted.append(old)
+
+        for old in evicted:
+            self._unlink(old)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self.nbytes -= self._sizes.pop(key, 0)
+        self._unlink(key)
+
+    def _unlink(self, key: str):
+        self._unlink_path(self._file(key))
+
+    @staticmethod
+    def _unlink_path(path: str | pathlib.Path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+# Two-tier cache of encoded tiles in front of the renderer. Lookups check
+# memory first, then disk, and promote disk hits back into memory.
+class TileCache:
+    def __init__(
+        self,
+        *,
+        memory_bytes: int,
+        disk_bytes: int,
+        path: pathlib.Path | None,
+    ):
+        self.memory = MemoryTier(max_bytes=memory_bytes)
+        self.disk = (
+            DiskTier(path=path, max_bytes=disk_bytes)
+            if path is not None and disk_bytes > 0 else
+            None
+        )
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    # The memory tier alone, which is cheap enough to check on the event
+    # loop. A miss here is not counted, since `get` follows it.
+    def get_memory(self, key: str) -> CachedTile | None:
+        with self._lock:
+            tile = self.memory.get(key)
+            if tile is not None:
+                self.memory_hits += 1
+                self.bytes_served += len(tile.content)
+            return tile
+
+    # Both tiers. The disk is read outside the lock, but it is still read,
+    # so call this off the event loop.
+    def get(self, key: str) -> CachedTile | None:
+        tile = self.get_memory(key)
+        if tile is not None:
+            return tile
+
+        tile = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if tile is None:
+                self.misses += 1
+                return None
+
+            self.memory.put(key, tile)
+            self.disk_hits += 1
+            self.bytes_served += len(tile.content)
+            return tile
+
+    # Writes to disk, so call it off the event loop
+    def put(self, key: str, content: bytes, media_type: str, headers: dict[str, str]={}):
+        tile = CachedTile(content=bytes(content), media_type=media_type, headers=dict(headers))
+        with self._lock:
+            self.memory.put(key, tile)
+        if self.disk is not None:
+            self.disk.put(key, tile)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return dict(
+                memory_hits=self.memory_hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                hit_ratio=(hits / lookups) if lookups else 0.0,
+                bytes_served=self.bytes_served,
+                memory_entries=len(self.memory),
+                memory_bytes=self.memory.nbytes,
+                disk_entries=len(self.disk) if self.disk is not None else 0,
+                disk_bytes=self.disk.nbytes if self.disk is not None else 0,
+            )
+
+
+# Coalesce concurrent calls that share a key: the first caller starts the work
+# as its own task and everyone, including later arrivals, awaits that task.
+# Because the work is not tied to any one caller, a client that disconnects
+# does not cancel the render for the others.
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func: typing.Callable[[], typing.Awaitable[typing.Any]]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return dict(
+            inflight=len(self._inflight),
+            leaders=self.leaders,
+            coalesced=self.coalesced,
+        )
@@ -4,6 +4,7 @@
 
 from __future__ import annotations
 from ._auto import auto
+from . import encode
 import json
 
 
@@ -13,6 +14,14 @@ class RendererConfig:
         self._type = self.data["type"]
         self._modules = self.data["modules"]
         self._samples = self.data["samples"]
+        self._pool_size = self.data.get("pool_size", 1)
+        self._framebuffer_pool_bytes = self.data.get("framebuffer_pool_bytes", 256 * 1024 * 1024)
+        self._progressive_variance = self.data.get("progressive_variance", 0.01)
+        self._progressive_max_passes = self.data.get("progressive_max_passes", 64)
+        self._light_cache_size = self.data.get("light_cache_size", 16)
+        self._adaptive = self.data.get("adaptive", False)
+        self._adaptive_variance = self.data.get("adaptive_variance", 0.02)
+        self._adaptive_max_passes = self.data.get("adaptive_max_passes", 8)
 
         # Valid types that we allow for the renderer
         self._valid_types = [
@@ -37,6 +46,27 @@ class RendererConfig:
                 if module not in self._valid_modules:
                     print(f'ERROR: Invalid module: ${module}')
                     exit()
+        if not isinstance(self._pool_size, int) or self._pool_size < 1:
+            print(f'ERROR: Invalid pool size: {self._pool_size}')
+            exit()
+        if not isinstance(self._adaptive_max_passes, int) or self._adaptive_max_passes < 1:
+            print(f'ERROR: Invalid adaptive max passes: {self._adaptive_max_passes}')
+            exit()
+        if not isinstance(self._light_cache_size, int) or self._light_cache_size < 1:
+            print(f'ERROR: Invalid light cache size: {self._light_cache_size}')
+            exit()
+        if not isinstance(self._framebuffer_pool_bytes, int) or self._framebuffer_pool_bytes < 0:
+            print(f'ERROR: Invalid framebuffer pool bytes: {self._framebuffer_pool_bytes}')
+            exit()
+        if not isinstance(self._progressive_variance, (int, float)) or self._progressive_variance < 0:
+            print(f'ERROR: Invalid progressive variance: {self._progressive_variance}')
+            exit()
+        if not isinstance(self._progressive_max_passes, int) or self._progressive_max_passes < 1:
+            print(f'ERROR: Invalid progressive max passes: {self._progressive_max_passes}')
+            exit()
+        if not isinstance(self._adaptive_variance, (int, float)) or self._adaptive_variance < 0:
+            print(f'ERROR: Invalid adaptive variance: {self._adaptive_variance}')
+            exit()
         print("success")
 
     # Get the type of renderer from the config
@@ -51,6 +81,39 @@ class RendererConfig:
     def samples(self):
         return self._samples
 
+    # Get the number of scenes (and render workers) to keep in the pool
+    def pool_size(self):
+        return self._pool_size
+
+    # Get the cap on idle framebuffer memory kept by each scene for reuse
+    def framebuffer_pool_bytes(self):
+        return self._framebuffer_pool_bytes
+
+    # Get the variance at which progressive refinement stops sending frames
+    def progressive_variance(self):
+        return self._progressive_variance
+
+    # Get the most passes progressive refinement accumulates for one camera
+    def progressive_max_passes(self):
+        return self._progressive_max_passes
+
+    # Get the number of committed light sets each scene keeps for reuse
+    def light_cache_size(self):
+        return self._light_cache_size
+
+    # Get whether tiles are rendered in accumulated passes until the variance
+    # settles, rather than at a fixed number of samples
+    def adaptive(self):
+        return self._adaptive
+
+    # Get the variance at which adaptive rendering stops adding passes
+    def adaptive_variance(self):
+        return self._adaptive_variance
+
+    # Get the most passes adaptive rendering spends on one tile
+    def adaptive_max_passes(self):
+        return self._adaptive_max_passes
+
 class ServerConfig:
     def __init__(self, server_data):
         self.data = server_data
@@ -113,6 +176,158 @@ class ClientConfig:
         return self._map_data
 
 
+class CacheConfig:
+    def __init__(self, cache_data):
+        self.data = cache_data
+
+        self._memory_bytes = self.data.get("memory_bytes", 64 * 1024 * 1024)
+        self._disk_bytes = self.data.get("disk_bytes", 0)
+        self._path = self.data.get("path", None)
+
+    def validate(self):
+        print("Validating cache...", end=" ")
+        if self._memory_bytes < 0 or self._disk_bytes < 0:
+            print(f'ERROR: Cache sizes must not be negative')
+            exit()
+        if self._disk_bytes > 0 and self._path is None:
+            print(f'ERROR: Cache disk_bytes is set but no path was given')
+            exit()
+        print("success")
+
+    # Get the budget for encoded tiles kept in memory
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    # Get the budget for encoded tiles kept on disk (0 disables the disk tier)
+    def disk_bytes(self):
+        return self._disk_bytes
+
+    # Get the directory the disk tier stores tiles in
+    def path(self):
+        if self._path is None:
+            return None
+        return auto.pathlib.Path(self._path)
+
+
+class CityConfig:
+    def __init__(self, city_data):
+        self.data = city_data
+
+        self._states = self.data.get("states", ["AK"])
+        self._cell_size = self.data.get("cell_size", 10.0)
+        self._radius = self.data.get("radius", 100.0)
+        self._memory_bytes = self.data.get("memory_bytes", 2 * 1024 * 1024 * 1024)
+        self._workers = self.data.get("workers", auto.os.cpu_count() or 1)
+        self._lod_distances = self.data.get("lod_distances", [2.0, 10.0])
+        self._snapshot = self.data.get("snapshot", None)
+
+    def validate(self):
+        print("Validating city...", end=" ")
+        if not all(isinstance(state, str) and state for state in self._states):
+            print(f'ERROR: City states must be directory names under data/pre: {self._states}')
+            exit()
+        if self._cell_size <= 0 or self._radius < 0:
+            print(f'ERROR: City cell_size must be positive and radius must not be negative')
+            exit()
+        if self._memory_bytes <= 0:
+            print(f'ERROR: Invalid city memory budget: {self._memory_bytes}')
+            exit()
+        if self._workers < 1:
+            print(f'ERROR: Invalid number of city loader workers: {self._workers}')
+            exit()
+        if list(self._lod_distances) != sorted(self._lod_distances):
+            print(f'ERROR: City lod_distances must be increasing: {self._lod_distances}')
+            exit()
+        print("success")
+
+    # Get the states (or counties), as directories under data/pre and
+    # data/gen, that the city starts with
+    def states(self):
+        return tuple(self._states)
+
+    # Get the edge length (km) of the cells buildings are paged in by
+    def cell_size(self):
+        return self._cell_size
+
+    # Get the distance (km) from the camera within which cells are resident
+    def radius(self):
+        return self._radius
+
+    # Get the budget for resident building meshes across all cells
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    # Get the number of threads used to map and validate building meshes
+    def workers(self):
+        return self._workers
+
+    # Get the camera distances (km) beyond which cells switch to the
+    # decimated and then the box level of detail
+    def lod_distances(self):
+        return tuple(self._lod_distances)
+
+    # Get the snapshot directory written by `python -m sunrise.snapshot`, if
+    # the server should start from one
+    def snapshot(self):
+        if self._snapshot is None:
+            return None
+        return auto.pathlib.Path(self._snapshot)
+
+
+class EncoderConfig:
+    def __init__(self, encoder_data):
+        self.data = encoder_data
+
+        self._workers = self.data.get("workers", auto.os.cpu_count() or 1)
+        self._profile = self.data.get("profile", "default")
+        self._profiles = {
+            "default": { "format": "png" },
+            **self.data.get("profiles", {}),
+        }
+
+    def validate(self):
+        print("Validating encoder...", end=" ")
+        if self._workers < 1:
+            print(f'ERROR: Invalid number of encoder workers: {self._workers}')
+            exit()
+        if self._profile not in self._profiles:
+            print(f'ERROR: Unknown default encoder profile: {self._profile}')
+            exit()
+        for name in self._profiles:
+            try:
+                self.encoding(profile=name)
+            except ValueError as e:
+                print(f'ERROR: Invalid encoder profile {name}: {e}')
+                exit()
+        print("success")
+
+    # Get the number of threads used to encode images
+    def workers(self):
+        return self._workers
+
+    # Get the names of the available quality profiles
+    def profiles(self):
+        return list(self._profiles)
+
+    # Resolve a profile name plus optional per-request overrides into an
+    # encoding. Raises ValueError for unknown profiles or invalid settings.
+    def encoding(self, *, profile=None, format=None, quality=None):
+        if profile is None:
+            profile = self._profile
+        if profile not in self._profiles:
+            raise ValueError(f'Unknown encoder profile {profile!r}')
+
+        settings = self._profiles[profile]
+        if format is None:
+            format = settings["format"]
+            if quality is None:
+                quality = settings.get("quality", None)
+
+        encoding = encode.Encoding(format=format, quality=quality)
+        encode.validate(encoding)
+        return encoding
+
+
 # Overall configuration
 class Config:
     def __init__(self, config_data):
@@ -120,9 +335,15 @@ class Config:
         self._renderer = RendererConfig(self.config["renderer"])
         self._server = ServerConfig(self.config["server"])
         self._client = ClientConfig(self.config["client"])
+        self._cache = CacheConfig(self.config.get("cache", {}))
+        self._encoder = EncoderConfig(self.config.get("encoder", {}))
+        self._city = CityConfig(self.config.get("city", {}))
 
         self._server.validate()
         self._renderer.validate()
+        self._cache.validate()
+        self._encoder.validate()
+        self._city.validate()
         self._client
 
     @property
@@ -133,6 +354,18 @@ class Config:
     def server(self):
         return self._server
 
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def encoder(self):
+        return self._encoder
+
+    @property
+    def city(self):
+        return self._city
+
     
     def client_data_response(self):
         config_obj = json.dumps({
@@ -0,0 +1,237 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+
+import concurrent.futures
+import ctypes
+import io
+import threading
+import time
+import typing
+
+import numpy as np
+import PIL.Image
+
+
+__all__ = [
+    'Encoding',
+    'EncodedImage',
+    'EncoderPool',
+    'ENCODERS',
+]
+
+
+# How a rendered image should be turned into bytes. `quality` is the zlib
+# compression level (0-9) for PNG and the lossy quality (1-100) for JPEG and
+# WebP; it is ignored for raw RGBA.
+class Encoding(typing.NamedTuple):
+    format: str
+    quality: int | None = None
+
+
+class EncodedImage(typing.NamedTuple):
+    content: bytes
+    media_type: str
+    headers: dict[str, str]
+
+
+MEDIA_TYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'raw': 'application/octet-stream',
+}
+
+
+# Images arrive either as PIL images or as (height, width, 4) uint8 views of a
+# mapped framebuffer. Views are usually strided (the ghost border is cropped
+# off by slicing), so hand PIL the row stride and let its raw decoder read the
+# rows straight out of the mapped memory.
+def _as_image(image: PIL.Image.Image | np.ndarray) -> PIL.Image.Image:
+    if isinstance(image, PIL.Image.Image):
+        return image
+
+    height, width, channels = image.shape
+    assert channels == 4 and image.dtype == np.uint8 and image.strides[1:] == (4, 1)
+
+    stride = image.strides[0]
+    size = stride * (height - 1) + width * 4
+    buffer = (ctypes.c_uint8 * size).from_address(image.ctypes.data)
+    return PIL.Image.frombuffer('RGBA', (width, height), buffer, 'raw', 'RGBA', stride, 1)
+
+
+def _size(image: PIL.Image.Image | np.ndarray) -> tuple[int, int]:
+    if isinstance(image, PIL.Image.Image):
+        return image.size
+
+    height, width, _ = image.shape
+    return width, height
+
+
+def _png(image: PIL.Image.Image | np.ndarray, quality: int | None) -> EncodedImage:
+    image = _as_image(image)
+    with io.BytesIO() as f:
+        image.save(f, 'PNG', compress_level=6 if quality is None else quality)
+        return EncodedImage(f.getvalue(), MEDIA_TYPES['png'], {})
+
+
+def _jpeg(image: PIL.Image.Image | np.ndarray, quality: int | None) -> EncodedImage:
+    image = _as_image(image)
+    with io.BytesIO() as f:
+        image.convert('RGB').save(f, 'JPEG', quality=75 if quality is None else quality)
+        return EncodedImage(f.getvalue(), MEDIA_TYPES['jpeg'], {})
+
+
+def _webp(image: PIL.Image.Image | np.ndarray, quality: int | None) -> EncodedImage:
+    image = _as_image(image)
+    with io.BytesIO() as f:
+        image.save(f, 'WEBP', quality=80 if quality is None else quality)
+        return EncodedImage(f.getvalue(), MEDIA_TYPES['webp'], {})
+
+
+# Uncompressed 8-bit RGBA rows, top to bottom, for clients on the same machine
+def _raw(image: PIL.Image.Image | np.ndarray, quality: int | None) -> EncodedImage:
+    width, height = _size(image)
+    return EncodedImage(
+        (
+            image.tobytes()
+            if isinstance(image, np.ndarray) else
+            image.convert('RGBA').tobytes()
+        ),
+        MEDIA_TYPES['raw'],
+        {
+            'X-Sunrise-Width': str(width),
+            'X-Sunrise-Height': str(height),
+            'X-Sunrise-Pixel-Format': 'RGBA8',
+        },
+    )
+
+
+ENCODERS: dict[str, typing.Callable[[PIL.Image.Image | np.ndarray, int | None], EncodedImage]] = {
+    'png': _png,
+    'jpeg': _jpeg,
+    'webp': _webp,
+    'raw': _raw,
+}
+
+# Valid quality range per format, if quality applies at all
+QUALITY_RANGE = {
+    'png': (0, 9),
+    'jpeg': (1, 100),
+    'webp': (1, 100),
+}
+
+
+def validate(encoding: Encoding, /):
+    if encoding.format not in ENCODERS:
+        raise ValueError(f'Unknown image format {encoding.format!r}, expected one of {sorted(ENCODERS)}')
+
+    if encoding.quality is not None and encoding.format in QUALITY_RANGE:
+        lo, hi = QUALITY_RANGE[encoding.format]
+        if not lo <= encoding.quality <= hi:
+            raise ValueError(f'Quality for {encoding.format} must be in [{lo}, {hi}], got {encoding.quality}')
+
+
+# Calls `release` on the `count`th call, from whichever thread makes it
+class _Countdown:
+    def __init__(self, count: int, release: typing.Callable[[], None]):
+        self._count = count
+        self._release = release
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self._count -= 1
+            if self._count != 0:
+                return
+        self._release()
+
+
+# Encodes images on a dedicated thread pool so compression never runs on the
+# event loop. Pillow releases the GIL while compressing, so the pool scales
+# with cores.
+#
+# Mapped framebuffer views are read in place by the pool threads, so whoever
+# maps one must not unmap it while an encode may still be reading. Pass the
+# unmapping function as `release` and the pool owns it: it is called on the
+# pool thread once the encode has finished, even if the awaiting task was
+# cancelled first.
+class EncoderPool:
+    def __init__(self, *, workers: int):
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='encode',
+        )
+
+    def _encode(self, image: PIL.Image.Image | np.ndarray, encoding: Encoding, logger, release=None) -> EncodedImage:
+        encode_start = time.time_ns()
+        try:
+            encoded = ENCODERS[encoding.format](image, encoding.quality)
+        finally:
+            if release is not None:
+                release()
+        encode_time = time.time_ns() - encode_start
+
+        if logger is not None:
+            logger.info(
+                event='encode_time_ns',
+                time=encode_time,
+                format=encoding.format,
+                quality=encoding.quality,
+                bytes=len(encoded.content),
+                dimension=list(_size(image)),
+            )
+
+        return encoded
+
+    # Submitted jobs are awaited through a shield: cancelling the caller must
+    # not cancel a job that has not started yet, or `release` would never run.
+    def _submit(self, image: PIL.Image.Image | np.ndarray, encoding: Encoding, logger, release):
+        try:
+            future = self._pool.submit(self._encode, image, encoding, logger, release)
+        except BaseException:
+            if release is not None:
+                release()
+            raise
+        return auto.asyncio.shield(auto.asyncio.wrap_future(future))
+
+    async def encode(self, image: PIL.Image.Image | np.ndarray, encoding: Encoding, logger=None, *, release=None) -> EncodedImage:
+        return await self._submit(image, encoding, logger, release)
+
+    # Every image shares one `release`, called after the last encode has
+    # finished. Waits for all of them before raising the first error, so a
+    # failed tile never leaves its neighbours reading released memory.
+    async def encode_many(self, images: dict, encoding: Encoding, logger=None, *, release=None) -> dict:
+        keys = list(images)
+        if not keys:
+            if release is not None:
+                release()
+            return {}
+
+        if release is not None:
+            release = _Countdown(len(keys), release)
+
+        # Submit every job before the first await, so all of them count down
+        futures = []
+        for key in keys:
+            try:
+                futures.append(self._submit(images[key], encoding, logger, release))
+            except BaseException as e:
+                futures.append(e)
+
+        encoded = await auto.asyncio.gather(*(
+            future
+            for future in futures
+            if not isinstance(future, BaseException)
+        ), return_exceptions=True)
+
+        for result in (*futures, *encoded):
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(keys, encoded))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
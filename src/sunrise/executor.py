@@ -0,0 +1,244 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+
+import asyncio
+import queue
+import threading
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from . import scene, model
+
+
+__all__ = [
+    'RenderExecutor',
+]
+
+
+# Seconds a render worker waits for a job before refreshing its idle scene
+IDLE_REFRESH = 1.0
+
+
+# A unit of work for a render worker: call `func(scene, *args)` on the worker
+# thread and hand the result back to `future` on its event loop
+class _Job(typing.NamedTuple):
+    func: typing.Callable[..., typing.Any]
+    args: tuple
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+    enqueued_ns: int
+
+
+# Give back whatever a result borrows (a mapped or pooled framebuffer) when
+# nobody is left to receive it
+def _discard(result: typing.Any):
+    release = getattr(result, 'release', None)
+    if release is not None:
+        release()
+
+
+# Resolve a future from the loop thread, unless the caller gave up on it, in
+# which case the result is released here
+def _set_result(future: asyncio.Future, result: typing.Any):
+    if future.done():
+        _discard(result)
+        return
+    future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exc: BaseException):
+    if not future.done():
+        future.set_exception(exc)
+
+
+class RenderWorker:
+    def __init__(self, index: int, scene: scene.Scene, jobs: queue.Queue):
+        self.index = index
+        self.scene = scene
+        self._jobs = jobs
+
+        self.jobs_done = 0
+        self.busy_ns = 0
+        self.wait_ns = 0
+        self.started_ns = None
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f'render-{index}',
+            daemon=True,
+        )
+
+    def start(self):
+        self.started_ns = time.monotonic_ns()
+        self._thread.start()
+
+    def join(self, timeout: float | None=None):
+        self._thread.join(timeout)
+
+    # Pull jobs off the shared queue until we are handed the shutdown sentinel.
+    # While idle, bring the scene's world up to date every IDLE_REFRESH
+    # seconds, so it does not keep cells the city has retired alive.
+    def _run(self):
+        while True:
+            try:
+                job = self._jobs.get(timeout=IDLE_REFRESH)
+            except queue.Empty:
+                self._refresh()
+                continue
+            if job is None:
+                break
+
+            begin = time.monotonic_ns()
+            self.wait_ns += begin - job.enqueued_ns
+            try:
+                result = job.func(self.scene, *job.args)
+            except BaseException as e:
+                self._post(job, _set_exception, e)
+            else:
+                if not self._post(job, _set_result, result):
+                    _discard(result)
+            finally:
+                self.busy_ns += time.monotonic_ns() - begin
+                self.jobs_done += 1
+
+    def _refresh(self):
+        try:
+            self.scene.refresh()
+        except Exception:
+            # The next job pages and commits the world anyway
+            pass
+
+    # Hand a result to the job's loop. Returns False when the loop is
+    # already closed, so the worker carries on with the next job.
+    def _post(self, job: _Job, callback: typing.Callable, value: typing.Any) -> bool:
+        try:
+            job.loop.call_soon_threadsafe(callback, job.future, value)
+        except RuntimeError:
+            return False
+        return True
+
+    # Fraction of wall time since start that this worker spent rendering
+    def utilisation(self) -> float:
+        if self.started_ns is None:
+            return 0.0
+
+        elapsed = time.monotonic_ns() - self.started_ns
+        if elapsed <= 0:
+            return 0.0
+
+        return self.busy_ns / elapsed
+
+    def stats(self) -> dict:
+        return dict(
+            name=self._thread.name,
+            jobs=self.jobs_done,
+            busy_ns=self.busy_ns,
+            mean_wait_ns=(self.wait_ns // self.jobs_done) if self.jobs_done else 0,
+            utilisation=self.utilisation(),
+        )
+
+
+# A fixed set of long-lived render threads, each pinned to one Scene. Requests
+# are queued in FIFO order and picked up by whichever worker is free.
+class RenderExecutor:
+    def __init__(self, scenes: list[scene.Scene]):
+        if len(scenes) == 0:
+            raise ValueError("RenderExecutor needs at least one scene")
+
+        self._jobs = queue.Queue()
+        self.workers = [
+            RenderWorker(i, scene_, self._jobs)
+            for i, scene_ in enumerate(scenes)
+        ]
+        self._started = False
+        self._closed = False
+
+    def start(self):
+        if self._started:
+            return
+
+        self._started = True
+        for worker in self.workers:
+            worker.start()
+
+    # Stop the workers once they finish the jobs already queued
+    def shutdown(self, timeout: float | None=None):
+        if self._closed:
+            return
+
+        self._closed = True
+        for _ in self.workers:
+            self._jobs.put(None)
+
+        for worker in self.workers:
+            worker.join(timeout)
+
+    # Run `func(scene, *args)` on the next free worker and return an awaitable
+    # for the result. Must be called from a running event loop.
+    def submit(self, func: typing.Callable[..., typing.Any], *args) -> asyncio.Future:
+        if self._closed:
+            raise RuntimeError("RenderExecutor has been shut down")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put(_Job(
+            func=func,
+            args=args,
+            future=future,
+            loop=loop,
+            enqueued_ns=time.monotonic_ns(),
+        ))
+        return future
+
+    def render(self, request: model.RenderingRequest, logger) -> asyncio.Future[model.RenderingResponse]:
+        return self.submit(_render, request, logger)
+
+    def render_grid(self, request: model.GridRequest, logger) -> asyncio.Future[model.GridResponse]:
+        return self.submit(_render_grid, request, logger)
+
+    def render_pass(self, session: scene.ProgressiveSession, logger) -> asyncio.Future[model.RenderingResponse]:
+        return self.submit(_render_pass, session, logger)
+
+    def pick(self, request: model.PickRequest, logger) -> asyncio.Future[list[model.PickResult]]:
+        return self.submit(_pick, request, logger)
+
+    @property
+    def size(self) -> int:
+        return len(self.workers)
+
+    # Number of jobs waiting for a free worker
+    def queue_depth(self) -> int:
+        return self._jobs.qsize()
+
+    def stats(self) -> dict:
+        return dict(
+            workers=self.size,
+            queue_depth=self.queue_depth(),
+            cpu_count=auto.os.cpu_count(),
+            per_worker=[worker.stats() for worker in self.workers],
+        )
+
+
+def _render(scene_: scene.Scene, request: model.RenderingRequest, logger) -> model.RenderingResponse:
+    scene_.logger = logger
+    return scene_.render(request)
+
+
+def _render_grid(scene_: scene.Scene, request: model.GridRequest, logger) -> model.GridResponse:
+    scene_.logger = logger
+    return scene_.render_grid(request)
+
+
+def _render_pass(scene_: scene.Scene, session: scene.ProgressiveSession, logger) -> model.RenderingResponse:
+    scene_.logger = logger
+    return session.render_pass(scene_)
+
+
+def _pick(scene_: scene.Scene, request: model.PickRequest, logger) -> list[model.PickResult]:
+    scene_.logger = logger
+    return scene_.pick(request)
@@ -0,0 +1,140 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+
+import numpy as np
+
+
+__all__ = [
+    'FULL',
+    'DECIMATED',
+    'BOX',
+    'LEVELS',
+    'box',
+    'decimate',
+    'level',
+    'select',
+]
+
+
+# Levels of detail, finest first. The full mesh is what the generator wrote;
+# the others are derived from it.
+FULL = 0
+DECIMATED = 1
+BOX = 2
+LEVELS = (FULL, DECIMATED, BOX)
+
+# Vertex clustering grid for DECIMATED, as a fraction of the building's
+# largest extent
+DECIMATE_GRID = 1 / 8
+
+
+# An orthonormal (east, north, up) frame for a building whose vertices are
+# in earth-centred coordinates, so that "up" points away from the centre
+def _frame(xyz: np.ndarray) -> np.ndarray:
+    up = xyz.mean(axis=0)
+    up = up / (np.linalg.norm(up) or 1.0)
+
+    pole = np.array([0.0, 0.0, 1.0]) if abs(up[2]) < 0.9 else np.array([1.0, 0.0, 0.0])
+    east = np.cross(pole, up)
+    east = east / np.linalg.norm(east)
+    north = np.cross(up, east)
+    return np.stack([east, north, up])
+
+
+# Triangles of a box with corners numbered by bits (east, north, up)
+_BOX_INDEX = np.array([
+    (0, 2, 1), (1, 2, 3),  # bottom
+    (4, 5, 6), (5, 7, 6),  # top
+    (0, 1, 4), (1, 5, 4),  # south
+    (2, 6, 3), (3, 6, 7),  # north
+    (0, 4, 2), (2, 4, 6),  # west
+    (1, 3, 5), (3, 7, 5),  # east
+], dtype='u4')
+
+
+# The building's footprint rectangle in its local east/north plane, extruded
+# from its lowest to its highest point: 8 vertices and 12 triangles
+def box(position: np.ndarray, index: np.ndarray, /) -> tuple[np.ndarray, np.ndarray]:
+    xyz = position.view('f4').reshape(-1, 3).astype('f8')
+    frame = _frame(xyz)
+    local = xyz @ frame.T
+    lo, hi = local.min(axis=0), local.max(axis=0)
+
+    corners = np.array([
+        [(hi if bit & (1 << axis) else lo)[axis] for axis in range(3)]
+        for bit in range(8)
+    ])
+    corners = corners @ frame
+
+    return (
+        corners.astype('f4').view(position.dtype).reshape(-1),
+        _BOX_INDEX.view(index.dtype).reshape(-1),
+    )
+
+
+# Vertex clustering: snap vertices to a grid `grid` times the building's
+# largest extent, merge each cluster to its mean and drop the triangles that
+# collapse. Cheap, and good enough for buildings a few pixels across.
+def decimate(
+    position: np.ndarray,
+    index: np.ndarray,
+    /,
+    *,
+    grid: float=DECIMATE_GRID,
+) -> tuple[np.ndarray, np.ndarray]:
+    xyz = position.view('f4').reshape(-1, 3).astype('f8')
+    tri = index.view('u4').reshape(-1, 3)
+
+    lo = xyz.min(axis=0)
+    cell = float((xyz.max(axis=0) - lo).max()) * grid
+    if cell <= 0:
+        return box(position, index)
+
+    cluster = np.floor((xyz - lo) / cell).astype('i8')
+    _, remap, counts = np.unique(cluster, axis=0, return_inverse=True, return_counts=True)
+    remap = remap.reshape(-1)
+
+    merged = np.zeros((len(counts), 3))
+    np.add.at(merged, remap, xyz)
+    merged /= counts[:, None]
+
+    tri = remap[tri]
+    keep = (tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) & (tri[:, 0] != tri[:, 2])
+    tri = tri[keep]
+    if len(tri) == 0:
+        return box(position, index)
+
+    # Two triangles over the same three clusters are the same triangle; keep
+    # the first of each so the winding is preserved
+    _, first = np.unique(np.sort(tri, axis=1), axis=0, return_index=True)
+    tri = tri[np.sort(first)]
+
+    return (
+        merged.astype('f4').view(position.dtype).reshape(-1),
+        np.ascontiguousarray(tri, dtype='u4').view(index.dtype).reshape(-1),
+    )
+
+
+# Derive level `lod` from a building's full mesh. The coarse meshes use the
+# same vertex and triangle dtypes as the inputs.
+def level(position: np.ndarray, index: np.ndarray, lod: int, /) -> tuple[np.ndarray, np.ndarray]:
+    if lod == FULL:
+        return position, index
+    if lod == DECIMATED:
+        return decimate(position, index)
+    if lod == BOX:
+        return box(position, index)
+    raise ValueError(f'Unknown level of detail {lod}, expected one of {LEVELS}')
+
+
+# The level to use for something `distance` km from the camera, given the
+# distances at which each coarser level takes over
+def select(distance: float, thresholds: tuple[float, ...], /) -> int:
+    for lod, threshold in enumerate(thresholds):
+        if distance < threshold:
+            return LEVELS[lod]
+    return LEVELS[min(len(thresholds), len(LEVELS) - 1)]
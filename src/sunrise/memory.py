@@ -0,0 +1,154 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+
+import ctypes
+import dataclasses
+import mmap
+import os
+import pathlib
+import typing
+
+import numpy as np
+
+
+__all__ = [
+    'Usage',
+    'rss',
+    'residency',
+    'page_cache',
+]
+
+
+# What one scene object holds onto. `mapped` and `heap` are the arrays it
+# keeps alive for OSPRay to share: mapped ones only cost RSS as far as their
+# pages are in the page cache, heap ones cost it in full. `copied` is what
+# OSPRay copied out of our arrays into its own memory (Data without share),
+# and `handles` the OSPRay objects released on close.
+@dataclasses.dataclass
+class Usage:
+    mapped: int = 0
+    heap: int = 0
+    copied: int = 0
+    handles: int = 0
+    files: set[str] = dataclasses.field(default_factory=set)
+
+    def hold(self, what: typing.Any):
+        if not isinstance(what, np.ndarray):
+            return
+
+        filename = getattr(what, 'filename', None)
+        if isinstance(what, np.memmap) and filename is not None:
+            self.mapped += what.nbytes
+            self.files.add(str(filename))
+        else:
+            self.heap += what.nbytes
+
+    def own(self, copied: int=0):
+        self.handles += 1
+        self.copied += copied
+
+    def __add__(self, other: Usage) -> Usage:
+        return Usage(
+            mapped=self.mapped + other.mapped,
+            heap=self.heap + other.heap,
+            copied=self.copied + other.copied,
+            handles=self.handles + other.handles,
+            files=self.files | other.files,
+        )
+
+    def asdict(self) -> dict:
+        return dict(
+            mapped=self.mapped,
+            heap=self.heap,
+            copied=self.copied,
+            handles=self.handles,
+            files=len(self.files),
+        )
+
+
+# Resident set size of this process in bytes, split into anonymous memory,
+# file-backed pages (our memmaps among them) and shared memory where the
+# kernel reports it
+def rss() -> dict[str, int]:
+    usage = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('VmRSS', 'RssAnon', 'RssFile', 'RssShmem', 'VmHWM'):
+                    usage[name] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        usage['VmHWM'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return dict(
+        rss=usage.get('VmRSS'),
+        anon=usage.get('RssAnon'),
+        file=usage.get('RssFile'),
+        shmem=usage.get('RssShmem'),
+        peak=usage.get('VmHWM'),
+    )
+
+
+_PROT_READ = 0x1
+_MAP_SHARED = 0x01
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+@auto.functools.cache
+def _libc():
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long)
+    libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+    libc.mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte))
+    return libc
+
+
+# How much of a file is in the page cache, as (resident bytes, file size).
+# Maps the file read-only and asks mincore, so nothing is read from disk.
+def residency(path: pathlib.Path) -> tuple[int, int]:
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, 0
+
+    libc = _libc()
+    with open(path, 'rb') as f:
+        address = libc.mmap(None, size, _PROT_READ, _MAP_SHARED, f.fileno(), 0)
+    if address in (None, _MAP_FAILED):
+        raise OSError(ctypes.get_errno(), f'Cannot map {path}')
+
+    try:
+        pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+        vector = (ctypes.c_ubyte * pages)()
+        if libc.mincore(address, size, vector) != 0:
+            raise OSError(ctypes.get_errno(), f'mincore failed for {path}')
+        resident = int((np.frombuffer(vector, dtype='u1') & 1).sum())
+    finally:
+        libc.munmap(address, size)
+
+    return min(resident * mmap.PAGESIZE, size), size
+
+
+# Page cache residency of several files, in total and per file. Files that
+# cannot be checked (gone, or not a Linux kernel) are counted as missing.
+def page_cache(paths: typing.Iterable[str | pathlib.Path]) -> dict:
+    resident = total = missing = 0
+    for path in sorted(set(map(str, paths))):
+        try:
+            file_resident, file_size = residency(pathlib.Path(path))
+        except (OSError, AttributeError):
+            missing += 1
+            continue
+        resident += file_resident
+        total += file_size
+
+    return dict(
+        resident=resident,
+        size=total,
+        missing=missing,
+    )
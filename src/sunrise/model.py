@@ -155,6 +155,100 @@ class RenderingRequest:
     light: str
     # observation: str
 
+# `image` may borrow memory from the renderer (an RGBA array view of a mapped
+# framebuffer); hand `release` to the encoder, which calls it once the encode
+# has finished reading the image. `passes` is how many
+# accumulated passes adaptive rendering took, 1 otherwise. `partial` is set
+# when the city ran out of memory before every wanted cell was paged in, so
+# the image is missing buildings.
 @dataclasses.dataclass
 class RenderingResponse:
-   image: PIL.Image
+   image: PIL.Image | np.ndarray
+   release: typing.Callable[[], None] = lambda: None
+   passes: int = 1
+   partial: bool = False
+
+
+# A whole grid of tiles rendered as one frame. `width` and `height` are the
+# size of a single tile, and `tiles` lists the (row, col) tiles to return.
+@dataclasses.dataclass
+class GridRequest:
+    width: int
+    height: int
+    rows: int
+    cols: int
+    tiles: tuple[
+        tuple[
+            typing.Annotated[int, 'row'],
+            typing.Annotated[int, 'col'],
+        ],
+        ...
+    ]
+    position: tuple[
+        typing.Annotated[float, 'x'],
+        typing.Annotated[float, 'y'],
+        typing.Annotated[float, 'z'],
+    ]
+    direction: tuple[
+        typing.Annotated[float, 'x'],
+        typing.Annotated[float, 'y'],
+        typing.Annotated[float, 'z'],
+    ]
+    up: tuple[
+        typing.Annotated[float, 'x'],
+        typing.Annotated[float, 'y'],
+        typing.Annotated[float, 'z'],
+    ]
+    samples: int
+    hour: float
+    light: str
+
+@dataclasses.dataclass
+class GridResponse:
+   images: dict[tuple[int, int], PIL.Image | np.ndarray]
+   release: typing.Callable[[], None] = lambda: None
+   passes: int = 1
+   partial: bool = False
+
+
+# Screen points to look up in a view, without rendering it. The camera
+# fields are those of a RenderingRequest; `points` are (x, y) pixel
+# coordinates in the whole width x height image, with rows in the same order
+# as the images /api/v1/view/ returns.
+@dataclasses.dataclass
+class PickRequest:
+    width: int
+    height: int
+    position: tuple[
+        typing.Annotated[float, 'x'],
+        typing.Annotated[float, 'y'],
+        typing.Annotated[float, 'z'],
+    ]
+    direction: tuple[
+        typing.Annotated[float, 'x'],
+        typing.Annotated[float, 'y'],
+        typing.Annotated[float, 'z'],
+    ]
+    up: tuple[
+        typing.Annotated[float, 'x'],
+        typing.Annotated[float, 'y'],
+        typing.Annotated[float, 'z'],
+    ]
+    points: tuple[
+        tuple[
+            typing.Annotated[float, 'x'],
+            typing.Annotated[float, 'y'],
+        ],
+        ...
+    ]
+
+# What is under one picked point. A hit with no `building` is the earth, or a
+# building that was paged out meanwhile.
+@dataclasses.dataclass
+class PickResult:
+    point: tuple[float, float]
+    hit: bool
+    position: tuple[float, float, float] | None = None
+    state: str | None = None
+    building: str | None = None
+    primitive: int | None = None
@@ -5,8 +5,10 @@
 from __future__ import annotations
 
 from ._auto import auto
-import sunrise.util, sunrise.model
+import sunrise.util, sunrise.model, sunrise.arrayfile, sunrise.memory, sunrise.archive, sunrise.lod, sunrise.spatial, sunrise.snapshot
 
+import collections
+import concurrent.futures
 import contextlib
 import ctypes
 import dataclasses
@@ -58,6 +60,11 @@ def Read(
     dtype: np.DType,
 ) -> np.NDArray:
     print(f'trying to open {path}: ', end='')
+    if sunrise.arrayfile.is_container(path):
+        data = sunrise.arrayfile.read(path, dtype, mode='r')
+        print('success')
+        return data
+
     with open(path, 'r+b') as f:
         def Read(fmt: str, /) -> tuple:
             size = struct.calcsize(fmt)
@@ -81,7 +88,7 @@ def Map(
     *,
     dtype: auto.np.DType,
 ) -> auto.np.NDArray:
-    return auto.np.memmap(path, dtype=dtype, mode='c')
+    return sunrise.arrayfile.read(path, dtype, mode='c')
 
 def Data(
     array: np.ndarray,
@@ -91,19 +98,15 @@ def Data(
     share: bool=False,
 ) -> lib.OSPData:
     # print("DATA 1")
+    if isinstance(array, HandleArray):
+        return Data(array.array, type=type, share=share)
+
     if isinstance(array, list):
-        all_object = True
-        for i, x in enumerate(array):
-            if x is None:
-                raise ValueError("Nullptr not expected")
-            if not isinstance(x, lib.OSPObject):
-                all_object = False
-
-        if all_object:
-            array = (ctypes.cast(x, ctypes.c_void_p).value for x in array)
-            assert(array != None)
-            array = np.fromiter(array, dtype=np.uintp)
-            return Data(array, type=type)
+        if any(x is None for x in array):
+            raise ValueError("Nullptr not expected")
+
+        if all(isinstance(x, lib.OSPObject) for x in array):
+            return Data(HandleArray.of(array), type=type)
     
         array = np.asarray(array)
         return Data(array, type=type)
@@ -144,9 +147,83 @@ def Data(
 
     lib.ospRelease(src)
     # print("DATA 6")
+    _copied[Address(dst)] = array.nbytes
     return dst
 
 
+# Bytes OSPRay copied for each Data made without `share`, until whoever owns
+# the handle claims them with Copied
+_copied: dict[int, int] = {}
+
+
+def Copied(handle: lib.OSPData, /) -> int:
+    return _copied.pop(Address(handle), 0)
+
+
+# OSPRay handles as a growable uintp array. Appending each handle as its
+# object is created means a Data of thousands of them is one buffer handed to
+# OSPRay, with no pass over Python objects at that point.
+class HandleArray:
+    def __init__(self, capacity: int=16):
+        self._buffer = np.zeros(max(capacity, 1), dtype=np.uintp)
+        self._count = 0
+
+    @classmethod
+    def of(cls, handles: typing.Sequence[lib.OSPObject], /) -> HandleArray:
+        handles_ = cls(len(handles))
+        handles_._buffer[:len(handles)] = [Address(handle) for handle in handles]
+        handles_._count = len(handles)
+        if not handles_.array.all():
+            raise ValueError("Nullptr not expected")
+        return handles_
+
+    # Join several arrays with one copy each
+    @classmethod
+    def concatenate(cls, arrays: typing.Iterable[HandleArray], /) -> HandleArray:
+        arrays = [array.array for array in arrays]
+        count = sum(len(array) for array in arrays)
+        handles = cls(count)
+        if arrays:
+            np.concatenate(arrays, out=handles._buffer[:count])
+        handles._count = count
+        return handles
+
+    def append(self, handle: lib.OSPObject, /):
+        address = Address(handle)
+        if not address:
+            raise ValueError("Nullptr not expected")
+
+        if self._count == len(self._buffer):
+            buffer = np.zeros(2 * len(self._buffer), dtype=np.uintp)
+            buffer[:self._count] = self._buffer
+            self._buffer = buffer
+        self._buffer[self._count] = address
+        self._count += 1
+
+    def clear(self):
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._buffer[:self._count]
+
+
+# The raw pointer value of an OSPRay handle, 0 for None
+def Address(handle: lib.OSPObject | None, /) -> int:
+    if handle is None:
+        return 0
+    return ctypes.cast(handle, ctypes.c_void_p).value or 0
+
+
+# World-space bounds of a committed world, instance or group, as (lo, hi)
+def Bounds(handle: lib.OSPObject, /) -> tuple[np.ndarray, np.ndarray]:
+    bounds = lib.ospGetBounds(handle)
+    return np.array(bounds.lower, dtype='f4'), np.array(bounds.upper, dtype='f4')
+
+
 def Affine3f(
     *,
     sx: float = 1.0,
@@ -173,9 +250,22 @@ def with_exit_stack(func: callable, /):
     return wrapper
 
 
+# Objects that own OSPRay handles and the arrays those handles share. Every
+# object records what it holds in `usage` (see sunrise.memory.Usage):
+# arrays passed to `hold`, and handles passed to `own` along with any bytes
+# OSPRay copied for them.
+#
+# Handles are kept in an ospray.Arena and arrays in a plain list, so an
+# owner costs a few array slots rather than a closure per handle. On close
+# the exit stack unwinds first (entered objects and deferred callbacks), then
+# the handles are released, then the arrays are let go.
 class WithExitStackMixin:
     def __init__(self):
         self._stack = auto.contextlib.ExitStack()
+        self._arena = None
+        self._held = []
+        self._entered = []
+        self.usage = sunrise.memory.Usage()
     
     def __enter__(self):
         self.make()
@@ -186,34 +276,199 @@ class WithExitStackMixin:
     
     def close(self):
         self._stack.close()
+        if self._arena is not None:
+            self._arena.close()
+        self._held = []
+        self._entered = []
+        self.usage = sunrise.memory.Usage()
     
     def hold(self, what):
-        return self.defer(id, what)
+        self.usage.hold(what)
+        self._held.append(what)
+    
+    # Take over the caller's reference to `handle`, released on close
+    def own(self, handle, type: lib.OSPDataType | None=None, /):
+        if self._arena is None:
+            self._arena = ospray.Arena(lib)
+        self.usage.own(Copied(handle))
+        return self._arena.own(handle, type)
+
+    # Add a reference to a handle someone else owns, released on close
+    def retain(self, handle, type: lib.OSPDataType | None=None, /):
+        lib.ospRetain(handle)
+        return self.own(handle, type)
     
     def defer(self, callback, *args, **kwargs):
         self._stack.callback(callback, *args, **kwargs)
     
     def enter(self, other):
+        if isinstance(other, WithExitStackMixin):
+            self._entered.append(other)
         return self._stack.enter_context(other)
 
+    # What this object and everything it entered hold
+    def total_usage(self) -> sunrise.memory.Usage:
+        usage = self.usage
+        for other in self._entered:
+            usage = usage + other.total_usage()
+        return usage
+
+    # Handles this object and everything it entered own, by OSPDataType name
+    def total_handles(self) -> collections.Counter:
+        handles = collections.Counter()
+        if self._arena is not None:
+            names = _TypeNames()
+            for type, count in self._arena.counts().items():
+                handles[names.get(type, str(type))] += count
+        for other in self._entered:
+            handles.update(other.total_handles())
+        return handles
+
+
+@functools.cache
+def _TypeNames() -> dict[int, str]:
+    return {
+        value: name
+        for name in dir(lib)
+        if name.startswith('OSP_')
+        and isinstance(value := getattr(lib, name), int)
+        and value >= lib.OSP_OBJECT
+    }
 
-# BUILDING
-class Building(WithExitStackMixin):
-    def __init__(self, path: auto.pathlib.Path, name:str, scale: float):
-        super().__init__()
 
+# BUILDING
+class Building:
+    # With an `archive`, the mesh is sliced out of the state's packed blobs
+    # instead of memmapping the building's own files under `path`. Coarser
+    # levels of detail come from the archive too, or are derived from the
+    # full mesh when the archive was packed without them.
+    #
+    # Buildings whose meshes are copies of one prototype share its group
+    # through `prototypes`; each building only adds its own instance. A
+    # building owns no handles itself: the cell that makes it owns the
+    # instance in its arena, and `slot` is where it is in the cell's handles.
+    def __init__(
+        self,
+        path: auto.pathlib.Path,
+        name:str,
+        scale: float,
+        archive: sunrise.archive.Archive | None=None,
+        lod: int=sunrise.lod.FULL,
+        prototypes: PrototypeCache | None=None,
+    ):
         self.name = name
         self.path = path
         self.scale = scale
+        self.archive = archive
+        self.lod = lod
+        self.prototypes = prototypes
+        self.position = None
+        self.index = None
+        self.slot = None
+
+        # Which shared mesh this building is, and how it is placed. Names are
+        # only unique within a state, so the state's directory is part of it.
+        self.prototype = (path, name, lod)
+        self.transform = (np.ones(3, 'f4'), np.zeros(3, 'f4'))
     
+    # I/O phase: map the mesh and check that OSPRay will accept it. Makes no
+    # OSPRay calls, so it is safe to run on a worker thread.
+    def load(self):
+        if self.archive is not None and self.archive.has_level(self.lod):
+            position, index = self.archive.arrays(self.name, self.lod)
+            prototype, *self.transform = self.archive.prototype(self.name, self.lod)
+            self.prototype = (self.path, prototype, self.lod)
+        else:
+            if self.archive is not None:
+                position, index = self.archive.arrays(self.name)
+                prototype, *self.transform = self.archive.prototype(self.name)
+                self.prototype = (self.path, prototype, self.lod)
+            else:
+                position, index = sunrise.archive.building_files(self.path, self.name)
+                position = Map(position, dtype=sunrise.archive.POSITION_DTYPE)
+                index = Map(index, dtype=sunrise.archive.INDEX_DTYPE)
+
+            if len(position) == 0 or len(index) == 0:
+                raise ValueError(f'Building {self.name} has an empty mesh')
+            position, index = sunrise.lod.level(position, index, self.lod)
+
+        if len(position) == 0 or len(index) == 0:
+            raise ValueError(f'Building {self.name} has an empty mesh')
+        if int(index.view('u4').max()) >= len(position):
+            raise ValueError(f'Building {self.name} indexes past its {len(position)} vertices')
+
+        self.position = position
+        self.index = index
+
+    # Axis-aligned bounds and approximate resident size of a loaded mesh
+    def bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        xyz = self.position.view('f4').reshape(-1, 3)
+        return xyz.min(axis=0), xyz.max(axis=0)
+
+    def nbytes(self) -> int:
+        return self.position.nbytes + self.index.nbytes
+
+    def unload(self):
+        self.position = None
+        self.index = None
+
+    # Commit phase: instance the (possibly shared) prototype of a loaded mesh
+    # into `cell`. A shared prototype is given back by Cell.close.
+    def make(self, cell: Cell):
+        if self.position is None:
+            self.load()
+
+        if self.prototypes is not None:
+            prototype = self.prototypes.acquire(self.prototype, self.position, self.index)
+        else:
+            prototype = cell.enter(Prototype(self.position, self.index))
+
+        scale, offset = self.transform
+
+        # print(f'loading instance')
+        try:
+            instance = cell.own(lib.ospNewInstance(None), lib.OSP_INSTANCE)
+        except BaseException:
+            if self.prototypes is not None:
+                self.prototypes.release(self.prototype)
+            raise
+
+        lib.ospSetObject(instance, b'group', prototype.group)
+        lib.ospSetAffine3f(instance, b'transform', Affine3f(
+            # sx=1.5 * self.scale,
+            sx=float(scale[0]) * self.scale,
+            # sx=-1.0 * self.scale,
+            sy=float(scale[1]) * self.scale,
+            # sy=1.5 * self.scale,
+            # sy=-1.0 * self.scale,
+            # sz=-1.0 * self.scale,
+            # sz=1.0,
+            sz=float(scale[2]) * self.scale,
+            tx=float(offset[0]) * self.scale,
+            ty=float(offset[1]) * self.scale,
+            tz=float(offset[2]) * self.scale,
+        ))
+        lib.ospCommit(instance)
+        # print('loaded instance')
+
+        self.slot = len(cell.handles)
+        cell.handles.append(instance)
+
+
+# The geometry, model and group of one mesh. Buildings that are translated
+# and scaled copies of each other share a single Prototype and differ only in
+# their instance transforms.
+class Prototype(WithExitStackMixin):
+    def __init__(self, position: np.ndarray, index: np.ndarray):
+        super().__init__()
+
+        self.position = position
+        self.index = index
+
     def make(self):
-        position = self.path / f'{self.name}.mesh.vec3f[].vertex.position.bin'
+        position, index = self.position, self.index
+
         # print(f'Loading vertices {position}')
-        position = Map(position, dtype=[
-            ('x', 'f4'),
-            ('y', 'f4'),
-            ('z', 'f4'),
-        ])
         # print()
         # print()
         # print("POSITION")
@@ -234,15 +489,9 @@ class Building(WithExitStackMixin):
         # print(f'[ {zlo:.1f} ]-[ {zmi:.1f} ]-[ {zhi:.1f} ] ({position["z"][0]:.1f})')
         self.hold(position)
         position = Data(position, type=lib.OSP_VEC3F, share=True)
-        self.defer(lib.ospRelease, position)
+        self.own(position, lib.OSP_DATA)
 
-        index = self.path / f'{self.name}.mesh.vec3ui[].vertex.index.bin'
         # print(f'Loading quads {index}')
-        index = Map(index, dtype=[
-            ('a', 'u4'),
-            ('b', 'u4'),
-            ('c', 'u4'),
-        ])
         # print()
         # print()
         # print("INDEX")
@@ -252,13 +501,13 @@ class Building(WithExitStackMixin):
 
         self.hold(index)
         index = Data(index, type=lib.OSP_VEC3UI, share=True)
-        self.defer(lib.ospRelease, index)
+        self.own(index, lib.OSP_DATA)
 
         
         # print(self.path)
 
         geometry = lib.ospNewGeometry(b'mesh')
-        self.defer(lib.ospRelease, geometry)
+        self.own(geometry, lib.OSP_GEOMETRY)
         lib.ospSetObject(geometry, b'vertex.position', position)
         lib.ospSetObject(geometry, b'index', index)
         lib.ospSetVec3f(geometry, b'color', 0.0, 1.0, 1.0) 
@@ -267,7 +516,7 @@ class Building(WithExitStackMixin):
         # print(f'loading materials')
         material = lib.ospNewMaterial(b'obj')
         lib.ospSetVec3f(material, b'kd', 0.5, 0.7, 0.2)
-        self.defer(lib.ospRelease, material)
+        self.own(material, lib.OSP_MATERIAL)
 
         # materials = []
         # with open(self.path / 'OSPMaterial[].obj.vec3f.kd.bin', 'rb') as f:
@@ -275,7 +524,7 @@ class Building(WithExitStackMixin):
         #         r, g, b = auto.struct.unpack('fff', f.read(12))
         #
         #         material = lib.ospNewMaterial(b'obj')
-        #         self.defer(lib.ospRelease, material)
+        #         self.own(material, lib.OSP_MATERIAL)
         #         # lib.ospSetVec3f(material, b'kd', r, g, b)
         #
         #         if i == 0:
@@ -292,7 +541,7 @@ class Building(WithExitStackMixin):
         # materials = Data([
         #     *materials,
         # ], type=lib.OSP_MATERIAL)
-        # self.defer(lib.ospRelease, materials)
+        # self.own(materials, lib.OSP_DATA)
         # print('loaded materials')
 
         # index = self.path / 'TOSPGeometricModel.uchar[].index.bin'
@@ -303,12 +552,12 @@ class Building(WithExitStackMixin):
         # ])
         # self.hold(index)
         # index = Data(index, type=lib.OSP_UCHAR, share=True)
-        # self.defer(lib.ospRelease, index)
+        # self.own(index, lib.OSP_DATA)
         # print('loaded index')
         
         # print(f'loading geomodel')
         geomodel = lib.ospNewGeometricModel(None)
-        self.defer(lib.ospRelease, geomodel)
+        self.own(geomodel, lib.OSP_GEOMETRIC_MODEL)
         lib.ospSetObject(geomodel, b'geometry', geometry)
         lib.ospSetObject(geomodel, b'material', material)
         lib.ospSetVec4f(geomodel, b'color', 0.0, 1.0, 1.0, 1.0)
@@ -320,35 +569,18 @@ class Building(WithExitStackMixin):
         geomodels = Data([
             geomodel,
         ], type=lib.OSP_GEOMETRIC_MODEL)
-        self.defer(lib.ospRelease, geomodel)
+        self.own(geomodels, lib.OSP_DATA)
         # print('loaded geomodels')
 
         # print(f'loading group')
         group = lib.ospNewGroup()
-        self.defer(lib.ospRelease, group)
+        self.own(group, lib.OSP_GROUP)
         lib.ospSetObject(group, b'geometry', geomodels)
         lib.ospCommit(group)
         # print('loaded group')
 
-        # print(f'loading instance')
-        instance = lib.ospNewInstance(None)
-        self.defer(lib.ospRelease, instance)
-        lib.ospSetObject(instance, b'group', group)
-        lib.ospSetAffine3f(instance, b'transform', Affine3f(
-            # sx=1.5 * self.scale,
-            sx=1.0 * self.scale,
-            # sx=-1.0 * self.scale,
-            sy=1.0 * self.scale,
-            # sy=1.5 * self.scale,
-            # sy=-1.0 * self.scale,
-            # sz=-1.0 * self.scale,
-            # sz=1.0,
-            sz=1.0 * self.scale,
-        ))
-        lib.ospCommit(instance)
-        # print('loaded instance')
+        self.group = group
 
-        self.instance = instance
 
 # BACKGROUND
 class Background(WithExitStackMixin):
@@ -366,8 +598,9 @@ class Background(WithExitStackMixin):
         ])
 
         self.hold(vertex__position)
+        positions = vertex__position
         vertex__position = Data(vertex__position, type=lib.OSP_VEC3F, share=True)
-        self.defer(lib.ospRelease, vertex__position)
+        self.own(vertex__position, lib.OSP_DATA)
         print('loaded vertex.position')
 
         vertex__color = self.path / 'OSPGeometry.mesh.vec3f[].vertex.color.bin'
@@ -377,7 +610,7 @@ class Background(WithExitStackMixin):
         ])
         self.hold(vertex__color)
         vertex__color = Data(vertex__color, type=lib.OSP_VEC3F, share=True)
-        self.defer(lib.ospRelease, vertex__color)
+        self.own(vertex__color, lib.OSP_DATA)
         print('loaded vertex.color')
 
         texdata = Map(self.path / 'OSPGeometry.mesh.vec3f[].vertex.color.bin', dtype=[
@@ -385,16 +618,16 @@ class Background(WithExitStackMixin):
         ])
         self.hold(texdata)
         texdata = Data(texdata, type=lib.OSP_VEC3F, share=True)
-        self.defer(lib.ospRelease, texdata)
+        self.own(texdata, lib.OSP_DATA)
 
         texture = lib.ospNewTexture(b'texture2d')
-        self.defer(lib.ospRelease, texture)
+        self.own(texture, lib.OSP_TEXTURE)
         lib.ospSetObject(texture, b'data', texdata)
         lib.ospSetUInt(texture, b'format', lib.OSP_TEXTURE_RGB32F)
         lib.ospCommit(texture)
 
         material = lib.ospNewMaterial(b'obj')
-        self.defer(lib.ospRelease, material)
+        self.own(material, lib.OSP_MATERIAL)
         lib.ospSetObject(material, b'map_kd', texture)
         # lib.ospSetObject(material, b'map_ks', texture)
         lib.ospSetFloat(material, b'ns', 1.0)
@@ -408,12 +641,12 @@ class Background(WithExitStackMixin):
         ])
         self.hold(index)
         index = Data(index, type=lib.OSP_VEC4UI-1, share=True)
-        self.defer(lib.ospRelease, index)
+        self.own(index, lib.OSP_DATA)
         print('loaded index')
 
         print(f'loading geometry')
         geometry = lib.ospNewGeometry(b'mesh')
-        self.defer(lib.ospRelease, geometry)
+        self.own(geometry, lib.OSP_GEOMETRY)
         lib.ospSetObject(geometry, b'vertex.position', vertex__position)
         lib.ospSetObject(geometry, b'vertex.color', vertex__color)
         # lib.ospSetObject(geometry, b'material', material)
@@ -423,7 +656,7 @@ class Background(WithExitStackMixin):
 
         print(f'loading geomodel')
         geomodel = lib.ospNewGeometricModel(None)
-        self.defer(lib.ospRelease, geomodel)
+        self.own(geomodel, lib.OSP_GEOMETRIC_MODEL)
         lib.ospSetObject(geomodel, b'geometry', geometry)
         lib.ospSetObject(geomodel, b'material', material)
         lib.ospCommit(geomodel)
@@ -433,20 +666,20 @@ class Background(WithExitStackMixin):
         geomodels = Data([
             geomodel,
         ], type=lib.OSP_GEOMETRIC_MODEL)
-        self.defer(lib.ospRelease, geomodels)
+        self.own(geomodels, lib.OSP_DATA)
         
         print('loaded geomodels')
 
         print(f'loading group')
         group = lib.ospNewGroup()
-        self.defer(lib.ospRelease, group)
+        self.own(group, lib.OSP_GROUP)
         lib.ospSetObject(group, b'geometry', geomodels)
         lib.ospCommit(group)
         print('loaded group')
 
         print(f'loading instance')
         instance = lib.ospNewInstance(None)
-        self.defer(lib.ospRelease, instance)
+        self.own(instance, lib.OSP_INSTANCE)
         lib.ospSetObject(instance, b'group', group)
         lib.ospSetAffine3f(instance, b'transform', Affine3f(
             sx=-1.0 * self.scale,
@@ -460,6 +693,20 @@ class Background(WithExitStackMixin):
         print('loaded instance')
 
         self.instance = instance
+        self.lo, self.hi = Bounds(instance)
+        self.center, self.radius = self.sphere(positions)
+
+    # A sphere around the mesh in world space, through the instance's flip
+    # of x and y. It fits a globe far tighter than its bounding box does.
+    def sphere(self, positions: np.ndarray) -> tuple[np.ndarray, float]:
+        xyz = np.stack([positions['x'], positions['y'], positions['z']], axis=-1)
+        xyz = xyz * np.array([-self.scale, -self.scale, self.scale], dtype='f4')
+        if len(xyz) == 0:
+            return np.zeros(3, dtype='f4'), 0.0
+
+        center = (xyz.min(axis=0) + xyz.max(axis=0)) / 2
+        radius = float(np.sqrt(((xyz - center) ** 2).sum(axis=1).max()))
+        return center, radius
 
 
 class Roads(WithExitStackMixin):
@@ -476,7 +723,7 @@ class Roads(WithExitStackMixin):
         ])
         self.hold(vertex_position_radius)
         vertex_position_radius = Data(vertex_position_radius, type=lib.OSP_VEC4F, share=True)
-        self.defer(lib.ospRelease, vertex_position_radius)
+        self.own(vertex_position_radius, lib.OSP_DATA)
         
         index = self.path / 'OSPGeometry.curve.index.uint[].bin'
         index = Map(index, dtype=[
@@ -484,31 +731,31 @@ class Roads(WithExitStackMixin):
         ])
         self.hold(index)
         index = Data(index, type=lib.OSP_UINT, share=True)
-        self.defer(lib.ospRelease, index)
+        self.own(index, lib.OSP_DATA)
         
         geometry = lib.ospNewGeometry(b'curve')
-        self.defer(lib.ospRelease, geometry)
+        self.own(geometry, lib.OSP_GEOMETRY)
         lib.ospSetObject(geometry, b'vertex.position_radius', vertex_position_radius)
         lib.ospSetObject(geometry, b'index', index)
         lib.ospCommit(geometry)
         
         geomodel = lib.ospNewGeometricModel(None)
-        self.defer(lib.ospRelease, geomodel)
+        self.own(geomodel, lib.OSP_GEOMETRIC_MODEL)
         lib.ospSetObject(geomodel, b'geometry', geometry)
         lib.ospCommit(geomodel)
         
         geomodels = Data([
             geomodel,
         ], type=lib.OSP_GEOMETRIC_MODEL)
-        self.defer(lib.ospRelease, geomodels)
+        self.own(geomodels, lib.OSP_DATA)
         
         group = lib.ospNewGroup()
-        self.defer(lib.ospRelease, group)
+        self.own(group, lib.OSP_GROUP)
         lib.ospSetObject(group, b'geometry', geomodels)
         lib.ospCommit(group)
         
         instance = lib.ospNewInstance(None)
-        self.defer(lib.ospRelease, instance)
+        self.own(instance, lib.OSP_INSTANCE)
         lib.ospSetObject(instance, b'group', group)
 
         lib.ospSetAffine3f(instance, b'transform', Affine3f(
@@ -524,36 +771,424 @@ class Roads(WithExitStackMixin):
         self.instance = instance
 
 
-class City(WithExitStackMixin):
-    def __init__(self, path: auto.pathlib.Path):
+# Log a progress event at most every `interval` seconds instead of once per
+# item, so a 30k-building startup does not spend its time on terminal I/O
+class ThrottledProgress:
+    def __init__(self, logger, *, event: str, total: int, interval: float=2.0, **fields):
+        self.logger = logger
+        self.event = event
+        self.total = total
+        self.interval = interval
+        self.fields = fields
+
+        self.done = 0
+        self._last = time.monotonic()
+
+    def update(self, n: int=1):
+        self.done += n
+        now = time.monotonic()
+        if now - self._last >= self.interval or self.done == self.total:
+            self._last = now
+            self.logger.info(event=self.event, done=self.done, total=self.total, **self.fields)
+
+
+# Prototypes in use by resident buildings, keyed by (state directory,
+# prototype name, level of detail) and closed once the last building using
+# one is closed
+class PrototypeCache:
+    def __init__(self):
+        self._prototypes: dict[tuple[auto.pathlib.Path, str, int], list] = {}
+        self._lock = auto.threading.Lock()
+
+        self.instances = 0
+
+    def acquire(self, key: tuple[auto.pathlib.Path, str, int], position: np.ndarray, index: np.ndarray) -> Prototype:
+        with self._lock:
+            entry = self._prototypes.get(key)
+            if entry is None:
+                prototype = Prototype(position, index)
+                prototype.make()
+                entry = self._prototypes[key] = [prototype, 0]
+            entry[1] += 1
+            self.instances += 1
+            return entry[0]
+
+    def release(self, key: tuple[auto.pathlib.Path, str, int]):
+        with self._lock:
+            entry = self._prototypes[key]
+            entry[1] -= 1
+            self.instances -= 1
+            if entry[1] == 0:
+                del self._prototypes[key]
+                entry[0].close()
+
+    # What the prototypes in use hold, per state directory name
+    def usage(self) -> dict[str, sunrise.memory.Usage]:
+        with self._lock:
+            entries = list(self._prototypes.items())
+
+        usage = {}
+        for (path, _, _), (prototype, _) in entries:
+            usage[path.name] = usage.get(path.name, sunrise.memory.Usage()) + prototype.total_usage()
+        return usage
+
+    def stats(self) -> dict:
+        with self._lock:
+            prototypes = len(self._prototypes)
+            return dict(
+                prototypes=prototypes,
+                instances=self.instances,
+                dedup_ratio=(self.instances / prototypes) if prototypes else 1.0,
+            )
+
+
+# A cube of one state, `City.cell_size` on a side, whose buildings are made
+# resident in OSPRay and evicted together at one level of detail. Buildings
+# belong to the cell that holds the centre of their bounds; `lo` and `hi`
+# cover all of them. `sizes` is the approximate resident size at each level.
+# Keys are (state, i, j, k), so cells of neighbouring states never merge.
+class Cell(WithExitStackMixin):
+    def __init__(
+        self,
+        *,
+        key: tuple[str, int, int, int],
+        names: list[str],
+        lo: np.ndarray,
+        hi: np.ndarray,
+        sizes: dict[int, int],
+        path: auto.pathlib.Path,
+        archive: sunrise.archive.Archive | None,
+        load: typing.Callable[[list[Building]], list[Building]],
+        prototypes: PrototypeCache | None=None,
+        lod: int=sunrise.lod.FULL,
+    ):
         super().__init__()
 
+        self.key = key
+        self.names = names
+        self.lo = lo
+        self.hi = hi
+        self.sizes = sizes
         self.path = path
+        self.archive = archive
+        self.load = load
+        self.prototypes = prototypes
+        self.lod = lod
+
         self.buildings = []
+        self.handles = HandleArray(len(names))
+        self.made = False
+
+    # The same cell at another level of detail, not yet made
+    def at(self, lod: int) -> Cell:
+        return Cell(
+            key=self.key,
+            names=self.names,
+            lo=self.lo,
+            hi=self.hi,
+            sizes=self.sizes,
+            path=self.path,
+            archive=self.archive,
+            load=self.load,
+            prototypes=self.prototypes,
+            lod=lod,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.sizes[self.lod]
+
+    # Distance from `point` to the nearest point of the cell's bounds
+    def distance(self, point: tuple[float, float, float]) -> float:
+        point = np.asarray(point, dtype='f4')
+        nearest = np.clip(point, self.lo, self.hi)
+        return float(np.linalg.norm(point - nearest))
+
+    def make(self):
+        buildings = self.load([
+            Building(
+                path=self.path,
+                name=name,
+                scale=1,
+                archive=self.archive,
+                lod=self.lod,
+                prototypes=self.prototypes,
+            )
+            for name in self.names
+        ])
+        for building in buildings:
+            building.make(self)
+            self.buildings.append(building)
+        self.made = True
+
+    # The cell's arena releases every building's instance at once; shared
+    # prototypes are given back per building, as each holds one reference
+    def close(self):
+        super().close()
+        if self.prototypes is not None:
+            for building in self.buildings:
+                self.prototypes.release(building.prototype)
+        self.buildings = []
+        self.handles.clear()
+        self.made = False
+
+
+# One state's (or county's) buildings: every building's name and bounds,
+# resident or not, the spatial index over them and the cells they are paged
+# in by. A state is indexed on its own, so states can come and go while the
+# others stay resident.
+class State:
+    def __init__(
+        self,
+        *,
+        name: str,
+        archive: sunrise.archive.Archive | None,
+        names: list[str],
+        spatial: sunrise.spatial.SpatialIndex,
+        cells: dict[tuple[str, int, int, int], Cell],
+        lo: np.ndarray | None=None,
+        hi: np.ndarray | None=None,
+    ):
+        self.name = name
+        self.archive = archive
+        self.names = names
+        self.spatial = spatial
+        self.cells = cells
+
+        # Bounds of every building, resident or not, and of each cell; lo and
+        # hi are None without buildings
+        self.lo = lo
+        self.hi = hi
+        self.cell_lo = np.array([cell.lo for cell in cells.values()], dtype='f4').reshape(-1, 3)
+        self.cell_hi = np.array([cell.hi for cell in cells.values()], dtype='f4').reshape(-1, 3)
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.archive.dedup_ratio() if self.archive is not None else 1.0
+
+    def stats(self) -> dict:
+        return dict(
+            buildings=len(self.names),
+            cells=len(self.cells),
+            packed=self.archive is not None,
+            dedup_ratio=self.dedup_ratio,
+        )
+
+
+class City(WithExitStackMixin):
+    DEFAULT_STATES = ('AK',)
+    DEFAULT_CELL_SIZE = 10.0  # km
+    DEFAULT_RADIUS = 100.0  # km
+    DEFAULT_MEMORY_BYTES = 2 * 1024 * 1024 * 1024
+    DEFAULT_LOD_DISTANCES = (2.0, 10.0)  # km at which DECIMATED, then BOX take over
+
+    def __init__(
+        self,
+        path: auto.pathlib.Path,
+        workers: int | None=None,
+        *,
+        states: typing.Iterable[str]=DEFAULT_STATES,
+        cell_size: float=DEFAULT_CELL_SIZE,
+        radius: float=DEFAULT_RADIUS,
+        memory_bytes: int=DEFAULT_MEMORY_BYTES,
+        lod_distances: tuple[float, ...]=DEFAULT_LOD_DISTANCES,
+        snapshot: sunrise.snapshot.Snapshot | None=None,
+    ):
+        super().__init__()
+
+        self.path = path
+        self.snapshot = snapshot
+        self.earth_path = snapshot.earth_path if snapshot is not None else path / 'Earth'
+        self.hdri_path = (
+            snapshot.hdri_path
+            if snapshot is not None else
+            path / 'space' / 'OSPTexture.texture2d.data.vec2f.bin'
+        )
+        self.workers = workers or auto.os.cpu_count() or 1
+        self.cell_size = cell_size
+        self.radius = radius
+        self.memory_bytes = memory_bytes
+        self.lod_distances = tuple(lod_distances)
+        self.logger = auto.structlog.get_logger('sunrise.scene')
+
+        # The states loaded by make; add_state and remove_state change the
+        # set afterwards
+        self.initial_states = tuple(states)
+        self.states: dict[str, State] = {}
+        # Sorted names of `states`, replaced whole whenever the set changes so
+        # it can be read without the lock
+        self._state_names: tuple[str, ...] = ()
+        self.resident: collections.OrderedDict[tuple[str, int, int, int], Cell] = collections.OrderedDict()
+        self.resident_bytes = 0
+        self.version = 0
+
+        # Cells being made by a `page` with the lock released, by key, and
+        # the budget set aside for them
+        self._paging: set[tuple[str, int, int, int]] = set()
+        self.reserved_bytes = 0
+
+        # Evicted cells stay made until every scene has committed a world
+        # that no longer references them, since their meshes are shared with
+        # OSPRay rather than copied
+        self._retired: list[tuple[int, Cell]] = []
+        self.prototypes = PrototypeCache()
+
+        # The version each scene last committed to its world, by id
+        self._views: dict[int, int] = {}
+        self._lock = auto.threading.Lock()
+
+        self.page_ins = 0
+        self.evictions = 0
+        self.instances_copied = 0
 
     # Get all buildings for a given state
     def get_building_list(self, state: str):
-        building_names = auto.os.listdir(f'data/pre/{state}')
+        building_names = auto.os.listdir(self.path / 'pre' / state)
         return building_names
-    
-    def make(self):
-        state = 'AK'
-        all_buildings = self.get_building_list(state)
-        total = len(all_buildings)
-        i = 1
-        for name in all_buildings:
-            print(f'BUILDING {name}')
-            building = self.enter(Building(
+
+    # Open the state's packed archive, from the snapshot if it has one or
+    # else if `python -m sunrise.archive` has been run for it
+    def get_archive(self, state: str) -> sunrise.archive.Archive | None:
+        if self.snapshot is not None and state in self.snapshot.states:
+            return self.snapshot.archive(state)
+
+        path = self.path / 'pack' / state
+        if not sunrise.archive.Archive.exists(path):
+            return None
+        return sunrise.archive.Archive(path)
+
+    # Map and validate every building on the loader pool. Buildings that fail
+    # validation are logged and left out rather than failing the whole city.
+    def load_buildings(self, buildings: list[Building]) -> list[Building]:
+        progress = ThrottledProgress(self.logger, event='city_progress', phase='load', total=len(buildings))
+
+        ok = [False] * len(buildings)
+        futures = {
+            self._pool.submit(building.load): i
+            for i, building in enumerate(buildings)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                future.result()
+            except (OSError, ValueError) as e:
+                self.logger.warning(event='building_skipped', name=buildings[i].name, error=str(e))
+            else:
+                ok[i] = True
+            progress.update()
+
+        # Keep the original order so instance order is stable between runs
+        return [building for building, good in zip(buildings, ok) if good]
+
+    # Bounds of every building in a state, and its size at each level of
+    # detail (one column per level). Packed archives carry these in their
+    # tables; otherwise every mesh is mapped once to find them.
+    def survey(
+        self,
+        state: str,
+        archive: sunrise.archive.Archive | None,
+    ) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+        if archive is not None:
+            return (
+                archive.names,
+                archive.table['lo'],
+                archive.table['hi'],
+                archive.sizes(),
+            )
+
+        buildings = self.load_buildings([
+            Building(
                 path=self.path / "gen" / state,
                 name=name,
                 scale=1,
-            ))
-            self.buildings.append(building)
-            print(f'{i} / {total}')
-            i += 1
+            )
+            for name in self.get_building_list(state)
+        ])
 
-            if i == 30000:
-                break
+        names, lo, hi, nbytes = [], [], [], []
+        for building in buildings:
+            names.append(building.name)
+            building_lo, building_hi = building.bounds()
+            lo.append(building_lo)
+            hi.append(building_hi)
+            nbytes.append(building.nbytes())
+            building.unload()
+
+        full = np.array(nbytes, dtype='u8')
+        return (
+            names,
+            np.array(lo, dtype='f4').reshape(-1, 3),
+            np.array(hi, dtype='f4').reshape(-1, 3),
+            np.stack([
+                sunrise.archive.estimate_nbytes(full, lod)
+                for lod in sunrise.lod.LEVELS
+            ], axis=1),
+        )
+
+    # Group a state's buildings into cells by the centre of their bounds, and
+    # index their bounds for spatial queries. A snapshot taken with the same
+    # cell size already has the grouping. Reads only this state's files.
+    def index_state(self, state: str) -> State:
+        archive = self.get_archive(state)
+        names, lo, hi, nbytes = self.survey(state, archive)
+        spatial = (
+            archive.spatial
+            if archive is not None else
+            sunrise.spatial.SpatialIndex.of(lo, hi)
+        )
+
+        if (
+            self.snapshot is not None
+            and state in self.snapshot.states
+            and self.snapshot.cell_size == self.cell_size
+        ):
+            groups = self.snapshot.cells(state)
+        else:
+            groups = sunrise.spatial.group_cells(lo, hi, self.cell_size)
+
+        cells = {}
+        for key, members in groups:
+            key = (state, *key)
+            cells[key] = Cell(
+                key=key,
+                names=[names[i] for i in members],
+                lo=lo[members].min(axis=0),
+                hi=hi[members].max(axis=0),
+                sizes={
+                    lod: int(nbytes[members, column].sum())
+                    for column, lod in enumerate(sunrise.lod.LEVELS)
+                },
+                path=self.path / "gen" / state,
+                archive=archive,
+                load=self.load_buildings,
+                prototypes=self.prototypes,
+            )
+
+        return State(
+            name=state,
+            archive=archive,
+            names=names,
+            spatial=spatial,
+            cells=cells,
+            lo=lo.min(axis=0) if len(lo) else None,
+            hi=hi.max(axis=0) if len(hi) else None,
+        )
+
+    def make(self):
+        make_start = time.time_ns()
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix='city-load',
+        )
+        self.defer(self._pool.shutdown)
+        self.defer(self._close_cells)
+
+        index_start = time.time_ns()
+        for state in self.initial_states:
+            self.states[state] = self.index_state(state)
+        self._state_names = tuple(sorted(self.states))
+        index_time = time.time_ns() - index_start
 
         # building = self.path / state 
         # print(f'loading building {building}')
@@ -562,13 +1197,15 @@ class City(WithExitStackMixin):
         #     scale=1,
         # ))
         
-        earth = auto.pathlib.Path('data') / 'Earth'
+        earth_start = time.time_ns()
+        earth = self.earth_path
         print(f'loading earth {earth}')
         earth = self.enter(Background(
             path=earth,
             scale=0.999999 ** 4,
         ))
         print('loaded earth')
+        earth_time = time.time_ns() - earth_start
 
         # usa = self.path / 'USA'
         # print(f'loading usa {usa}')
@@ -601,25 +1238,440 @@ class City(WithExitStackMixin):
         #     scale=1,
         # ))
         # print('loaded roads')
-        building_instances = [b.instance for b in self.buildings]
-        # print(*building_instances)
-        exit
-
-        print(f'loading instances')
-        instances = Data([
-            building.instance,
-            earth.instance,
-            # usa.instance,
-            # tn.instance,
-            # knox.instance,
-            # roads.instance,
-            *building_instances
-            # building_instances[0],
-        ], type=lib.OSP_INSTANCE)
-        self.defer(lib.ospRelease, instances)
-        print('loaded instances')
 
+        self.earth = earth
+        self.instances = None
+        self.commit_instances()
+
+        self.logger.info(
+            event='city_make_ns',
+            time=time.time_ns() - make_start,
+            index=index_time,
+            earth=earth_time,
+            states={name: state.stats() for name, state in self.states.items()},
+            workers=self.workers,
+        )
+
+    # Rebuild the instance list from the earth and every resident cell. Each
+    # cell recorded its handles as it made its buildings, so this joins a few
+    # arrays rather than walking every instance. The previous list stays
+    # alive inside any world still using it.
+    def commit_instances(self):
+        instances = Data(HandleArray.concatenate([
+            HandleArray.of([self.earth.instance]),
+            # HandleArray.of([usa.instance, tn.instance, knox.instance, roads.instance]),
+            *(cell.handles for cell in self.resident.values()),
+        ]), type=lib.OSP_INSTANCE)
+
+        if self.instances is not None:
+            lib.ospRelease(self.instances)
         self.instances = instances
+        self.instances_copied = Copied(instances)
+        self.version += 1
+
+    # Bring a state into the live city. It is indexed without holding the
+    # lock, so scenes keep rendering meanwhile, and its cells are paged in by
+    # the next `page` near them.
+    def add_state(self, name: str) -> State:
+        with self._lock:
+            if name in self.states:
+                return self.states[name]
+
+        start = time.time_ns()
+        state = self.index_state(name)
+
+        with self._lock:
+            state = self.states.setdefault(name, state)
+            self._state_names = tuple(sorted(self.states))
+
+        self.logger.info(event='city_state_added_ns', time=time.time_ns() - start, state=name, **state.stats())
+        return state
+
+    # Take a state out of the live city. Its resident cells are retired like
+    # evicted ones, and every scene re-commits the new instance list before
+    # its next frame; nothing else is reloaded.
+    def remove_state(self, name: str) -> State:
+        with self._lock:
+            state = self.states.pop(name)
+            self._state_names = tuple(sorted(self.states))
+
+            for key in [key for key in self.resident if key[0] == name]:
+                self._retire(self.resident[key])
+            self.commit_instances()
+            self._collect()
+
+        self.logger.info(event='city_state_removed', state=name, version=self.version)
+        return state
+
+    # The states currently in the city, sorted. Does not take the lock, so
+    # the event loop can call it while a cell is being paged in.
+    def state_names(self) -> tuple[str, ...]:
+        return self._state_names
+
+    # Make the cells within `radius` of `position` resident, nearest first,
+    # at the level of detail their distance calls for, evicting the least
+    # recently used cold cells to stay under the memory budget. Returns the
+    # instance list to use, its version, and whether every wanted cell fit;
+    # a view without them all is missing buildings and must not be cached.
+    # Nothing is freed until `view` reports the commit through `committed`.
+    #
+    # Only the choice of cells happens under the lock: the new cells are
+    # reserved and marked as paging, made with the lock released (archive
+    # I/O, prototypes and OSPRay commits), then installed under the lock
+    # again. A cell another `page` is still making is left out of this view.
+    def page(self, position: tuple[float, float, float]) -> tuple[int, lib.OSPData, bool]:
+        page_start = time.time_ns()
+        with self._lock:
+            wanted = sorted(
+                (
+                    (distance, cell)
+                    for state in self.states.values()
+                    for cell in state.cells.values()
+                    if (distance := cell.distance(position)) <= self.radius
+                ),
+                key=lambda pair: pair[0],
+            )
+            hot = {cell.key for _, cell in wanted}
+
+            build = []
+            changed = False
+            complete = True
+            for distance, cell in wanted:
+                lod = sunrise.lod.select(distance, self.lod_distances)
+                current = self.resident.get(cell.key)
+                if current is not None and current.lod == lod:
+                    self.resident.move_to_end(cell.key)
+                    continue
+                if cell.key in self._paging:
+                    complete = False
+                    continue
+
+                # The cell at its current level makes way for it once made
+                cell = cell.at(lod)
+                nbytes = cell.nbytes - (current.nbytes if current is not None else 0)
+                changed |= self._evict(nbytes, keep=hot)
+                if self.resident_bytes + self.reserved_bytes + nbytes > self.memory_bytes and (self.resident or self.reserved_bytes):
+                    self.logger.warning(
+                        event='city_budget_exceeded',
+                        cell=cell.key,
+                        resident_bytes=self.resident_bytes,
+                        reserved_bytes=self.reserved_bytes,
+                        memory_bytes=self.memory_bytes,
+                    )
+                    complete = False
+                    break
+
+                # A retired cell at the same level is taken back as it is
+                revived = self._revive(cell)
+                if revived is not None:
+                    self._install(revived)
+                    changed = True
+                    continue
+
+                self._paging.add(cell.key)
+                self.reserved_bytes += nbytes
+                build.append((cell, nbytes))
+
+            if changed:
+                self.commit_instances()
+            if not build:
+                if changed:
+                    self._log_page(page_start)
+                return self.version, self.instances, complete
+
+        made = []
+        try:
+            for cell, _ in build:
+                cell.make()
+                made.append(cell)
+        finally:
+            with self._lock:
+                for cell, nbytes in build:
+                    self._paging.discard(cell.key)
+                    self.reserved_bytes -= nbytes
+                for cell in made:
+                    self._install(cell)
+                if made:
+                    self.commit_instances()
+                    self._log_page(page_start)
+                result = self.version, self.instances, complete and len(made) == len(build)
+
+            # The cell that failed, if any, may be partly made
+            for cell, _ in build[len(made):]:
+                cell.close()
+
+        return result
+
+    def _log_page(self, page_start: int):
+        self.logger.info(
+            event='city_page_ns',
+            time=time.time_ns() - page_start,
+            version=self.version,
+            **self.stats(),
+        )
+
+    # The current instance list and its version, without paging anything in
+    def current(self) -> tuple[int, lib.OSPData]:
+        with self._lock:
+            return self.version, self.instances
+
+    # `view` has committed a world built from the instance list of `version`,
+    # so retired cells older than that are free as far as it is concerned
+    def committed(self, view: object, version: int):
+        with self._lock:
+            self._views[id(view)] = version
+            self._collect()
+
+    # `view` is gone and no longer holds anything back
+    def forget(self, view: object):
+        with self._lock:
+            self._views.pop(id(view), None)
+            self._collect()
+
+    # Take back a retired cell with the same key and level, if there is one
+    def _revive(self, cell: Cell) -> Cell | None:
+        for pair in self._retired:
+            if pair[1].key == cell.key and pair[1].lod == cell.lod:
+                self._retired.remove(pair)
+                return pair[1]
+        return None
+
+    # Make a made cell resident in place of the one with its key, if any. A
+    # cell whose state was removed while it was being made is retired
+    # straight away instead.
+    def _install(self, cell: Cell):
+        if cell.key[0] not in self.states:
+            self._retired.append((self.version + 1, cell))
+            return
+
+        current = self.resident.get(cell.key)
+        if current is not None:
+            self._retire(current)
+
+        self.resident[cell.key] = cell
+        self.resident_bytes += cell.nbytes
+        self.page_ins += 1
+
+    # Evict cold cells until `nbytes` more would fit. Returns whether any
+    # cell was evicted.
+    def _evict(self, nbytes: int, *, keep: set) -> bool:
+        evicted = False
+        for key in list(self.resident):
+            if self.resident_bytes + self.reserved_bytes + nbytes <= self.memory_bytes:
+                break
+            if key in keep:
+                continue
+
+            self._retire(self.resident[key])
+            self.evictions += 1
+            evicted = True
+
+        return evicted
+
+    # Take a cell out of the resident set. It is closed by _collect once no
+    # world can reference it.
+    def _retire(self, cell: Cell):
+        del self.resident[cell.key]
+        self.resident_bytes -= cell.nbytes
+        self._retired.append((self.version + 1, cell))
+
+    # Close retired cells once no scene's world can still reference them
+    def _collect(self):
+        oldest = min(self._views.values(), default=self.version)
+        keep = []
+        for version, cell in self._retired:
+            if version <= oldest:
+                cell.close()
+            else:
+                keep.append((version, cell))
+        self._retired = keep
+
+    def _close_cells(self):
+        if self.instances is not None:
+            lib.ospRelease(self.instances)
+            self.instances = None
+
+        for _, cell in self._retired:
+            cell.close()
+        for cell in self.resident.values():
+            cell.close()
+        self._retired = []
+        self.resident.clear()
+        self.resident_bytes = 0
+
+    @property
+    def buildings(self) -> list[Building]:
+        return [
+            building
+            for cell in self.resident.values()
+            for building in cell.buildings
+        ]
+
+    def _current_states(self) -> list[State]:
+        with self._lock:
+            return list(self.states.values())
+
+    # Spatial queries over the bounds of every building in the city, resident
+    # or not. They return (state, building name) pairs.
+    def query_box(self, lo, hi) -> list[tuple[str, str]]:
+        return [
+            (state.name, state.names[i])
+            for state in self._current_states()
+            for i in state.spatial.box(lo, hi)
+        ]
+
+    # Buildings that may be visible from `request`'s camera
+    def query_frustum(self, request: model.RenderingRequest, *, fovy: float=60.0) -> list[tuple[str, str]]:
+        planes = sunrise.spatial.frustum_planes(
+            request.position,
+            request.direction,
+            request.up,
+            fovy=fovy,
+            aspect=request.width / request.height,
+        )
+        return [
+            (state.name, state.names[i])
+            for state in self._current_states()
+            for i in state.spatial.frustum(planes)
+        ]
+
+    # Buildings whose bounds the ray passes through, nearest first
+    def query_ray(self, origin, direction, *, tmax: float=math.inf) -> list[tuple[str, str]]:
+        found = sorted(
+            (t, state.name, state.names[i])
+            for state in self._current_states()
+            for t, i in state.spatial.ray(origin, direction, tmax=tmax, keys=True)
+        )
+        return [(state, name) for _, state, name in found]
+
+    def query_nearest(self, point, k: int=1) -> list[tuple[str, str]]:
+        found = sorted(
+            (d2, state.name, state.names[i])
+            for state in self._current_states()
+            for d2, i in state.spatial.nearest(point, k, keys=True)
+        )
+        return [(state, name) for _, state, name in found[:k]]
+
+    # Extents of what the city can show: the earth (with the sphere around
+    # it) and each state's buildings, resident or not. All were computed as
+    # the earth was made and the states indexed.
+    def bounds(self) -> dict:
+        def box(lo, hi) -> dict:
+            return dict(lower=np.asarray(lo).tolist(), upper=np.asarray(hi).tolist())
+
+        states = {
+            name: dict(**box(state.lo, state.hi), buildings=len(state.names))
+            for name, state in dict(self.states).items()
+            if state.lo is not None
+        }
+
+        lo = np.min([self.earth.lo, *(state['lower'] for state in states.values())], axis=0)
+        hi = np.max([self.earth.hi, *(state['upper'] for state in states.values())], axis=0)
+        return dict(
+            city=box(lo, hi),
+            earth=dict(
+                **box(self.earth.lo, self.earth.hi),
+                center=np.asarray(self.earth.center).tolist(),
+                radius=self.earth.radius,
+            ),
+            states=states,
+        )
+
+    # Whether anything the city can show may be inside the frustum `planes`
+    # (see sunrise.spatial.frustum_planes). The earth is tested as its
+    # sphere; a state as the box around its buildings, then its cells.
+    def in_view(self, planes: np.ndarray) -> bool:
+        if sunrise.spatial.spheres_in_frustum(self.earth.center, self.earth.radius, planes).any():
+            return True
+
+        for state in dict(self.states).values():
+            if state.lo is None:
+                continue
+            if not sunrise.spatial.boxes_in_frustum(state.lo, state.hi, planes).any():
+                continue
+            if sunrise.spatial.boxes_in_frustum(state.cell_lo, state.cell_hi, planes).any():
+                return True
+        return False
+
+    # The (state, name) of the building behind each instance handle, or None
+    # for the earth and for handles no longer in the city. Retired cells are
+    # searched too, since a scene may still be looking at them.
+    def locate(self, addresses: typing.Sequence[int]) -> list[tuple[str, str] | None]:
+        found = [None] * len(addresses)
+        with self._lock:
+            cells = [*self.resident.values(), *(cell for _, cell in self._retired)]
+            if not cells or not any(addresses):
+                return found
+
+            handles = np.concatenate([cell.handles.array for cell in cells])
+            owners = np.repeat(np.arange(len(cells)), [len(cell.handles) for cell in cells])
+            starts = np.cumsum([0, *(len(cell.handles) for cell in cells)])
+
+            for j, address in enumerate(addresses):
+                if not address:
+                    continue
+                i = np.flatnonzero(handles == address)
+                if len(i) == 0:
+                    continue
+                cell = cells[owners[i[0]]]
+                found[j] = (cell.key[0], cell.buildings[i[0] - starts[owners[i[0]]]].name)
+
+        return found
+
+    # What the city holds, per state and for the earth, with how much of the
+    # files behind it is in the page cache. Retired cells still hold their
+    # meshes until every scene has moved on, so they are counted too.
+    def memory(self) -> dict:
+        with self._lock:
+            cells = [*self.resident.values(), *(cell for _, cell in self._retired)]
+            names = list(self.states)
+        prototypes = self.prototypes.usage()
+
+        states = {}
+        for name in names:
+            buildings = sunrise.memory.Usage()
+            for cell in cells:
+                if cell.key[0] == name:
+                    buildings = buildings + cell.total_usage()
+
+            shared = prototypes.get(name, sunrise.memory.Usage())
+            states[name] = dict(
+                cells=sum(1 for cell in cells if cell.key[0] == name),
+                buildings=buildings.asdict(),
+                prototypes=shared.asdict(),
+                page_cache=sunrise.memory.page_cache(buildings.files | shared.files),
+            )
+
+        earth = self.earth.total_usage()
+        return dict(
+            states=states,
+            earth=dict(
+                **earth.asdict(),
+                page_cache=sunrise.memory.page_cache(earth.files),
+            ),
+            instances=dict(copied=self.instances_copied),
+        )
+
+    def stats(self) -> dict:
+        # A copy, since the admin API may add or remove a state meanwhile
+        states = dict(self.states)
+        return dict(
+            states={name: state.stats() for name, state in states.items()},
+            cells=sum(len(state.cells) for state in states.values()),
+            resident_cells=len(self.resident),
+            resident_bytes=self.resident_bytes,
+            memory_bytes=self.memory_bytes,
+            paging_cells=len(self._paging),
+            reserved_bytes=self.reserved_bytes,
+            retired_cells=len(self._retired),
+            page_ins=self.page_ins,
+            evictions=self.evictions,
+            lods={
+                lod: sum(1 for cell in self.resident.values() if cell.lod == lod)
+                for lod in sunrise.lod.LEVELS
+            },
+            **self.prototypes.stats(),
+        )
 
 
 class Colormap(WithExitStackMixin):
@@ -634,22 +1686,22 @@ class Colormap(WithExitStackMixin):
         data = Read(data, dtype=[ ('r', 'f4'), ('g', 'f4'), ('b', 'f4') ])
         self.hold(data)
         data = Data(data, type=lib.OSP_VEC3F, share=True)
-        self.defer(lib.ospRelease, data)
+        self.own(data, lib.OSP_DATA)
 
         texture = lib.ospNewTexture(b'texture2d')
-        self.defer(lib.ospRelease, texture)
+        self.own(texture, lib.OSP_TEXTURE)
         lib.ospSetObject(texture, b'data', data)
         lib.ospSetUInt(texture, b'format', lib.OSP_TEXTURE_RGB32F)
         lib.ospCommit(texture)
 
         material = lib.ospNewMaterial(b'obj')
-        self.defer(lib.ospRelease, material)
+        self.own(material, lib.OSP_MATERIAL)
         lib.ospSetObject(material, b'map_kd', texture)
         lib.ospSetFloat(material, b'ns', 1.0)
         lib.ospCommit(material)
 
         self.material = material
-        self.defer(lib.ospRelease, material)
+        self.own(material, lib.OSP_MATERIAL)
         lib.ospSetObject(material, b'map_kd', texture)
         lib.ospSetFloat(material, b'ns', 1.0)
         lib.ospCommit(material)
@@ -663,7 +1715,7 @@ class Ambient(WithExitStackMixin):
     
     def make(self):
         light = lib.ospNewLight(b'ambient')
-        self.defer(lib.ospRelease, light)
+        self.own(light, lib.OSP_LIGHT)
         lib.ospSetFloat(light, b'intensity', 0.15)
         lib.ospSetInt(light, b'intensityQuantity', 6)
         lib.ospSetVec3f(light, b'color', 1.0, 0.8, 0.4)
@@ -672,12 +1724,12 @@ class Ambient(WithExitStackMixin):
         self.light = light
 
         # group = lib.ospNewGroup()
-        # self.defer(lib.ospRelease, group)
+        # self.own(group, lib.OSP_GROUP)
         # lib.ospSetObjectAsData(group, b'light', lib.OSP_LIGHT, light)
         # lib.ospCommit(group)
 
         # instance = lib.ospNewInstance(None)
-        # self.defer(lib.ospRelease, instance)
+        # self.own(instance, lib.OSP_INSTANCE)
         # lib.ospSetObject(instance, b'group', group)
         # lib.ospCommit(instance)
 
@@ -690,7 +1742,7 @@ class Point(WithExitStackMixin):
 
     def make(self):
         light = lib.ospNewLight(b'sphere')
-        self.defer(lib.ospRelease, light)
+        self.own(light, lib.OSP_LIGHT)
         lib.ospSetFloat(light, b'intensity', 0.5)
         lib.ospSetInt(light, b'intensityQuantity', 1)
         lib.ospSetVec3f(light, b'direction', 0.0, 0.0, 0.0)
@@ -702,12 +1754,12 @@ class Point(WithExitStackMixin):
         self.light = light
 
         # group = lib.ospNewGroup()
-        # self.defer(lib.ospRelease, group)
+        # self.own(group, lib.OSP_GROUP)
         # lib.ospSetObjectAsData(group, b'light', lib.OSP_LIGHT, light)
         # lib.ospCommit(group)
 
         # instance = lib.ospNewInstance(None)
-        # self.defer(lib.ospRelease, instance)
+        # self.own(instance, lib.OSP_INSTANCE)
         # lib.ospSetObject(instance, b'group', group)
         # lib.ospCommit(instance)
 
@@ -720,7 +1772,7 @@ class Distant(WithExitStackMixin):
 
     def make(self):
         light = lib.ospNewLight(b'distant')
-        self.defer(lib.ospRelease, light)
+        self.own(light, lib.OSP_LIGHT)
         lib.ospSetFloat(light, b'intensity', 0.75)
         lib.ospSetInt(light, b'intensityQuantity', 13)
         lib.ospSetVec3f(light, b'direction', 0.0, 1.0, 1.0)
@@ -729,12 +1781,12 @@ class Distant(WithExitStackMixin):
         self.light = light
 
         # group = lib.ospNewGroup()
-        # self.defer(lib.ospRelease, group)
+        # self.own(group, lib.OSP_GROUP)
         # lib.ospSetObjectAsData(group, b'light', lib.OSP_LIGHT, light)
         # lib.ospCommit(group)
 
         # instance = lib.ospNewInstance(None)
-        # self.defer(lib.ospRelease, instance)
+        # self.own(instance, lib.OSP_INSTANCE)
         # lib.ospSetObject(instance, b'group', group)
         # lib.ospCommit(instance)
 
@@ -757,7 +1809,7 @@ class Sunlight(WithExitStackMixin):
         position = sunrise.model.position_from_location(location)
 
         light = lib.ospNewLight(self.light_type.encode())
-        self.defer(lib.ospRelease, light)
+        self.own(light, lib.OSP_LIGHT)
         lib.ospSetInt(light, b'intensityQuantity', 1)
         lib.ospSetVec3f(light, b'color', 1.0, 0.8, 0.4)
         
@@ -780,12 +1832,12 @@ class Sunlight(WithExitStackMixin):
         self.light = light
 
         # group = lib.ospNewGroup()
-        # self.defer(lib.ospRelease, group)
+        # self.own(group, lib.OSP_GROUP)
         # lib.ospSetObjectAsData(group, b'light', lib.OSP_LIGHT, light)
         # lib.ospCommit(group)
 
         # instance = lib.ospNewInstance(None)
-        # self.defer(lib.ospRelease, instance)
+        # self.own(instance, lib.OSP_INSTANCE)
         # lib.ospSetObject(instance, b'group', group)
         # lib.ospCommit(instance)
 
@@ -827,13 +1879,13 @@ class HDRI(WithExitStackMixin):
         data = self.data()
         
         texture = lib.ospNewTexture(b'texture2d')
-        self.defer(lib.ospRelease, texture)
+        self.own(texture, lib.OSP_TEXTURE)
         lib.ospSetObject(texture, b'data', data)
         lib.ospSetUInt(texture, b'format', lib.OSP_TEXTURE_RGB32F)
         lib.ospCommit(texture)
 
         light = lib.ospNewLight(b'hdri')
-        self.defer(lib.ospRelease, light)
+        self.own(light, lib.OSP_LIGHT)
         # lib.ospSetInt(light, b'intensityQuantity', 1)
         # lib.ospSetVec3f(light, b'color', 1.0, 0.8, 0.4)
         # lib.ospSetVec3f(light, b'color', 1.0, 1.0, 1.0)
@@ -851,11 +1903,409 @@ class HDRI(WithExitStackMixin):
         data = Read(data, dtype=[ ('r', 'f4'), ('g', 'f4'), ('b', 'f4') ])
         self.hold(data)
         data = Data(data, type=lib.OSP_VEC3F, share=True)
-        self.defer(lib.ospRelease, data)
+        self.own(data, lib.OSP_DATA)
         return data
 
 
+# Approximate bytes per pixel held by OSPRay for each framebuffer format and
+# channel. Only used to keep the framebuffer pool under its memory cap.
+_FB_FORMAT_BYTES = {
+    0: 0,  # OSP_FB_NONE
+    1: 4,  # OSP_FB_RGBA8
+    2: 4,  # OSP_FB_SRGBA
+    3: 16,  # OSP_FB_RGBA32F
+}
+
+_FB_CHANNEL_BYTES = {
+    1 << 1: 4,  # OSP_FB_DEPTH
+    1 << 2: 16,  # OSP_FB_ACCUM
+    1 << 3: 16,  # OSP_FB_VARIANCE
+    1 << 4: 12,  # OSP_FB_NORMAL
+    1 << 5: 12,  # OSP_FB_ALBEDO
+    1 << 6: 4,  # OSP_FB_ID_PRIMITIVE
+    1 << 7: 4,  # OSP_FB_ID_OBJECT
+    1 << 8: 4,  # OSP_FB_ID_INSTANCE
+}
+
+
+class FrameBufferKey(typing.NamedTuple):
+    width: int
+    height: int
+    format: int
+    channels: int
+    imageops: int  # address of the image operation OSPData, 0 for none
+
+    def nbytes(self) -> int:
+        per_pixel = _FB_FORMAT_BYTES.get(self.format, 16)
+        for channel, size in _FB_CHANNEL_BYTES.items():
+            if self.channels & channel:
+                per_pixel += size
+        return self.width * self.height * per_pixel
+
+
+# Idle framebuffers kept around for reuse, keyed by size and format. Sizes are
+# evicted least-recently-used first once the idle buffers exceed `max_bytes`.
+class FrameBufferPool:
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, *, max_bytes: int=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.busy_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._idle: collections.OrderedDict[FrameBufferKey, list[lib.OSPFrameBuffer]] = collections.OrderedDict()
+        self._lock = auto.threading.Lock()
+
+    # Get a committed framebuffer for `key`, creating one on a miss
+    def acquire(
+        self,
+        width: int,
+        height: int,
+        format: int,
+        channels: int,
+        imageops: lib.OSPData | None=None,
+    ) -> tuple[FrameBufferKey, lib.OSPFrameBuffer]:
+        key = FrameBufferKey(
+            width=width,
+            height=height,
+            format=format,
+            channels=channels,
+            imageops=Address(imageops),
+        )
+
+        with self._lock:
+            self.busy_bytes += key.nbytes()
+            idle = self._idle.get(key)
+            if idle:
+                framebuffer = idle.pop()
+                if not idle:
+                    del self._idle[key]
+                self.nbytes -= key.nbytes()
+                self.hits += 1
+            else:
+                framebuffer = None
+                self.misses += 1
+
+        if framebuffer is not None:
+            if channels & lib.OSP_FB_ACCUM:
+                lib.ospResetAccumulation(framebuffer)
+            return key, framebuffer
+
+        framebuffer = lib.ospNewFrameBuffer(width, height, format, channels)
+        if imageops is not None:
+            lib.ospSetObject(framebuffer, b'imageOperation', imageops)
+        lib.ospCommit(framebuffer)
+        return key, framebuffer
+
+    # Return a framebuffer to the pool once the caller is done reading it
+    def release(self, key: FrameBufferKey, framebuffer: lib.OSPFrameBuffer):
+        evicted = []
+        with self._lock:
+            self.busy_bytes -= key.nbytes()
+            self._idle.setdefault(key, []).append(framebuffer)
+            self._idle.move_to_end(key)
+            self.nbytes += key.nbytes()
+
+            while self.nbytes > self.max_bytes and self._idle:
+                old_key, old = next(iter(self._idle.items()))
+                evicted.append(old.pop(0))
+                if not old:
+                    del self._idle[old_key]
+                self.nbytes -= old_key.nbytes()
+                self.evictions += 1
+
+        for framebuffer in evicted:
+            lib.ospRelease(framebuffer)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, collections.OrderedDict()
+            self.nbytes = 0
+
+        for framebuffers in idle.values():
+            for framebuffer in framebuffers:
+                lib.ospRelease(framebuffer)
+
+    def stats(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            idle_bytes=self.nbytes,
+            busy_bytes=self.busy_bytes,
+        )
+
+
+# What a set of scene lights depends on. The sky "up" vector only changes how
+# the sunSky light is oriented, so it is normalised and bucketed to
+# SKY_BUCKET so that nearby cameras share a light set.
+class LightKey(typing.NamedTuple):
+    hour: float
+    light_type: str
+    sky: tuple[float, float, float]
+
+    SKY_BUCKET = 0.01
+
+    @classmethod
+    def of(cls, *, hour: float, light_type: str, sky: tuple[float, float, float]) -> LightKey:
+        norm = math.sqrt(sum(x * x for x in sky)) or 1.0
+        sky = tuple(
+            round(x / norm / cls.SKY_BUCKET) * cls.SKY_BUCKET
+            for x in sky
+        )
+        return cls(hour=hour, light_type=light_type, sky=sky)
+
+
+# The sun for one LightKey plus the scene's fixed ambient and HDRI lights,
+# committed and packed into the OSPData a world expects
+class LightSet(WithExitStackMixin):
+    def __init__(self, *, key: LightKey, ambient: Ambient, hdri: HDRI):
+        super().__init__()
+
+        self.key = key
+        self.ambient = ambient
+        self.hdri = hdri
+
+    def make(self):
+        now = (
+            datetime.datetime(year=2023, month=6, day=1, hour=0, tzinfo=datetime.timezone(
+                offset=datetime.timedelta(hours=0),  # Eastern Time
+                # offset=datetime.timedelta(hours=-5),  # Eastern Time
+                name='EST'
+            ))
+            + 
+            datetime.timedelta(hours=self.key.hour)
+            # datetime.timedelta(hours=-15)
+        )
+
+        sunlight = self.enter(Sunlight(
+            now=now,
+            light_type=self.key.light_type,
+            intensity=3.0,
+            # intensity=0.014,
+            sky=self.key.sky,
+        ))
+
+        distant = self.enter(Sunlight(
+            now=now,
+            light_type='distant',
+            intensity=4.0,
+        ))
+
+        lights = Data([
+            self.ambient.light,
+            distant.light,
+            # point.light,
+            sunlight.light,
+            self.hdri.light,
+        ], type=lib.OSP_LIGHT)
+        self.own(lights, lib.OSP_DATA)
+
+        self.sunlight = sunlight
+        self.distant = distant
+        self.lights = lights
+
+
+# Committed light sets keyed by LightKey, least-recently-used first out. An
+# evicted set releases its lights; a world still using them keeps its own
+# reference inside OSPRay.
+class LightCache:
+    DEFAULT_MAX_ENTRIES = 16
+
+    def __init__(self, *, max_entries: int=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._sets: collections.OrderedDict[LightKey, LightSet] = collections.OrderedDict()
+
+    def get(self, key: LightKey, make: typing.Callable[[LightKey], LightSet]) -> LightSet:
+        light_set = self._sets.get(key)
+        if light_set is not None:
+            self._sets.move_to_end(key)
+            self.hits += 1
+            return light_set
+
+        self.misses += 1
+        light_set = make(key)
+        self._sets[key] = light_set
+
+        # The set being returned is never evicted, even with no room at all
+        while len(self._sets) > self.max_entries and next(iter(self._sets)) != key:
+            _, evicted = self._sets.popitem(last=False)
+            evicted.close()
+
+        return light_set
+
+    def close(self):
+        sets, self._sets = self._sets, collections.OrderedDict()
+        for light_set in sets.values():
+            light_set.close()
+
+    def usage(self) -> sunrise.memory.Usage:
+        usage = sunrise.memory.Usage()
+        for light_set in list(self._sets.values()):
+            usage = usage + light_set.total_usage()
+        return usage
+
+    def stats(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            entries=len(self._sets),
+        )
+
+
+# Pixels rendered around every requested image and cropped away afterwards
+GHOST = 16
+
+
+# Set a camera's position, orientation and aspect ratio from a request
+def PointCamera(camera: lib.OSPCamera, request: model.RenderingRequest, /):
+    lib.ospSetFloat(camera, b'aspect', request.width / request.height)
+    lib.ospSetVec3f(camera, b'position', *(
+        request.position
+        # -1700.0, -1400.0, -700.0
+    ))
+    lib.ospSetVec3f(camera, b'up', *(
+        request.up
+        # 0.0, 1.0, 0.0,  # y+ up
+    ))
+    lib.ospSetVec3f(camera, b'direction', *(
+        request.direction
+        # -camx, -camy, -camz,
+    ))
+
+
+# The window between `start` and `end` of the image widened by GHOST pixels
+# on every side of a width x height framebuffer
+def GhostWindow(
+    start: tuple[float, float],
+    end: tuple[float, float],
+    width: int,
+    height: int,
+    /,
+) -> tuple[tuple[float, float], tuple[float, float]]:
+    (img_start_x, img_start_y), (img_end_x, img_end_y) = start, end
+
+    dx = (img_end_x - img_start_x) / width
+    dy = (img_end_y - img_start_y) / height
+
+    return (
+        (img_start_x - GHOST * dx, img_start_y - GHOST * dy),
+        (img_end_x + GHOST * dx, img_end_y + GHOST * dy),
+    )
+
+
+# Restrict a camera to the window between `start` and `end` of the image,
+# widened by GHOST pixels on every side of a width x height framebuffer
+def SetImageWindow(
+    camera: lib.OSPCamera,
+    start: tuple[float, float],
+    end: tuple[float, float],
+    width: int,
+    height: int,
+    /,
+):
+    (img_start_x, img_start_y), (img_end_x, img_end_y) = GhostWindow(start, end, width, height)
+
+    lib.ospSetVec2f(camera, b'imageStart', *(
+        img_start_x, img_start_y
+        # 1.0, 0.0,  # flip x
+        # 0.0, 1.0,  # flip y
+    ))
+    lib.ospSetVec2f(camera, b'imageEnd', *(
+        img_end_x, img_end_y
+        # 0.0, 1.0  # flip x
+        # 1.0, 0.0,  # flip y
+    ))
+
+
+# Split a "RofN,CofM" tile into its window of the image
+def TileWindow(tile: tuple[str, str], /) -> tuple[tuple[float, float], tuple[float, float]]:
+    row, col = tile
+
+    col_id, num_x_bins = map(int, col.split('of'))
+    row_id, num_y_bins = map(int, row.split('of'))
+
+    return (
+        (col_id / num_x_bins, row_id / num_y_bins),
+        ((1+col_id) / num_x_bins, (1+row_id) / num_y_bins),
+    )
+
+
+# The colour channel of a mapped, GHOST-bordered framebuffer, wrapped as a
+# NumPy array without copying. `pixels` is a strided view with the border
+# cropped off; it (and any slice of it) is only valid until `close()`, which
+# unmaps the framebuffer and hands it to `release`.
+class MappedImage:
+    # Images mapped right now across every scene. Encoders wrap the same
+    # memory in PIL images without copying it, so this covers those too.
+    mapped = 0
+    mapped_bytes = 0
+    _lock = auto.threading.Lock()
+
+    def __init__(
+        self,
+        framebuffer: lib.OSPFrameBuffer,
+        width: int,
+        height: int,
+        /,
+        *,
+        release: typing.Callable[[], None] | None=None,
+        passes: int=1,
+    ):
+        self._framebuffer = framebuffer
+        self._release = release
+        self.passes = passes
+        self._rgba = lib.ospMapFrameBuffer(framebuffer, lib.OSP_FB_COLOR)
+
+        full = np.ctypeslib.as_array(
+            ctypes.cast(self._rgba, ctypes.POINTER(ctypes.c_uint8)),
+            shape=(height + 2*GHOST, width + 2*GHOST, 4),
+        )
+        self.pixels = full[GHOST:GHOST+height, GHOST:GHOST+width]
+
+        self._nbytes = full.nbytes
+        with MappedImage._lock:
+            MappedImage.mapped += 1
+            MappedImage.mapped_bytes += self._nbytes
+
+    def close(self):
+        if self._rgba is None:
+            return
+
+        self.pixels = None
+        lib.ospUnmapFrameBuffer(self._rgba, self._framebuffer)
+        self._rgba = None
+        with MappedImage._lock:
+            MappedImage.mapped -= 1
+            MappedImage.mapped_bytes -= self._nbytes
+
+        if self._release is not None:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def stats() -> dict:
+        return dict(
+            mapped=MappedImage.mapped,
+            mapped_bytes=MappedImage.mapped_bytes,
+        )
+
+
 class Scene(WithExitStackMixin):
+    # `what` may be shared between several scenes in a pool, so a Scene never
+    # takes ownership of it. Only the world, camera, renderer, lights and
+    # framebuffers belong to the scene itself.
     def __init__(self, what: City | Park,):
         super().__init__()
 
@@ -877,7 +2327,7 @@ class Scene(WithExitStackMixin):
         ))
 
         hdri = self.enter(HDRI(
-            path=auto.pathlib.Path('data/space/OSPTexture.texture2d.data.vec2f.bin')
+            path=self.what.hdri_path,
         ))
 
         sunlight = self.enter(Sunlight(
@@ -899,13 +2349,13 @@ class Scene(WithExitStackMixin):
         
         denoiser = lib.ospNewImageOperation(b'denoiser')
         lib.ospCommit(denoiser)
-        self.defer(lib.ospRelease, denoiser)
+        self.own(denoiser, lib.OSP_IMAGE_OPERATION)
 
         self.imageops = Data([
             denoiser
         ], type=lib.OSP_IMAGE_OPERATION)
         lib.ospCommit(self.imageops)
-        self.defer(lib.ospRelease, self.imageops)
+        self.own(self.imageops, lib.OSP_DATA)
 
         lights = Data([
             ambient.light,
@@ -914,16 +2364,22 @@ class Scene(WithExitStackMixin):
             sunlight.light,
             hdri.light,
         ], type=lib.OSP_LIGHT)
-        # self.defer(lib.ospRelease, lights)
+        self.own(lights, lib.OSP_DATA)
+
+        # Deferred first, so the city hears of it after the world is gone
+        self.defer(self.what.forget, self)
 
         world = lib.ospNewWorld()
-        self.defer(lib.ospRelease, world)
-        lib.ospSetObject(world, b'instance', self.what.instances)
+        self.own(world, lib.OSP_WORLD)
+        self.world_version, instances = self.what.current()
+        self.world_partial = False
+        lib.ospSetObject(world, b'instance', instances)
         lib.ospSetObject(world, b'light', lights)
         lib.ospSetBool(world, b'dynamicScene', False)
         lib.ospSetBool(world, b'compactMode', True)
         # lib.ospSetBool(world, b'dynamicScene', True)
         lib.ospCommit(world)
+        self.what.committed(self, self.world_version)
 
         renderer = (
             # b'ao'  # does not use lights
@@ -932,7 +2388,7 @@ class Scene(WithExitStackMixin):
             # self.config.renderer.type().encode('utf-8')
         )
         renderer = lib.ospNewRenderer(renderer)
-        self.defer(lib.ospRelease, renderer)
+        self.own(renderer, lib.OSP_RENDERER)
         
         # lib.ospSetInt(renderer, b'pixelSamples', self.config.renderer.samples())
         lib.ospSetInt(renderer, b'pixelSamples', 5)
@@ -944,18 +2400,60 @@ class Scene(WithExitStackMixin):
         ))
         lib.ospCommit(renderer)
 
+        # One sample per pixel, for adaptive passes and for windows that no
+        # geometry is in: there every ray misses and only the background and
+        # visible lights show, which one sample gets right and which need
+        # no denoising
+        pass_renderer = lib.ospNewRenderer(b'scivis')
+        self.own(pass_renderer, lib.OSP_RENDERER)
+        lib.ospSetInt(pass_renderer, b'pixelSamples', 1)
+        lib.ospSetVec4f(pass_renderer, b'backgroundColor', *(
+            0.0, 0.0, 0.0, 1.0, # Black background
+        ))
+        lib.ospCommit(pass_renderer)
+
         camera = (
             # b'orthographic'
             b'perspective'
         )
         camera = lib.ospNewCamera(camera)
-        self.defer(lib.ospRelease, camera)
+        self.own(camera, lib.OSP_CAMERA)
         lib.ospCommit(camera)
 
+        framebuffers = FrameBufferPool(
+            max_bytes=(
+                self.config.renderer.framebuffer_pool_bytes()
+                if self.config else
+                FrameBufferPool.DEFAULT_MAX_BYTES
+            ),
+        )
+        self.defer(framebuffers.close)
+
         self.world = world
         self.renderer = renderer
+        self.pass_renderer = pass_renderer
         self.camera = camera
         self.lights = lights
+        self.framebuffers = framebuffers
+        self.empty_windows = 0
+
+        # Adaptive rendering accumulates passes of `pass_renderer` until the
+        # variance drops to `adaptive_variance`, instead of rendering
+        # pixelSamples at once
+        self.adaptive = bool(self.config.renderer.adaptive()) if self.config else False
+        self.adaptive_variance = self.config.renderer.adaptive_variance() if self.config else 0.02
+        self.adaptive_max_passes = self.config.renderer.adaptive_max_passes() if self.config else 8
+
+        light_sets = LightCache(
+            max_entries=(
+                self.config.renderer.light_cache_size()
+                if self.config else
+                LightCache.DEFAULT_MAX_ENTRIES
+            ),
+        )
+        self.defer(light_sets.close)
+        self.light_sets = light_sets
+        self.light_key = None
 
         self.ambient = ambient
         self.distant = distant
@@ -978,225 +2476,443 @@ class Scene(WithExitStackMixin):
         index_time = time.time_ns() - index_start
         self.logger.info(event='observation_recreation_ns', time=index_time)
 
-    def update_lights(self, hour: int):
+    def update_lights(self, key: LightKey) -> LightSet:
         light_start = time.time_ns()
-        self.sunlight = self.enter(Sunlight(
-            now=(
-                datetime.datetime(year=2023, month=6, day=1, hour=0, tzinfo=datetime.timezone(
-                    offset=datetime.timedelta(hours=0),  # Eastern Time
-                    # offset=datetime.timedelta(hours=-5),  # Eastern Time
-                    name='EST'
-                ))
-                + 
-                datetime.timedelta(hours=hour)
-                # datetime.timedelta(hours=-15)
-            ),
-            light_type=self.request.light,
-            intensity=3.0,
-            # intensity=0.014,
-            sky=self.request.position
-        ))
-
-        
-        self.distant = self.enter(Sunlight(
-            now=(
-                datetime.datetime(year=2023, month=6, day=1, hour=0, tzinfo=datetime.timezone(
-                    offset=datetime.timedelta(hours=0),  # Eastern Time
-                    # offset=datetime.timedelta(hours=6),  # Eastern Time
-                    # offset=datetime.timedelta(hours=-5),  # Eastern Time
-                    name='EST'
-                ))
-                + 
-                datetime.timedelta(hours=hour)
-                # datetime.timedelta(hours=-15)
-            ),
-            light_type='distant',
-            intensity=4.0,
-            # light_type='distant',
-        ))
-
-        lights = Data([
-            self.ambient.light,
-            self.distant.light,
-            # point.light,
-            self.sunlight.light,
-            self.hdri.light,
-        ], type=lib.OSP_LIGHT)
+        lights = LightSet(
+            key=key,
+            ambient=self.ambient,
+            hdri=self.hdri,
+        )
+        lights.make()
         light_time = time.time_ns() - light_start
         self.logger.info(event='light_recreation_ns', time=light_time)
         return lights
 
-    def render(self, request: model.RenderingRequest):
-        render_start = time.time_ns()
+    # What this scene holds on top of the shared city: its world, camera,
+    # renderer and lights (the HDRI texture among them), cached light sets
+    # and framebuffers
+    def memory(self) -> dict:
+        hdri = self.hdri.total_usage()
+        return dict(
+            objects=self.total_usage().asdict(),
+            handles=dict(self.total_handles()),
+            hdri=dict(
+                **hdri.asdict(),
+                page_cache=sunrise.memory.page_cache(hdri.files),
+            ),
+            light_sets=self.light_sets.usage().asdict(),
+            framebuffers=dict(
+                idle_bytes=self.framebuffers.nbytes,
+                busy_bytes=self.framebuffers.busy_bytes,
+            ),
+        )
+
+    # Point the camera and lights at `request`. The camera is left uncommitted
+    # so that the caller can still choose which window of the image to render.
+    def setup(self, request: model.RenderingRequest):
+        self.setup_world(request)
+        self.setup_lights(request)
+        PointCamera(self.camera, request)
+
+    # Page in the part of the city around the camera and re-commit the world
+    # if the set of resident buildings changed since this scene last looked
+    def setup_world(self, request: model.RenderingRequest):
+        version, instances, complete = self.what.page(request.position)
+        self.world_partial = not complete
+        self.commit_world(version, instances)
+
+    # Bring an idle scene's world up to the city's current instance list, so
+    # cells retired since its last frame are not held back by it
+    def refresh(self):
+        if self.what.version != self.world_version:
+            self.commit_world(*self.what.current())
+
+    def commit_world(self, version: int, instances: lib.OSPData):
+        if version == self.world_version:
+            return
+
+        world_start = time.time_ns()
+        lib.ospSetObject(self.world, b'instance', instances)
+        lib.ospCommit(self.world)
+        self.world_version = version
+        self.what.committed(self, version)
+        self.logger.info(event='world_commit_ns', time=time.time_ns() - world_start, version=version)
+
+    # What is under each of `request.points`, without rendering a frame. The
+    # world is paged in for the view just as a render would, and the pick
+    # borrows a framebuffer of the size a render of the view would use.
+    def pick(self, request: model.PickRequest) -> list[model.PickResult]:
+        pick_start = time.time_ns()
+        self.setup_world(request)
+        PointCamera(self.camera, request)
+        SetImageWindow(self.camera, (0.0, 0.0), (1.0, 1.0), request.width, request.height)
+        lib.ospCommit(self.camera)
+
+        fb_key, framebuffer = self.framebuffers.acquire(
+            request.width + 2 * GHOST,
+            request.height + 2 * GHOST,
+            lib.OSP_FB_SRGBA,
+            lib.OSP_FB_COLOR,
+            self.imageops,
+        )
+
+        hits = []
+        try:
+            result = lib.OSPPickResult()
+            for x, y in request.points:
+                lib.ospPick(
+                    ctypes.byref(result),
+                    framebuffer,
+                    self.renderer,
+                    self.camera,
+                    self.world,
+                    (GHOST + x) / (request.width + 2 * GHOST),
+                    (GHOST + y) / (request.height + 2 * GHOST),
+                )
+                if not result.hasHit:
+                    hits.append(None)
+                    continue
+
+                hits.append((tuple(result.worldPosition), Address(result.instance), result.primID))
+                lib.ospRelease(result.instance)
+                lib.ospRelease(result.model)
+        finally:
+            self.framebuffers.release(fb_key, framebuffer)
+
+        owners = self.what.locate([hit[1] if hit is not None else 0 for hit in hits])
+
+        picks = []
+        for (x, y), hit, owner in zip(request.points, hits, owners):
+            if hit is None:
+                picks.append(sunrise.model.PickResult(point=(x, y), hit=False))
+                continue
+
+            position, _, primitive = hit
+            state, building = owner if owner is not None else (None, None)
+            picks.append(sunrise.model.PickResult(
+                point=(x, y),
+                hit=True,
+                position=position,
+                state=state,
+                building=building,
+                primitive=primitive,
+            ))
+
+        self.logger.info(event='pick_ns', time=time.time_ns() - pick_start, points=len(picks))
+        return picks
+
+    def setup_lights(self, request: model.RenderingRequest):
         self.request = request
         world = self.world
-        renderer = self.renderer
-        self.update_camera(request.width, request.height)
-        camera = self.camera
 
         # id = self.request.observation 
         # self.update_observation(id)
         
-        lib.ospRelease(self.lights)
-        # self.lights = self.update_lights(request.hour)
-        self.lights = self.update_lights(29)
+        key = LightKey.of(
+            # hour=request.hour,
+            hour=29,
+            light_type=request.light,
+            sky=request.position,
+        )
+        if key == self.light_key:
+            return
+
+        light_set = self.light_sets.get(key, self.update_lights)
+        self.sunlight = light_set.sunlight
+        self.distant = light_set.distant
+        self.lights = light_set.lights
         lib.ospSetObject(world, b'light', self.lights)
-        lib.ospCommit(self.lights)
-        # self.defer(lib.ospRelease, lights)
         lib.ospCommit(world)
+        self.light_key = key
+
+    # Render the part of the screen between `start` and `end` (image
+    # coordinates in [0, 1]) into a width x height image. A GHOST pixel border
+    # is rendered around the window so the denoiser has context at the edges,
+    # and is cropped away again afterwards.
+    #
+    # An `empty` window (see `in_view`) is rendered at one sample per pixel
+    # without the denoiser. With `max_passes` the window is rendered
+    # adaptively instead: one sample per pixel per pass into an accumulating
+    # framebuffer, until ospGetVariance reaches `adaptive_variance`. The
+    # image records how many passes it took.
+    def render_window(
+        self,
+        start: tuple[float, float],
+        end: tuple[float, float],
+        width: int,
+        height: int,
+        *,
+        empty: bool=False,
+        max_passes: int | None=None,
+    ) -> MappedImage:
+        render_start = time.time_ns()
 
-            
-        # lib.ospSetInt(renderer, b'pixelSamples', samples)
-        # 2of2
-        row, col = request.tile
-        
-        col_id, num_x_bins = map(int, col.split('of'))
-        row_id, num_y_bins = map(int, row.split('of'))
-        # num_x_bins = 2
-        # num_y_bins = 2
-
-        img_start_x, img_end_x = col_id / num_x_bins, (1+col_id) / num_x_bins
-        img_start_y, img_end_y = row_id / num_y_bins, (1+row_id) / num_y_bins
-
-        GHOST = 16
-        dx = (img_end_x - img_start_x) / request.width
-        dy = (img_end_y - img_start_y) / request.height
-
-        img_start_x, img_end_x = img_start_x - GHOST * dx, img_end_x + GHOST * dx
-        img_start_y, img_end_y = img_start_y - GHOST * dy, img_end_y + GHOST * dy
-
-        # px = (col + 0.5) / (2 ** (zoom))
-        # px = 1 - px  # flip x
-        # py = (row + 0.5) / (2 ** (zoom))
-        # py = 1 - py  # flip y
-        # pz = (
-        #     5.0  # looking at peaks
-        #     # -5.0  # looking at valleys
-        # )
-        # height = 1 / (2 ** zoom)
-        # print(f'{px=}, {py=}, {pz=} {height=}')
-
-        lib.ospSetVec2f(camera, b'imageStart', *(
-            img_start_x, img_start_y
-            # 0.0 + (col_id / num_x_bins), 0.0 + (row_id / num_y_bins)
-            # 0.0 + (col / num_x_bins), 0.0 + (row / num_y_bins)
-            # 1.0, 0.0,  # flip x
-            # 0.0, 1.0,  # flip y
-            # 1.0, 1.0,  # flip x and y
-        ))
-        lib.ospSetVec2f(camera, b'imageEnd', *(
-            img_end_x, img_end_y
-            # 0.0 + ((1+col_id) / num_x_bins), 0.0 + ((1+row_id) / num_y_bins)
-            # 0.0 + ((1+col) / num_x_bins), 0.0 + ((1+row) / num_y_bins)
-            # 1.0, 1.0,  # flip none
-            # 0.0, 1.0  # flip x
-            # 1.0, 0.0,  # flip y
-            # 0.0, 0.0,  # flip x and y
-        ))
-#         lib.ospSetFloat(camera, b'height', *(
-#             height,
-#         ))
-        campos = (-88.38224625102681,
-                  35.46709430572086,
-                  10.34000033088)
-        coef = 201.0
-        lib.ospSetVec3f(camera, b'position', *(
-            request.position
-            # camx, camy, camz,
-            # camx, camy, camz,
-            # px + coef, py + coef, pz + coef,
-            # -1700.0, -1400.0, -700.0
-        ))
-        lib.ospSetVec3f(camera, b'up', *(
-            request.up
-            # 0.0, 1.0, 0.0,  # y+ up
-            # 0.0, -1.0, 0.0,  # y- p
-            # 0.0, 0.0, 1.0,
-        ))
-        lib.ospSetVec3f(camera, b'direction', *(
-            request.direction
-            # dx, dy, dz,
-            # -1.0, -1.0, -1.0,
-            # -camx, -camy, -camz,
-            # -camx, -camy, -camz,
-        ))
-        lib.ospCommit(camera)
+        SetImageWindow(self.camera, start, end, width, height)
+        lib.ospCommit(self.camera)
 
-        framebuffer = lib.ospNewFrameBuffer(
-            request.width + 2 * GHOST,
-            request.height + 2 * GHOST,
+        channels = lib.OSP_FB_COLOR
+        if max_passes is not None:
+            channels |= lib.OSP_FB_ACCUM | lib.OSP_FB_VARIANCE
+
+        fb_key, framebuffer = self.framebuffers.acquire(
+            width + 2 * GHOST,
+            height + 2 * GHOST,
             (
                 # lib.OSP_FB_RGBA8
                 lib.OSP_FB_SRGBA
             ),
-            lib.OSP_FB_COLOR,
+            channels,
+            None if empty else self.imageops,
         )
 
-        lib.ospSetObject(framebuffer, b'imageOperation', self.imageops)
-        lib.ospCommit(framebuffer)
-
-        _variance: float = lib.ospRenderFrameBlocking(
-            framebuffer,
-            self.renderer,
-            self.camera,
-            self.world,
-        )
+        passes, variance = 1, None
+        if max_passes is None:
+            _variance: float = lib.ospRenderFrameBlocking(
+                framebuffer,
+                self.pass_renderer if empty else self.renderer,
+                self.camera,
+                self.world,
+            )
+        else:
+            passes, variance = self.accumulate(framebuffer, 1 if empty else max_passes)
 
-        rgba = lib.ospMapFrameBuffer(framebuffer, lib.OSP_FB_COLOR)
         encoding_start = time.time_ns()
-        image = PIL.Image.frombytes(
-            'RGBA',
-            (request.width + 2*GHOST, request.height + 2*GHOST),
-            ctypes.string_at(rgba, size=((request.width + 2*GHOST)* (request.height + 2*GHOST) * 4)),
-            'raw',
-            'RGBA',
-            0,
-            1,
+        image = MappedImage(
+            framebuffer,
+            width,
+            height,
+            release=lambda: self.framebuffers.release(fb_key, framebuffer),
+            passes=passes,
         )
-        w, h = image.size
-        print(f'W: {w}, H: {h}')
-        image.load()
         encoding_time = time.time_ns() - encoding_start
-        self.logger.info(event='encoding_time_ns', time=encoding_time, dimension=[request.width, request.height])
+        self.logger.info(event='encoding_time_ns', time=encoding_time, dimension=[width, height])
 #        cv_img = cv.cvtColor(np.array(image), cv.COLOR_RGB2BGR)
 #        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
 #        sharpened = cv.filter2D(cv_img, -1, kernel)
 #        image = PIL.Image.fromarray(sharpened)
 
-        lib.ospUnmapFrameBuffer(rgba, framebuffer)
+        time_rendering = time.time_ns() - render_start
+        self.logger.info(
+            event='rendering_time_ns',
+            time=time_rendering,
+            dimension=[width, height],
+            empty=empty,
+            passes=passes,
+            variance=variance if variance is not None and math.isfinite(variance) else None,
+            framebuffer_pool=self.framebuffers.stats(),
+            light_cache=self.light_sets.stats(),
+        )
 
-        lib.ospRelease(framebuffer)
+        return image
+
+    # Render passes into an accumulating framebuffer (pooled, so it is reset
+    # first) until the variance is low enough or `max_passes` are done.
+    # Variance is only meaningful once two passes are accumulated.
+    def accumulate(self, framebuffer: lib.OSPFrameBuffer, max_passes: int) -> tuple[int, float]:
+        lib.ospResetAccumulation(framebuffer)
+
+        passes, variance = 0, math.inf
+        while passes < max_passes:
+            lib.ospRenderFrameBlocking(
+                framebuffer,
+                self.pass_renderer,
+                self.camera,
+                self.world,
+            )
+            passes += 1
+            variance = lib.ospGetVariance(framebuffer)
+            if passes > 1 and variance <= self.adaptive_variance:
+                break
 
-        time_rendering = time.time_ns() - render_start
-        self.logger.info(event='rendering_time_ns', time=time_rendering, dimension=[request.width, request.height])
-        image = image.crop((
-            GHOST,
-            GHOST,
-            w - GHOST,
-            h - GHOST,
-        ))
-        w, h = image.size
-        print(f'After Crop: W: {w}, H: {h}')
+        return passes, variance
+
+    # The most passes to spend on `request`: its `samples`, capped by the
+    # configured maximum, or None when rendering at fixed samples
+    def max_passes(self, request: model.RenderingRequest | model.GridRequest) -> int | None:
+        if not self.adaptive:
+            return None
+        return max(1, min(request.samples, self.adaptive_max_passes))
+
+    # Whether the city may show in the window between `start` and `end` of
+    # the view, ghost border included. Conservative: a window is only called
+    # empty when the earth's sphere and every state's cells are outside it.
+    def in_view(
+        self,
+        request: model.RenderingRequest | model.GridRequest,
+        start: tuple[float, float],
+        end: tuple[float, float],
+        width: int,
+        height: int,
+    ) -> bool:
+        planes = sunrise.spatial.frustum_planes(
+            request.position,
+            request.direction,
+            request.up,
+            aspect=request.width / request.height,
+            window=GhostWindow(start, end, width, height),
+        )
+        if self.what.in_view(planes):
+            return True
+
+        self.empty_windows += 1
+        self.logger.info(event='empty_window', position=list(request.position), direction=list(request.direction))
+        return False
+
+    def render(self, request: model.RenderingRequest):
+        self.setup(request)
+
+        # lib.ospSetInt(renderer, b'pixelSamples', samples)
+        start, end = TileWindow(request.tile)
+        image = self.render_window(
+            start,
+            end,
+            request.width,
+            request.height,
+            empty=not self.in_view(request, start, end, request.width, request.height),
+            max_passes=self.max_passes(request),
+        )
 
-        # return server.model.RenderingResponse(
-        #     image=image,
-        # )
-        # #
         return sunrise.model.RenderingResponse(
-            image=image,
+            image=image.pixels,
+            release=image.close,
+            passes=image.passes,
+            partial=self.world_partial,
         )
 
-    def arender(self, request: RenderingRequest, logger) -> auto.asyncio.Future[RenderingResponse]:
-        print("ARENDER")
-        self.logger = logger
-        future = auto.asyncio.Future()
+    # Render a whole rows x cols grid of tiles as one frame, with a ghost
+    # border only around the outside, and slice the requested tiles out of it
+    def render_grid(self, request: model.GridRequest):
+        self.setup(request)
+
+        width, height = request.cols * request.width, request.rows * request.height
+        image = self.render_window(
+            (0.0, 0.0),
+            (1.0, 1.0),
+            width,
+            height,
+            empty=not self.in_view(request, (0.0, 0.0), (1.0, 1.0), width, height),
+            max_passes=self.max_passes(request),
+        )
+
+        images = {}
+        for row_id, col_id in request.tiles:
+            images[row_id, col_id] = image.pixels[
+                row_id * request.height:(1+row_id) * request.height,
+                col_id * request.width:(1+col_id) * request.width,
+            ]
+
+        return sunrise.model.GridResponse(
+            images=images,
+            release=image.close,
+            passes=image.passes,
+            partial=self.world_partial,
+        )
+
+
+# One client's progressively refined view. The session owns its own camera,
+# single-sample renderer and accumulating framebuffer, and borrows the world
+# of whichever pooled scene runs each pass, so passes can land on any worker.
+class ProgressiveSession(WithExitStackMixin):
+    def __init__(self, *, variance: float, max_passes: int):
+        super().__init__()
+
+        self.target_variance = variance
+        self.max_passes = max_passes
 
-        thread = auto.threading.Thread(
-            target=lambda: future.set_result(self.render(request)),
+        self.request = None
+        self.framebuffer = None
+        self.size = None
+        self.passes = 0
+        self.variance = math.inf
+
+    def make(self):
+        renderer = lib.ospNewRenderer(b'scivis')
+        self.own(renderer, lib.OSP_RENDERER)
+        lib.ospSetInt(renderer, b'pixelSamples', 1)
+        lib.ospSetVec4f(renderer, b'backgroundColor', *(
+            0.0, 0.0, 0.0, 1.0, # Black background
+        ))
+        lib.ospCommit(renderer)
+
+        camera = lib.ospNewCamera(b'perspective')
+        self.own(camera, lib.OSP_CAMERA)
+        lib.ospCommit(camera)
+
+        denoiser = lib.ospNewImageOperation(b'denoiser')
+        lib.ospCommit(denoiser)
+        self.own(denoiser, lib.OSP_IMAGE_OPERATION)
+
+        imageops = Data([
+            denoiser
+        ], type=lib.OSP_IMAGE_OPERATION)
+        self.own(imageops, lib.OSP_DATA)
+
+        self.renderer = renderer
+        self.camera = camera
+        self.imageops = imageops
+        self.defer(self._release_framebuffer)
+
+    def _release_framebuffer(self):
+        if self.framebuffer is not None:
+            lib.ospRelease(self.framebuffer)
+            self.framebuffer = None
+            self.size = None
+
+    # Start accumulating from scratch for a new camera
+    def reset(self, request: model.RenderingRequest):
+        size = (request.width + 2 * GHOST, request.height + 2 * GHOST)
+        if size != self.size:
+            self._release_framebuffer()
+            self.framebuffer = lib.ospNewFrameBuffer(
+                *size,
+                lib.OSP_FB_SRGBA,
+                lib.OSP_FB_COLOR | lib.OSP_FB_ACCUM | lib.OSP_FB_VARIANCE,
+            )
+            lib.ospSetObject(self.framebuffer, b'imageOperation', self.imageops)
+            lib.ospCommit(self.framebuffer)
+            self.size = size
+        else:
+            lib.ospResetAccumulation(self.framebuffer)
+
+        PointCamera(self.camera, request)
+        SetImageWindow(self.camera, *TileWindow(request.tile), request.width, request.height)
+        lib.ospCommit(self.camera)
+
+        self.request = request
+        self.passes = 0
+        self.variance = math.inf
+
+    # Whether another pass would still be worth sending
+    @property
+    def done(self) -> bool:
+        if self.passes >= self.max_passes:
+            return True
+
+        # Variance is only meaningful once at least two passes are accumulated
+        return self.passes > 1 and self.variance <= self.target_variance
+
+    # Accumulate one more sample per pixel using `scene`'s world and return
+    # the refined image. The response must be released before the next pass.
+    def render_pass(self, scene: Scene) -> model.RenderingResponse:
+        scene.setup_world(self.request)
+        scene.setup_lights(self.request)
+
+        lib.ospRenderFrameBlocking(
+            self.framebuffer,
+            self.renderer,
+            self.camera,
+            scene.world,
         )
-        thread.start()
+        self.passes += 1
+        self.variance = lib.ospGetVariance(self.framebuffer)
 
-        return future
+        image = MappedImage(self.framebuffer, self.request.width, self.request.height, passes=self.passes)
+        return sunrise.model.RenderingResponse(
+            image=image.pixels,
+            release=image.close,
+            passes=image.passes,
+            partial=scene.world_partial,
+        )
 
 
 def Render(
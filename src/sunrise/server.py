@@ -6,7 +6,12 @@ from __future__ import annotations
 from ._auto import auto
 from . import scene
 from . import model
+from . import executor
+from . import cache
+from . import encode
 from . import config as conf
+from . import snapshot
+from . import memory
 from fastapi.middleware.cors import CORSMiddleware
 import json
 import asyncio
@@ -145,6 +150,60 @@ def get_config():
         con = conf.Config(config)
         return con
 
+# Encoded tiles shared by every request, see sunrise.cache
+@auto.functools.cache
+def get_tile_cache():
+    config = get_config()
+    return cache.TileCache(
+        memory_bytes=config.cache.memory_bytes(),
+        disk_bytes=config.cache.disk_bytes(),
+        path=config.cache.path(),
+    )
+
+# Identical view requests that are in flight at the same time share one render
+@auto.functools.cache
+def get_single_flight():
+    return cache.SingleFlight()
+
+# Encoding happens off the event loop on its own thread pool
+@auto.functools.cache
+def get_encoder_pool():
+    config = get_config()
+    pool = encode.EncoderPool(workers=config.encoder.workers())
+    auto.atexit.register(pool.shutdown)
+    return pool
+
+# Pick the image encoding for a request from a quality profile and optional
+# format/quality overrides
+async def get_encoding(
+    config: auto.typing.Annotated[
+        auto.typing.Any,
+        auto.fastapi.Depends(get_config),
+    ],
+    profile: auto.typing.Annotated[
+        str | None,
+        auto.fastapi.Query(
+            alias='profile',
+        ),
+    ] = None,
+    format: auto.typing.Annotated[
+        str | None,
+        auto.fastapi.Query(
+            alias='format',
+        ),
+    ] = None,
+    quality: auto.typing.Annotated[
+        int | None,
+        auto.fastapi.Query(
+            alias='quality',
+        ),
+    ] = None,
+) -> encode.Encoding:
+    try:
+        return config.encoder.encoding(profile=profile, format=format, quality=quality)
+    except ValueError as e:
+        raise auto.fastapi.HTTPException(status_code=422, detail=str(e))
+
 # Load the species relation matrix 
 # for potential queries
 @auto.functools.cache
@@ -164,13 +223,8 @@ SUNRISE_LIBOSPRAY_PATH = auto.os.environ.get('SUNRISE_LIBOSPRAY_PATH', 'libospra
 SUNRISE_SCENE_PATH = auto.os.environ['SUNRISE_SCENE_PATH']
 
 
-# @auto.functools.cache
-async def get_scene(
-    config: auto.typing.Annotated[
-        auto.typing.Any,
-        auto.fastapi.Depends(get_config),
-    ],
-) -> auto.typing.Generator[scene.Scene, None, None]:
+# Load OSPRay and its modules once per process
+def get_library(config):
     global lib
     try:
         lib
@@ -184,40 +238,108 @@ async def get_scene(
 
 
         auto.atexit.register(lib.ospShutdown)
-    
-    global scenes
+
+    return lib
+
+
+# Open the configured snapshot. A missing or outdated one is not fatal: the
+# city is loaded from `data/` as before.
+def get_snapshot(config) -> snapshot.Snapshot | None:
+    path = config.city.snapshot()
+    if path is None or not snapshot.Snapshot.exists(path):
+        return None
+
     try:
-        scenes
+        return snapshot.Snapshot(path)
+    except (OSError, ValueError) as e:
+        custom_logger.warning(event='snapshot_ignored', path=str(path), error=str(e))
+        return None
+
+
+# Build the scene pool and the render workers that own it. Each worker thread
+# is pinned to one scene for the life of the process.
+async def get_executor(
+    config: auto.typing.Annotated[
+        auto.typing.Any,
+        auto.fastapi.Depends(get_config),
+    ],
+) -> executor.RenderExecutor:
+    get_library(config)
+
+    global render_executor
+    try:
+        render_executor
     except NameError:
-        scenes = auto.asyncio.Queue()
+        start = auto.time.time_ns()
+        scenes = []
+        snapshot_ = get_snapshot(config)
 #        what = scene.Park(
 #            path=auto.pathlib.Path('data'),
 #        )
 #        what.make()
 
-        NUM_THREADS = 1
-        # NUM_THREADS = 6
-        for _ in range(NUM_THREADS):
-            what=scene.City(
-                path=auto.pathlib.Path('data/'),
-            )
-            what.make()
+        # The city geometry is built and committed once; every scene in the
+        # pool only adds its own world, camera, renderer and lights on top.
+        what=scene.City(
+            path=auto.pathlib.Path('data/'),
+            workers=config.city.workers(),
+            states=config.city.states(),
+            cell_size=config.city.cell_size(),
+            radius=config.city.radius(),
+            memory_bytes=config.city.memory_bytes(),
+            lod_distances=config.city.lod_distances(),
+            snapshot=snapshot_,
+        )
+        what.make()
+
+        # Page in and light the snapshot's view on every scene, so the first
+        # request for it does not pay for that
+        warm = snapshot_.request() if snapshot_ is not None else None
+        if warm is not None:
+            warm = model.RenderingRequest(**{
+                key: tuple(value) if isinstance(value, list) else value
+                for key, value in warm.items()
+            })
+
+        for _ in range(config.renderer.pool_size()):
             scene_ = scene.Scene(
                 what=what,
             )
             scene_.configure(config)
             scene_.make()
+            if warm is not None:
+                scene_.logger = custom_logger
+                scene_.setup(warm)
 
-            scenes.put_nowait(scene_)
-    
-    scene_ = None
-    try:
-        scene_ = await scenes.get()
-        yield scene_
+            scenes.append(scene_)
 
-    finally:
-        if scene_ is not None:
-            scenes.put_nowait(scene_)
+        render_executor = executor.RenderExecutor(scenes)
+        render_executor.start()
+        auto.atexit.register(render_executor.shutdown)
+
+        custom_logger.info(
+            event='server_start_ns',
+            time=auto.time.time_ns() - start,
+            snapshot=str(snapshot_.path) if snapshot_ is not None else None,
+        )
+
+    return render_executor
+
+
+# All workers share one City, so any worker's scene has it
+async def get_city(
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+) -> scene.City:
+    return renderer.workers[0].scene.what
+
+
+# Build the scenes before the first request rather than inside it
+@app.on_event('startup')
+async def startup():
+    await get_executor(get_config())
 
 
 @app.get('/')
@@ -245,13 +367,56 @@ async def config(
     )
 
 
+# How tiles are sampled, for cache keys: adaptive rendering settles on
+# different pixels than a fixed sample count
+def sampling(config) -> tuple | None:
+    if not config.renderer.adaptive():
+        return None
+    return (config.renderer.adaptive_variance(), config.renderer.adaptive_max_passes())
+
+
+# Largest image side and sample count a request may ask OSPRay for
+MAX_SIZE = 8192
+MAX_SAMPLES = 1024
+
+
 @app.get('/api/v1/view/')
 async def view(
     *,
 
-    scene: auto.typing.Annotated[
-        scene.Scene,
-        auto.fastapi.Depends(get_scene),
+    config: auto.typing.Annotated[
+        auto.typing.Any,
+        auto.fastapi.Depends(get_config),
+    ],
+
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+
+    tiles: auto.typing.Annotated[
+        cache.TileCache,
+        auto.fastapi.Depends(get_tile_cache),
+    ],
+
+    flights: auto.typing.Annotated[
+        cache.SingleFlight,
+        auto.fastapi.Depends(get_single_flight),
+    ],
+
+    encoders: auto.typing.Annotated[
+        encode.EncoderPool,
+        auto.fastapi.Depends(get_encoder_pool),
+    ],
+
+    encoding: auto.typing.Annotated[
+        encode.Encoding,
+        auto.fastapi.Depends(get_encoding),
     ],
 
     tile: auto.typing.Annotated[
@@ -284,12 +449,16 @@ async def view(
         int,
         auto.fastapi.Query(
             alias='width',
+            ge=1,
+            le=MAX_SIZE,
         ),
     ],
     height: auto.typing.Annotated[
         int | None,
         auto.fastapi.Query(
             alias='height',
+            ge=1,
+            le=MAX_SIZE,
         ),
     ],
 
@@ -297,6 +466,8 @@ async def view(
         int,
         auto.fastapi.Query(
             alias='samples',
+            ge=1,
+            le=MAX_SAMPLES,
         ),
     ],
     
@@ -326,7 +497,7 @@ async def view(
     direction = tuple(map(float, direction.split(',')))
     up = tuple(map(float, up.split(',')))
 
-    response = await scene.arender(model.RenderingRequest(
+    request = model.RenderingRequest(
         width=width,
         height=height,
         tile=tile,
@@ -337,16 +508,705 @@ async def view(
         hour=hour,
         light=light,
         # observation=observation
-    ), custom_logger)
+    )
+
+    key = cache.request_key(request, renderer=config.renderer.type(), encoding=encoding, states=city.state_names(), sampling=sampling(config))
+    cached = tiles.get_memory(key)
+    if cached is None:
+        cached = await auto.asyncio.to_thread(tiles.get, key)
+    if cached is not None:
+        return auto.fastapi.Response(
+            content=cached.content,
+            media_type=cached.media_type,
+            headers=cached.headers,
+        )
+
+    async def render():
+        response = await renderer.render(request, custom_logger)
+        encoded = await encoders.encode(response.image, encoding, custom_logger, release=response.release)
+
+        headers = {
+            **encoded.headers,
+            'X-Sunrise-Passes': str(response.passes),
+        }
+
+        # A partial frame is missing buildings the city had no room for, so
+        # it is served but never cached
+        if response.partial:
+            headers['X-Sunrise-Partial'] = '1'
+        else:
+            await auto.asyncio.to_thread(tiles.put, key, encoded.content, encoded.media_type, headers)
+        return cache.CachedTile(content=encoded.content, media_type=encoded.media_type, headers=headers)
+
+    rendered = await flights.do(key, render)
+
+    return auto.fastapi.Response(
+        content=rendered.content,
+        media_type=rendered.media_type,
+        headers=rendered.headers,
+    )
+
+
+# Build a rendering request from a websocket message with the same fields as
+# the /api/v1/view/ query string. Vectors may be lists or "x,y,z" strings.
+# Anything malformed raises ValueError (or KeyError for a missing field), so
+# the socket can answer with an error frame.
+def rendering_request_from(message: object) -> model.RenderingRequest:
+    if not isinstance(message, dict):
+        raise ValueError(f'Expected a JSON object, got {type(message).__name__}')
+
+    def number(name, value, type=float):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f'{name} must be a number, got {value!r}')
+        value = float(value)
+        if not auto.math.isfinite(value):
+            raise ValueError(f'{name} must be finite, got {value!r}')
+        return type(value)
+
+    def count(name, value, hi):
+        value = number(name, value, int)
+        if not 1 <= value <= hi:
+            raise ValueError(f'{name} must be in [1, {hi}], got {value}')
+        return value
+
+    def vec3(name):
+        value = message[name]
+        if isinstance(value, str):
+            value = value.split(',')
+        if not isinstance(value, (list, tuple)) or len(value) != 3:
+            raise ValueError(f'{name} must be 3 numbers, got {value!r}')
+        return tuple(number(name, x) for x in value)
+
+    tile = message['tile']
+    if isinstance(tile, str):
+        tile = tile.split(',')
+    if not isinstance(tile, (list, tuple)) or len(tile) != 2:
+        raise ValueError(f'tile must be "row,col", got {tile!r}')
+    for part in tile:
+        index, _, bins = str(part).partition('of')
+        if not (index.isdigit() and bins.isdigit() and int(index) < int(bins)):
+            raise ValueError(f'tile must be "NofM,NofM" with N < M, got {tile!r}')
+
+    light = message['light']
+    if not isinstance(light, str):
+        raise ValueError(f'light must be a string, got {light!r}')
+
+    return model.RenderingRequest(
+        width=count('width', message['width'], MAX_SIZE),
+        height=count('height', message['height'], MAX_SIZE),
+        tile=tuple(map(str, tile)),
+        position=vec3('position'),
+        direction=vec3('direction'),
+        up=vec3('up'),
+        samples=count('samples', message.get('samples', 1), MAX_SAMPLES),
+        hour=number('hour', message['hour']),
+        light=light,
+    )
+
+
+# Progressive refinement: the client sends a JSON camera (same fields as
+# /api/v1/view/) and gets back a 1 sample-per-pixel frame straight away,
+# then increasingly refined frames as passes accumulate. Each frame is a JSON
+# text message {"pass", "variance", "final", "media_type"} followed by the
+# encoded image as a binary message. The encoding is picked with optional
+# "profile", "format" and "quality" fields, as for /api/v1/view/. Sending a
+# new camera restarts accumulation; refinement also stops once the variance
+# target or the pass limit is reached.
+#
+# The pass and the encode in flight are awaited through shields, so a client
+# going away does not abandon them; the session's framebuffer is only
+# released once both have finished with it.
+@app.websocket('/api/v1/view/ws')
+async def view_ws(
+    websocket: auto.fastapi.WebSocket,
+):
+    config = get_config()
+    renderer = await get_executor(config)
+    encoders = get_encoder_pool()
+
+    await websocket.accept()
+
+    session = scene.ProgressiveSession(
+        variance=config.renderer.progressive_variance(),
+        max_passes=config.renderer.progressive_max_passes(),
+    )
+    await auto.asyncio.to_thread(session.make)
+
+    # A message parsed as JSON, or the error parsing it raised, which is
+    # answered like any other bad message
+    async def receive_message():
+        text = await websocket.receive_text()
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            return e
+
+    rendering = None
+    encoding_ = None
+    receive = auto.asyncio.ensure_future(receive_message())
+    try:
+        while True:
+            # Idle until the client moves the camera
+            message = await receive
+            receive = auto.asyncio.ensure_future(receive_message())
+
+            pending = True
+            while pending:
+                pending = False
+                try:
+                    if isinstance(message, ValueError):
+                        raise message
+                    request = rendering_request_from(message)
+                    encoding = config.encoder.encoding(
+                        profile=message.get('profile'),
+                        format=message.get('format'),
+                        quality=message.get('quality'),
+                    )
+                except (KeyError, ValueError, TypeError) as e:
+                    await websocket.send_json(dict(error=repr(e)))
+                    break
+                await auto.asyncio.to_thread(session.reset, request)
+                custom_logger.info(event='progressive_start', dimension=[request.width, request.height])
+
+                while True:
+                    rendering = renderer.render_pass(session, custom_logger)
+                    response = await auto.asyncio.shield(rendering)
+                    rendering = None
+
+                    encoding_ = auto.asyncio.ensure_future(
+                        encoders.encode(response.image, encoding, custom_logger, release=response.release),
+                    )
+                    encoded = await auto.asyncio.shield(encoding_)
+                    encoding_ = None
+
+                    await websocket.send_json(dict(
+                        **{'pass': session.passes},
+                        variance=session.variance if auto.math.isfinite(session.variance) else None,
+                        final=session.done,
+                        media_type=encoded.media_type,
+                        **encoded.headers,
+                    ))
+                    await websocket.send_bytes(encoded.content)
+
+                    if receive.done():
+                        message = receive.result()
+                        receive = auto.asyncio.ensure_future(receive_message())
+                        pending = True
+                        break
+
+                    if session.done:
+                        custom_logger.info(
+                            event='progressive_done',
+                            passes=session.passes,
+                            variance=session.variance,
+                        )
+                        break
+
+    except auto.fastapi.WebSocketDisconnect:
+        pass
+
+    finally:
+        receive.cancel()
+        if rendering is not None:
+            response = await settled(rendering)
+            if response is not None:
+                response.release()
+        if encoding_ is not None:
+            await settled(encoding_)
+        await auto.asyncio.to_thread(session.close)
+
+
+# Wait for `future` to finish and return its result, or None if it failed.
+# Shielded, so cancelling the waiter again leaves `future` running rather
+# than abandoning it.
+async def settled(future: auto.asyncio.Future):
+    try:
+        return await auto.asyncio.shield(future)
+    except Exception:
+        return None
+
+
+# Pack encoded tiles into one body: a little-endian header of
+#   b'SRGD', u32 version, u32 count
+# then `count` entries of
+#   u32 row, u32 col, u64 offset, u64 length
+# followed by the tile payloads. Offsets are from the start of the body.
+def pack_tiles(tiles: dict[tuple[int, int], bytes]) -> bytes:
+    header = auto.struct.Struct('<4sII')
+    entry = auto.struct.Struct('<IIQQ')
+
+    offset = header.size + entry.size * len(tiles)
+    parts = [header.pack(b'SRGD', 1, len(tiles))]
+    payloads = []
+    for (row, col), content in sorted(tiles.items()):
+        parts.append(entry.pack(row, col, offset, len(content)))
+        payloads.append(content)
+        offset += len(content)
+
+    return b''.join(parts + payloads)
+
+
+@app.get('/api/v1/grid/')
+async def grid(
+    *,
+
+    config: auto.typing.Annotated[
+        auto.typing.Any,
+        auto.fastapi.Depends(get_config),
+    ],
+
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+
+    tiles: auto.typing.Annotated[
+        cache.TileCache,
+        auto.fastapi.Depends(get_tile_cache),
+    ],
+
+    flights: auto.typing.Annotated[
+        cache.SingleFlight,
+        auto.fastapi.Depends(get_single_flight),
+    ],
+
+    encoders: auto.typing.Annotated[
+        encode.EncoderPool,
+        auto.fastapi.Depends(get_encoder_pool),
+    ],
+
+    encoding: auto.typing.Annotated[
+        encode.Encoding,
+        auto.fastapi.Depends(get_encoding),
+    ],
+
+    rows: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='rows',
+            ge=1,
+        ),
+    ],
+    cols: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='cols',
+            ge=1,
+        ),
+    ],
+    # "row,col;row,col;..." -- defaults to every tile in the grid
+    which: auto.typing.Annotated[
+        str | None,
+        auto.fastapi.Query(
+            alias='tiles',
+        ),
+    ] = None,
+
+    position: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='position',
+        ),
+    ],
+    direction: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='direction',
+        ),
+    ],
+    up: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='up',
+        ),
+    ],
+
+    width: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='width',
+            ge=1,
+            le=MAX_SIZE,
+        ),
+    ],
+    height: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='height',
+            ge=1,
+            le=MAX_SIZE,
+        ),
+    ],
+
+    samples: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='samples',
+            ge=1,
+            le=MAX_SAMPLES,
+        ),
+    ],
     
-    with auto.io.BytesIO() as f:
-        response.image.save(f, 'PNG')
+    hour: auto.typing.Annotated[
+        float,
+        auto.fastapi.Query(
+            alias='hour',
+        ),
+    ],
+    
+    light: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='light',
+        ),
+    ],
+):
+    if which is None:
+        which = tuple(
+            (row, col)
+            for row in range(rows)
+            for col in range(cols)
+        )
+    else:
+        pairs = set()
+        for pair in which.split(';'):
+            try:
+                row, col = map(int, pair.split(','))
+            except ValueError:
+                raise auto.fastapi.HTTPException(
+                    status_code=422,
+                    detail=f'Tile {pair!r} is not "row,col"',
+                ) from None
+            pairs.add((row, col))
+        which = tuple(sorted(pairs))
 
+    for row, col in which:
+        if not (0 <= row < rows and 0 <= col < cols):
+            raise auto.fastapi.HTTPException(
+                status_code=422,
+                detail=f'Tile {row},{col} is outside the {rows}x{cols} grid',
+            )
+
+    position = tuple(map(float, position.split(',')))
+    direction = tuple(map(float, direction.split(',')))
+    up = tuple(map(float, up.split(',')))
+
+    request = model.GridRequest(
+        width=width,
+        height=height,
+        rows=rows,
+        cols=cols,
+        tiles=which,
+        position=position,
+        direction=direction,
+        up=up,
+        samples=samples,
+        hour=hour,
+        light=light,
+    )
+
+    media_type = 'application/x-sunrise-tiles'
+    key = cache.request_key(request, renderer=config.renderer.type(), encoding=encoding, grid=True, states=city.state_names(), sampling=sampling(config))
+    cached = tiles.get_memory(key)
+    if cached is None:
+        cached = await auto.asyncio.to_thread(tiles.get, key)
+    if cached is not None:
         return auto.fastapi.Response(
-            content=f.getvalue(),
-            media_type='image/png',
+            content=cached.content,
+            media_type=cached.media_type,
+            headers=cached.headers,
         )
 
+    async def render():
+        response = await renderer.render_grid(request, custom_logger)
+        encoded = await encoders.encode_many(response.images, encoding, custom_logger, release=response.release)
+
+        content = pack_tiles({
+            where: image.content
+            for where, image in encoded.items()
+        })
+        headers = {
+            'X-Sunrise-Tile-Media-Type': encode.MEDIA_TYPES[encoding.format],
+            'X-Sunrise-Passes': str(response.passes),
+        }
+
+        if response.partial:
+            headers['X-Sunrise-Partial'] = '1'
+        else:
+            await auto.asyncio.to_thread(tiles.put, key, content, media_type, headers)
+        return cache.CachedTile(content=content, media_type=media_type, headers=headers)
+
+    rendered = await flights.do(key, render)
+
+    return auto.fastapi.Response(
+        content=rendered.content,
+        media_type=rendered.media_type,
+        headers=rendered.headers,
+    )
+
+
+# Extents of the loaded city, for clients to place and clip the camera: the
+# earth's box and bounding sphere, and each state's buildings, in the same
+# coordinates as `position` in /api/v1/view/. Computed when the earth was
+# made and the states indexed, so this renders nothing.
+@app.get('/api/v1/bounds')
+async def bounds(
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+):
+    return city.bounds()
+
+
+# Picks per batch request; each one is an ospPick on the worker's thread
+MAX_PICK_POINTS = 1024
+
+
+# Build a pick request from a JSON body with the camera fields of
+# /api/v1/view/ and a list of [x, y] points
+def pick_request_from(message: dict) -> model.PickRequest:
+    def vec3(value):
+        if isinstance(value, str):
+            value = value.split(',')
+        return tuple(map(float, value))
+
+    width, height = int(message['width']), int(message['height'])
+    if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE):
+        raise ValueError(f'Invalid size {width}x{height}')
+
+    points = tuple((float(x), float(y)) for x, y in message['points'])
+    if not 0 < len(points) <= MAX_PICK_POINTS:
+        raise ValueError(f'Expected 1 to {MAX_PICK_POINTS} points, got {len(points)}')
+
+    return model.PickRequest(
+        width=width,
+        height=height,
+        position=vec3(message['position']),
+        direction=vec3(message['direction']),
+        up=vec3(message['up']),
+        points=points,
+    )
+
+
+# The building under one screen point of a view: the camera parameters of
+# /api/v1/view/ plus the pixel `x`, `y`. Runs on a pooled scene without
+# rendering a frame. The result has the hit position, and the state and
+# building names when a building was hit.
+@app.get('/api/v1/pick')
+async def pick(
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+
+    position: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='position',
+        ),
+    ],
+    direction: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='direction',
+        ),
+    ],
+    up: auto.typing.Annotated[
+        str,
+        auto.fastapi.Query(
+            alias='up',
+        ),
+    ],
+
+    width: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='width',
+            ge=1,
+            le=MAX_SIZE,
+        ),
+    ],
+    height: auto.typing.Annotated[
+        int,
+        auto.fastapi.Query(
+            alias='height',
+            ge=1,
+            le=MAX_SIZE,
+        ),
+    ],
+
+    x: auto.typing.Annotated[
+        float,
+        auto.fastapi.Query(
+            alias='x',
+        ),
+    ],
+    y: auto.typing.Annotated[
+        float,
+        auto.fastapi.Query(
+            alias='y',
+        ),
+    ],
+):
+    try:
+        request = pick_request_from(dict(
+            position=position,
+            direction=direction,
+            up=up,
+            width=width,
+            height=height,
+            points=[(x, y)],
+        ))
+    except ValueError as e:
+        raise auto.fastapi.HTTPException(status_code=422, detail=str(e))
+
+    picks = await renderer.pick(request, custom_logger)
+    return auto.dataclasses.asdict(picks[0])
+
+
+# Many screen points of one view in one call, as a JSON body with the fields
+# of /api/v1/pick and `points` instead of `x` and `y`. All points are picked
+# by the same worker, one after the other.
+@app.post('/api/v1/pick/batch')
+async def pick_batch(
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+    body: auto.typing.Annotated[
+        dict,
+        auto.fastapi.Body(),
+    ],
+):
+    try:
+        request = pick_request_from(body)
+    except (KeyError, TypeError, ValueError) as e:
+        raise auto.fastapi.HTTPException(status_code=422, detail=f'Invalid pick request: {e}')
+
+    picks = await renderer.pick(request, custom_logger)
+    return dict(picks=[auto.dataclasses.asdict(pick) for pick in picks])
+
+
+@app.get('/api/debug/executor')
+async def executor_stats(
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+):
+    return renderer.stats()
+
+
+@app.get('/api/debug/city')
+async def city_stats(
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+):
+    return city.stats()
+
+
+# Where the process's memory goes: every scene object's mapped, heap and
+# OSPRay-copied bytes and handles, page cache residency of the files behind
+# them, and the process RSS they add up to. Checking residency touches every
+# mapped file's page table, so it runs off the event loop.
+@app.get('/api/debug/memory')
+async def memory_stats(
+    renderer: auto.typing.Annotated[
+        executor.RenderExecutor,
+        auto.fastapi.Depends(get_executor),
+    ],
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+):
+    def collect():
+        return dict(
+            process=memory.rss(),
+            city=city.memory(),
+            scenes=[worker.scene.memory() for worker in renderer.workers],
+            images=scene.MappedImage.stats(),
+        )
+
+    return await auto.asyncio.to_thread(collect)
+
+
+# State names become directory names, so only plain ones are accepted
+def check_state_name(state: str):
+    if not auto.re.fullmatch(r'[A-Za-z0-9_-]+', state):
+        raise auto.fastapi.HTTPException(status_code=422, detail=f'Invalid state name {state!r}')
+
+
+@app.get('/api/admin/states')
+async def list_states(
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+):
+    return city.stats()['states']
+
+
+# Bring a state into the running city. Only that state's files are read, off
+# the event loop; the scenes pick it up on their next frame.
+@app.post('/api/admin/states/{state}')
+async def add_state(
+    state: str,
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+):
+    check_state_name(state)
+    try:
+        added = await auto.asyncio.to_thread(city.add_state, state)
+    except FileNotFoundError:
+        raise auto.fastapi.HTTPException(status_code=404, detail=f'No buildings for state {state}')
+    return {state: added.stats()}
+
+
+# Take a state out of the running city. Only the instance list is
+# re-committed.
+@app.delete('/api/admin/states/{state}')
+async def remove_state(
+    state: str,
+    city: auto.typing.Annotated[
+        scene.City,
+        auto.fastapi.Depends(get_city),
+    ],
+):
+    check_state_name(state)
+    try:
+        removed = await auto.asyncio.to_thread(city.remove_state, state)
+    except KeyError:
+        raise auto.fastapi.HTTPException(status_code=404, detail=f'State {state} is not loaded')
+    return {state: removed.stats()}
+
+
+@app.get('/api/debug/cache')
+async def cache_stats(
+    tiles: auto.typing.Annotated[
+        cache.TileCache,
+        auto.fastapi.Depends(get_tile_cache),
+    ],
+    flights: auto.typing.Annotated[
+        cache.SingleFlight,
+        auto.fastapi.Depends(get_single_flight),
+    ],
+):
+    return dict(
+        **tiles.stats(),
+        single_flight=flights.stats(),
+    )
+
 
 # Run the fastapi server
 async def run_server():
@@ -0,0 +1,257 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+import sunrise.archive, sunrise.arrayfile, sunrise.lod, sunrise.spatial
+
+import datetime
+import json
+import math
+import os
+import pathlib
+import shutil
+import typing
+
+import numpy as np
+
+
+__all__ = [
+    'SNAPSHOT_VERSION',
+    'CELL_DTYPE',
+    'Snapshot',
+    'write',
+]
+
+
+# Bumped whenever the layout changes. The server ignores a snapshot of any
+# other version and loads from `data/` as before.
+SNAPSHOT_VERSION = 1
+
+# One row per cell; its buildings are members[first:first+count], as rows of
+# the state's archive table
+CELL_DTYPE = np.dtype([
+    ('key', '<i8', (3,)),
+    ('first', '<u8'),
+    ('count', '<u8'),
+])
+
+MANIFEST_FILE = 'manifest.json'
+CELL_FILE = 'cell.table[].bin'
+MEMBER_FILE = 'cell.member.uint[].bin'
+STATES_DIR = 'states'
+EARTH_DIR = 'earth'
+HDRI_FILE = 'hdri/OSPTexture.texture2d.data.vec2f.bin'
+
+sunrise.arrayfile.register(CELL_FILE, CELL_DTYPE)
+
+
+# Hard link `src` into the snapshot so it costs no extra space; `pack`
+# replaces files rather than rewriting them, so the snapshot keeps its copy
+# when the archive is repacked. Falls back to copying across filesystems.
+def _link(src: pathlib.Path, dst: pathlib.Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+# Cell grouping of an archive, as a cell table and a member list
+def _cells(archive: sunrise.archive.Archive, cell_size: float) -> tuple[np.ndarray, np.ndarray]:
+    groups = sunrise.spatial.group_cells(archive.table['lo'], archive.table['hi'], cell_size)
+
+    cells = np.zeros(len(groups), dtype=CELL_DTYPE)
+    if not groups:
+        return cells, np.zeros(0, dtype='<u4')
+
+    cells['key'] = [key for key, _ in groups]
+    cells['count'] = [len(members) for _, members in groups]
+    cells['first'] = np.cumsum(cells['count']) - cells['count']
+    return cells, np.concatenate([members for _, members in groups]).astype('<u4')
+
+
+# Write a snapshot of `states` to `dst`: each state's packed archive (packed
+# now if `python -m sunrise.archive` has not been run for it) with its cell
+# grouping, the earth mesh, the HDRI texture and the view to warm up with.
+# The snapshot is built next to `dst` and swapped in whole.
+def write(
+    data: pathlib.Path,
+    dst: pathlib.Path,
+    states: typing.Iterable[str],
+    /,
+    *,
+    cell_size: float,
+    request: dict | None=None,
+    progress: typing.Callable[[str, int], None] | None=None,
+) -> dict:
+    tmp = dst.with_name(f'{dst.name}.tmp')
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    manifest = dict(
+        version=SNAPSHOT_VERSION,
+        created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        cell_size=cell_size,
+        states={},
+        request=request,
+    )
+
+    for state in states:
+        path = tmp / STATES_DIR / state
+        path.mkdir(parents=True)
+
+        packed = data / 'pack' / state
+        if sunrise.archive.Archive.exists(packed):
+            for file in sunrise.archive.Archive.files(packed):
+                _link(file, path / file.name)
+        else:
+            sunrise.archive.pack(
+                data / 'gen' / state,
+                path,
+                sorted(os.listdir(data / 'pre' / state)),
+                progress=(lambda i, state=state: progress(state, i)) if progress else None,
+            )
+
+        archive = sunrise.archive.Archive(path)
+        if not sunrise.spatial.SpatialIndex.exists(path):
+            archive.spatial.save(path)
+
+        cells, members = _cells(archive, cell_size)
+        sunrise.arrayfile.save(path / CELL_FILE, cells)
+        sunrise.arrayfile.save(path / MEMBER_FILE, members)
+
+        manifest['states'][state] = dict(
+            buildings=len(archive),
+            cells=len(cells),
+            bytes={
+                str(lod): int(archive.nbytes(lod).sum())
+                for lod in sunrise.lod.LEVELS
+                if archive.has_level(lod)
+            },
+        )
+
+    for file in (data / 'Earth').glob('*.bin'):
+        _link(file, tmp / EARTH_DIR / file.name)
+    _link(data / 'space' / pathlib.Path(HDRI_FILE).name, tmp / HDRI_FILE)
+
+    with open(tmp / MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the finished snapshot in, so a server starting meanwhile sees
+    # either the old one or the new one
+    old = dst.with_name(f'{dst.name}.old')
+    if dst.exists():
+        os.replace(dst, old)
+    os.replace(tmp, dst)
+    if old.exists():
+        shutil.rmtree(old)
+
+    return manifest
+
+
+# A snapshot written by `write`. Everything is opened lazily; the archives
+# are memory mapped, so opening a snapshot reads only the small tables.
+class Snapshot:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+        with open(path / MANIFEST_FILE) as f:
+            self.manifest = json.load(f)
+
+        version = self.manifest.get('version')
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'Snapshot {path} has version {version}, expected {SNAPSHOT_VERSION}')
+
+        self.cell_size = float(self.manifest['cell_size'])
+        self.states = list(self.manifest['states'])
+        self.earth_path = path / EARTH_DIR
+        self.hdri_path = path / HDRI_FILE
+
+    @staticmethod
+    def exists(path: pathlib.Path) -> bool:
+        return (path / MANIFEST_FILE).exists()
+
+    # The view the server renders once on every scene before taking requests,
+    # as RenderingRequest fields, or None
+    def request(self) -> dict | None:
+        return self.manifest.get('request')
+
+    def archive(self, state: str) -> sunrise.archive.Archive | None:
+        if state not in self.states:
+            return None
+        return sunrise.archive.Archive(self.path / STATES_DIR / state)
+
+    # The state's cells as (key, archive rows), as sunrise.spatial.group_cells
+    # returns them
+    def cells(self, state: str) -> list[tuple[tuple[int, int, int], np.ndarray]]:
+        path = self.path / STATES_DIR / state
+        cells = sunrise.arrayfile.read(path / CELL_FILE, CELL_DTYPE)
+        members = sunrise.arrayfile.read(path / MEMBER_FILE, '<u4').astype('i8')
+        return [
+            (tuple(key), members[first:first + count])
+            for key, first, count in zip(cells['key'].tolist(), cells['first'].tolist(), cells['count'].tolist())
+        ]
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Write everything the server needs at startup into one snapshot directory',
+    )
+    parser.add_argument('states', nargs='+', help='e.g. AK')
+    parser.add_argument('--data', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('data/snapshot'))
+    parser.add_argument('--cell-size', type=float, default=10.0,
+                        help='km; must match [city] cell_size for the grouping to be used')
+    parser.add_argument('--position', type=lambda s: tuple(float(x) for x in s.split(',')),
+                        default=None, help='camera position x,y,z in km to warm up with')
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--hour', type=float, default=12.0)
+    parser.add_argument('--light', default='distant')
+    args = parser.parse_args()
+
+    # Look straight down at the surface from the warm-up position
+    request = None
+    if args.position is not None:
+        norm = math.sqrt(sum(x * x for x in args.position))
+        request = dict(
+            width=args.width,
+            height=args.height,
+            tile=['0of1', '0of1'],
+            position=list(args.position),
+            direction=[-x / norm for x in args.position],
+            up=[0.0, 0.0, 1.0],
+            samples=1,
+            hour=args.hour,
+            light=args.light,
+        )
+
+    bars = {}
+    def progress(state, i):
+        if state not in bars:
+            bars[state] = auto.tqdm.tqdm(desc=state)
+        bars[state].update(1)
+
+    manifest = write(
+        args.data,
+        args.output,
+        args.states,
+        cell_size=args.cell_size,
+        request=request,
+        progress=progress,
+    )
+    for bar in bars.values():
+        bar.close()
+
+    print(f'Wrote snapshot version {manifest["version"]} to {args.output}')
+    for state, counts in manifest['states'].items():
+        print(f'  {state}: {counts["buildings"]} buildings in {counts["cells"]} cells')
+
+
+if __name__ == '__main__':
+    cli()
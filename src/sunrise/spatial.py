@@ -0,0 +1,364 @@
+"""
+
+"""
+
+from __future__ import annotations
+from ._auto import auto
+import sunrise.arrayfile
+
+import heapq
+import math
+import pathlib
+import typing
+
+import numpy as np
+
+
+__all__ = [
+    'NODE_DTYPE',
+    'SpatialIndex',
+    'boxes_in_frustum',
+    'build',
+    'frustum_planes',
+    'group_cells',
+    'spheres_in_frustum',
+]
+
+
+# One node of a packed BVH, stored depth first. An inner node's left child is
+# the next node and `start` is the index of its right child. A leaf has
+# `count` > 0 and owns items[start:start+count].
+NODE_DTYPE = np.dtype([
+    ('lo', '<f4', (3,)),
+    ('hi', '<f4', (3,)),
+    ('start', '<u4'),
+    ('count', '<u4'),
+])
+
+NODE_FILE = 'bvh.node[].bin'
+ITEM_FILE = 'bvh.item.uint[].bin'
+
+LEAF_SIZE = 4
+
+sunrise.arrayfile.register(NODE_FILE, NODE_DTYPE)
+
+
+# Build a BVH over boxes lo[i]..hi[i] by splitting at the median centroid
+# along the widest axis. Item ids are the row numbers of `lo` and `hi`.
+def build(lo: np.ndarray, hi: np.ndarray, /, *, leaf_size: int=LEAF_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    lo = np.asarray(lo, dtype='f4').reshape(-1, 3)
+    hi = np.asarray(hi, dtype='f4').reshape(-1, 3)
+    centre = (lo + hi) / 2
+
+    items = np.arange(len(lo), dtype='u4')
+    nodes = []
+
+    # (first, last, parent) spans of `items` still to be turned into nodes;
+    # the parent is patched with its right child's index when it is reached
+    stack = [(0, len(items), None)] if len(items) else []
+    while stack:
+        first, last, parent = stack.pop()
+        if parent is not None:
+            nodes[parent][2] = len(nodes)
+
+        span = items[first:last]
+        node = [lo[span].min(axis=0), hi[span].max(axis=0), first, 0]
+        index = len(nodes)
+        nodes.append(node)
+
+        if last - first <= leaf_size:
+            node[3] = last - first
+            continue
+
+        spread = centre[span].max(axis=0) - centre[span].min(axis=0)
+        axis = int(np.argmax(spread))
+        middle = (last - first) // 2
+        order = np.argpartition(centre[span, axis], middle)
+        items[first:last] = span[order]
+
+        # Right first so the left child is popped next and lands at index+1
+        stack.append((first + middle, last, index))
+        stack.append((first, first + middle, None))
+
+    packed = np.zeros(len(nodes), dtype=NODE_DTYPE)
+    if nodes:
+        packed['lo'] = np.array([node[0] for node in nodes])
+        packed['hi'] = np.array([node[1] for node in nodes])
+        packed['start'] = [node[2] for node in nodes]
+        packed['count'] = [node[3] for node in nodes]
+    return packed, items
+
+
+# Group boxes into cubes `cell_size` on a side by the centre of each box.
+# Returns each cell's integer key and the rows of the boxes in it.
+def group_cells(
+    lo: np.ndarray,
+    hi: np.ndarray,
+    cell_size: float,
+    /,
+) -> list[tuple[tuple[int, int, int], np.ndarray]]:
+    lo = np.asarray(lo).reshape(-1, 3)
+    hi = np.asarray(hi).reshape(-1, 3)
+    if len(lo) == 0:
+        return []
+
+    keys = np.floor((lo + hi) / 2 / cell_size).astype('i8')
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1)])
+    return [
+        (tuple(int(k) for k in keys[members[0]]), members)
+        for members in np.split(order, starts[1:])
+    ]
+
+
+# The six inward-facing planes (a, b, c, d with a*x + b*y + c*z + d >= 0
+# inside) of a perspective camera, as OSPRay's perspective camera sets it up.
+# `window` narrows it to part of the image, as the camera's imageStart and
+# imageEnd do.
+def frustum_planes(
+    position: tuple[float, float, float],
+    direction: tuple[float, float, float],
+    up: tuple[float, float, float],
+    /,
+    *,
+    fovy: float=60.0,
+    aspect: float=1.0,
+    near: float=0.0,
+    far: float=math.inf,
+    window: tuple[tuple[float, float], tuple[float, float]]=((0.0, 0.0), (1.0, 1.0)),
+) -> np.ndarray:
+    position = np.asarray(position, dtype='f8')
+    forward = np.asarray(direction, dtype='f8')
+    forward = forward / np.linalg.norm(forward)
+    right = np.cross(forward, np.asarray(up, dtype='f8'))
+    right = right / np.linalg.norm(right)
+    upward = np.cross(right, forward)
+
+    half_h = math.tan(math.radians(fovy) / 2)
+    half_w = half_h * aspect
+
+    # Edges of the window on the image plane one unit in front of the camera
+    (x0, y0), (x1, y1) = window
+    left, right_ = (2 * x0 - 1) * half_w, (2 * x1 - 1) * half_w
+    bottom, top = (2 * y0 - 1) * half_h, (2 * y1 - 1) * half_h
+
+    normals = [
+        forward,
+        np.cross(upward, forward + right * right_),  # right
+        np.cross(forward + right * left, upward),  # left
+        np.cross(forward + upward * top, right),  # top
+        np.cross(right, forward + upward * bottom),  # bottom
+    ]
+    offsets = [-near] + [0.0] * 4
+    if math.isfinite(far):
+        normals.append(-forward)
+        offsets.append(far)
+
+    planes = []
+    for normal, offset in zip(normals, offsets):
+        normal = normal / np.linalg.norm(normal)
+        planes.append((*normal, offset - float(normal @ position)))
+    return np.array(planes)
+
+
+# Which of the boxes lo[i]..hi[i] are at least partly inside every plane.
+# Like SpatialIndex.frustum, a box is only rejected when it is wholly
+# outside one plane, so a few boxes near the corners pass that miss.
+def boxes_in_frustum(lo: np.ndarray, hi: np.ndarray, planes: np.ndarray, /) -> np.ndarray:
+    lo = np.asarray(lo, dtype='f8').reshape(-1, 3)
+    hi = np.asarray(hi, dtype='f8').reshape(-1, 3)
+    planes = np.asarray(planes, dtype='f8')
+
+    # For each plane the box corner furthest along its normal
+    normals = planes[:, :3]
+    corners = np.where(normals[None] >= 0, hi[:, None], lo[:, None])
+    return ((corners * normals[None]).sum(axis=2) + planes[None, :, 3] >= 0).all(axis=1)
+
+
+# Which of the spheres are at least partly inside every plane; planes from
+# frustum_planes are normalised, so this is a signed distance test
+def spheres_in_frustum(center: np.ndarray, radius: np.ndarray, planes: np.ndarray, /) -> np.ndarray:
+    center = np.asarray(center, dtype='f8').reshape(-1, 3)
+    radius = np.asarray(radius, dtype='f8').reshape(-1)
+    planes = np.asarray(planes, dtype='f8')
+
+    distance = center @ planes[:, :3].T + planes[:, 3]
+    return (distance >= -radius[:, None]).all(axis=1)
+
+
+# Queries over a packed BVH. Every query returns item ids (building rows).
+# The node array may be a read-only memmap of a sidecar file. With the item
+# boxes `lo` and `hi` (the archive table has them) leaf items are tested
+# exactly; without them they are reported if their leaf's box matches.
+class SpatialIndex:
+    def __init__(
+        self,
+        nodes: np.ndarray,
+        items: np.ndarray,
+        lo: np.ndarray | None=None,
+        hi: np.ndarray | None=None,
+    ):
+        self.nodes = nodes
+        self.items = items
+
+        # Boxes are tested one at a time as plain floats, which is far cheaper
+        # than a handful of tiny NumPy operations per node
+        self._lo = nodes['lo']
+        self._hi = nodes['hi']
+        self._start = nodes['start'].tolist()
+        self._count = nodes['count'].tolist()
+
+        self._item_lo = lo
+        self._item_hi = hi
+
+    @classmethod
+    def of(cls, lo: np.ndarray, hi: np.ndarray, /) -> SpatialIndex:
+        return cls(*build(lo, hi), lo, hi)
+
+    @staticmethod
+    def exists(path: pathlib.Path) -> bool:
+        return (path / NODE_FILE).exists()
+
+    @classmethod
+    def open(cls, path: pathlib.Path, lo: np.ndarray | None=None, hi: np.ndarray | None=None) -> SpatialIndex:
+        return cls(
+            sunrise.arrayfile.read(path / NODE_FILE, NODE_DTYPE),
+            sunrise.arrayfile.read(path / ITEM_FILE, '<u4'),
+            lo,
+            hi,
+        )
+
+    # Write the index next to an archive, replacing any older one atomically
+    def save(self, path: pathlib.Path):
+        for name, array in ((NODE_FILE, self.nodes), (ITEM_FILE, self.items)):
+            sunrise.arrayfile.save(path / name, np.asarray(array))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _node_box(self, node: int) -> tuple[list[float], list[float]]:
+        return self._lo[node].tolist(), self._hi[node].tolist()
+
+    def _item_box(self, item: int, node: int) -> tuple[list[float], list[float]]:
+        if self._item_lo is None:
+            return self._node_box(node)
+        return self._item_lo[item].tolist(), self._item_hi[item].tolist()
+
+    # Walk the tree depth first. `test(lo, hi)` returns None to reject a box
+    # or a sort key to accept it; accepted items come back as (key, item).
+    def _walk(self, test: typing.Callable[[list[float], list[float]], typing.Any]) -> list[tuple[typing.Any, int]]:
+        found = []
+        stack = [0] if len(self.nodes) else []
+        while stack:
+            node = stack.pop()
+            if test(*self._node_box(node)) is None:
+                continue
+
+            count = self._count[node]
+            if not count:
+                stack.append(self._start[node])
+                stack.append(node + 1)
+                continue
+
+            start = self._start[node]
+            for item in self.items[start:start + count].tolist():
+                key = test(*self._item_box(item, node))
+                if key is not None:
+                    found.append((key, item))
+        return found
+
+    # Items whose boxes overlap lo..hi
+    def box(self, lo, hi) -> list[int]:
+        (x0, y0, z0), (x1, y1, z1) = map(float, lo), map(float, hi)
+
+        def test(box_lo, box_hi):
+            if (
+                box_lo[0] <= x1 and box_lo[1] <= y1 and box_lo[2] <= z1
+                and box_hi[0] >= x0 and box_hi[1] >= y0 and box_hi[2] >= z0
+            ):
+                return 0
+            return None
+
+        return [item for _, item in self._walk(test)]
+
+    # Items whose boxes are at least partly inside every plane, see
+    # frustum_planes
+    def frustum(self, planes: np.ndarray) -> list[int]:
+        planes = np.asarray(planes, dtype='f8').tolist()
+
+        # For each plane test the box corner furthest along its normal
+        def test(box_lo, box_hi):
+            for a, b, c, d in planes:
+                if (
+                    a * (box_hi[0] if a >= 0 else box_lo[0])
+                    + b * (box_hi[1] if b >= 0 else box_lo[1])
+                    + c * (box_hi[2] if c >= 0 else box_lo[2])
+                    + d
+                ) < 0:
+                    return None
+            return 0
+
+        return [item for _, item in self._walk(test)]
+
+    # Items whose boxes the ray enters within tmax, nearest entry first. With
+    # `keys` each comes with its entry distance, as (t, item).
+    def ray(self, origin, direction, *, tmax: float=math.inf, keys: bool=False) -> list:
+        origin = [float(x) for x in origin]
+        direction = [float(x) for x in direction]
+
+        # Slab test, one axis at a time
+        def test(box_lo, box_hi):
+            near, far = 0.0, tmax
+            for o, d, lo, hi in zip(origin, direction, box_lo, box_hi):
+                if d == 0:
+                    if o < lo or o > hi:
+                        return None
+                    continue
+
+                t0, t1 = (lo - o) / d, (hi - o) / d
+                if t0 > t1:
+                    t0, t1 = t1, t0
+                near = max(near, t0)
+                far = min(far, t1)
+                if near > far:
+                    return None
+            return near
+
+        found = sorted(self._walk(test))
+        return found if keys else [item for _, item in found]
+
+    # The k items whose boxes are nearest to `point`, nearest first. With
+    # `keys` each comes with its squared distance, as (d2, item).
+    def nearest(self, point, k: int=1, *, keys: bool=False) -> list:
+        point = [float(x) for x in point]
+
+        def distance(box_lo, box_hi) -> float:
+            total = 0.0
+            for p, lo, hi in zip(point, box_lo, box_hi):
+                if p < lo:
+                    total += (lo - p) ** 2
+                elif p > hi:
+                    total += (p - hi) ** 2
+            return total
+
+        # Entries are (squared distance, is_item, id): nodes and items share
+        # the heap and an item is final once it is the nearest thing left
+        found = []
+        heap = [(distance(*self._node_box(0)), False, 0)] if len(self.nodes) else []
+        while heap and len(found) < k:
+            key, is_item, id = heapq.heappop(heap)
+            if is_item:
+                found.append((key, id) if keys else id)
+                continue
+
+            count = self._count[id]
+            if count:
+                start = self._start[id]
+                for item in self.items[start:start + count].tolist():
+                    heapq.heappush(heap, (distance(*self._item_box(item, id)), True, item))
+            else:
+                for child in (id + 1, self._start[id]):
+                    heapq.heappush(heap, (distance(*self._node_box(child)), False, child))
+
+        return found